@@ -1,434 +1,23 @@
-def create_html_report(input_data, predictions):
-    """Create an HTML report with prediction results"""
-    html_content = f"""
-    <html>
-    <head>
-        <meta charset='UTF-8'>
-        <title>Weather Prediction Report</title>
-        <style>
-            body {{ font-family: 'Segoe UI', Arial, sans-serif; background: #f9f9f9; color: #222; }}
-            .header {{ text-align: center; margin-bottom: 16px; }}
-            .section {{ margin: 24px auto; max-width: 900px; padding: 20px; border: 1px solid #ddd; border-radius: 8px; background: #fff; }}
-            .section h2 {{ color: #1976D2; border-bottom: 2px solid #1976D2; padding-bottom: 5px; margin-top: 0; }}
-            .prediction-grid {{ display: grid; grid-template-columns: repeat(2, 1fr); gap: 20px; margin: 20px 0; }}
-            .prediction-item {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; border-radius: 10px; text-align: center; box-shadow: 0 4px 6px rgba(0,0,0,0.08); }}
-            .prediction-item h3 {{ margin: 0 0 10px 0; font-size: 1.1em; }}
-            .prediction-item .value {{ font-size: 1.8em; font-weight: bold; margin: 10px 0; }}
-            table {{ width: 100%; border-collapse: collapse; margin: 20px 0; }}
-            th, td {{ border: 1px solid #ddd; padding: 10px; text-align: left; }}
-            th {{ background-color: #4CAF50; color: white; font-weight: bold; }}
-            tr:nth-child(even) {{ background-color: #f9f9f9; }}
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <h1>🌤 Weather Prediction Report</h1>
-            <p style='margin:0;'>Designed and Developed by Varshini J</p>
-        </div>
-        <div class="section">
-            <h2>📊 Prediction Results</h2>
-            <div class="prediction-grid">
-                <div class="prediction-item">
-                    <h3>🌧 Rainfall Amount</h3>
-                    <div class="value">{predictions['rainfall']:.2f} mm</div>
-                </div>
-                <div class="prediction-item">
-                    <h3>🌡 Temperature</h3>
-                    <div class="value">{predictions['temperature']:.2f}°C</div>
-                </div>
-                <div class="prediction-item">
-                    <h3>☔ Rain Occurrence</h3>
-                    <div class="value">{predictions['rain_class']}</div>
-                </div>
-                <div class="prediction-item">
-                    <h3>🔥 Temperature Category</h3>
-                    <div class="value">{predictions['temp_class']}</div>
-                </div>
-            </div>
-        </div>
-        <div class="section">
-            <h2>📝 Input Parameters</h2>
-            <table>
-                <thead>
-                    <tr>
-                        <th>Parameter</th>
-                        <th>Value</th>
-                        <th>Description</th>
-                    </tr>
-                </thead>
-                <tbody>
-    """
-    parameter_descriptions = {
-        "latitude": "Degrees North",
-        "longitude": "Degrees East", 
-        "humidity": "Percentage (%)",
-        "wind_kph": "Kilometers per Hour",
-        "cloud": "Percentage (%)",
-        "pressure_mb": "Millibars",
-        "uv_index": "UV Index Scale",
-        "feels_like_celsius": "Degrees Celsius",
-        "air_quality_Carbon_Monoxide": "μg/m³",
-        "air_quality_Ozone": "μg/m³",
-        "air_quality_Nitrogen_dioxide": "μg/m³",
-        "air_quality_Sulphur_dioxide": "μg/m³",
-        "air_quality_PM2.5": "μg/m³",
-        "air_quality_PM10": "μg/m³"
-    }
-    for param, value in input_data.items():
-        description = parameter_descriptions.get(param, "")
-        html_content += f"""
-                    <tr>
-                        <td>{param.replace('_', ' ').title()}</td>
-                        <td>{value:.4f}</td>
-                        <td>{description}</td>
-                    </tr>"""
-    html_content += f"""
-                </tbody>
-            </table>
-        </div>
-    </body>
-    </html>
-    """
-    return html_content
-
 import streamlit as st
-import pandas as pd
-import numpy as np
-import joblib
 import io
-import base64
-import os
-import shutil
-import tempfile
-import subprocess
-from datetime import datetime
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-
-
-def detect_pdf_engine():
-    """Return a short string describing which PDF engine is available on the system."""
-    # Prefer WeasyPrint
-    try:
-        import weasyprint  # type: ignore
-        return 'weasyprint'
-    except Exception:
-        pass
+import time
 
-    # Try pdfkit+wkhtmltopdf
-    try:
-        import pdfkit  # type: ignore
-        wk = shutil.which('wkhtmltopdf')
-        if wk:
-            return f'pdfkit + wkhtmltopdf ({wk})'
-        # check common install locations on Windows
-        candidates = [
-            r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe",
-            r"C:\Program Files (x86)\wkhtmltopdf\bin\wkhtmltopdf.exe",
-        ]
-        for c in candidates:
-            if os.path.exists(c):
-                return f'pdfkit + wkhtmltopdf ({c})'
-        return 'pdfkit (no wkhtmltopdf found)'
-    except Exception:
-        pass
-
-    # Direct wkhtmltopdf
-    wk = shutil.which('wkhtmltopdf')
-    if wk:
-        return f'wkhtmltopdf ({wk})'
-
-    return 'none'
-
-
-def create_pdf_report(input_data, predictions):
-    """Create a PDF report that matches the HTML design exactly"""
-    # Try WeasyPrint first (should work now that it's installed)
-    try:
-        from weasyprint import HTML, CSS  # type: ignore
-        html = create_html_report(input_data, predictions)
-        
-        # Add some CSS tweaks for better PDF rendering
-        css_fixes = CSS(string='''
-            @page { 
-                size: A4; 
-                margin: 0.5in; 
-            }
-            body { 
-                -webkit-print-color-adjust: exact !important;
-                color-adjust: exact !important;
-            }
-            .prediction-item {
-                break-inside: avoid;
-                page-break-inside: avoid;
-            }
-        ''')
-        
-        buffer = io.BytesIO()
-        HTML(string=html).write_pdf(buffer, stylesheets=[css_fixes])
-        buffer.seek(0)
-        return buffer
-    except Exception as e:
-        print(f"WeasyPrint failed: {e}")
-    
-    # Fallback: Create a much better ReportLab version that mimics the HTML closely
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=0.5*inch, bottomMargin=0.5*inch)
-    
-    styles = getSampleStyleSheet()
-    
-    # Better styles that match the HTML design
-    title_style = ParagraphStyle(
-        'TitleStyle', 
-        parent=styles['Title'], 
-        fontSize=24, 
-        spaceAfter=10, 
-        textColor=colors.HexColor('#333'), 
-        alignment=1,
-        fontName='Helvetica-Bold'
-    )
-    
-    subtitle_style = ParagraphStyle(
-        'SubtitleStyle', 
-        parent=styles['Normal'], 
-        fontSize=12, 
-        spaceAfter=20, 
-        textColor=colors.HexColor('#666'), 
-        alignment=1
-    )
-    
-    section_style = ParagraphStyle(
-        'SectionStyle', 
-        parent=styles['Heading2'], 
-        fontSize=16, 
-        spaceAfter=10, 
-        textColor=colors.HexColor('#1976D2'), 
-        leftIndent=0,
-        fontName='Helvetica-Bold'
-    )
-    
-    story = []
-    
-    # Header section
-    story.append(Paragraph("Weather Prediction Report", title_style))
-    story.append(Paragraph("Designed and Developed by Varshini J", subtitle_style))
-    story.append(Spacer(1, 20))
-    
-    # Prediction Results section
-    story.append(Paragraph("Prediction Results", section_style))
-    story.append(Spacer(1, 10))
-    
-    # Create a better-looking prediction grid (replace emojis with text)
-    pred_data = [
-        ["Rainfall Amount", f"{predictions['rainfall']:.2f} mm"],
-        ["Temperature", f"{predictions['temperature']:.2f}°C"],
-        ["Rain Occurrence", predictions['rain_class']],
-        ["Temperature Category", predictions['temp_class']]
-    ]
-    
-    pred_table = Table(pred_data, colWidths=[3*inch, 3*inch])
-    pred_table.setStyle(TableStyle([
-        # Background colors to mimic the gradient
-        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#667eea')),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.white),
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 12),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('GRID', (0, 0), (-1, -1), 2, colors.HexColor('#764ba2')),
-        ('ROWBACKGROUNDS', (0, 0), (-1, -1), [colors.HexColor('#667eea'), colors.HexColor('#764ba2')]),
-        ('LEFTPADDING', (0, 0), (-1, -1), 15),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 15),
-        ('TOPPADDING', (0, 0), (-1, -1), 15),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 15),
-    ]))
-    
-    story.append(pred_table)
-    story.append(Spacer(1, 30))
-    
-    # Input Parameters section
-    story.append(Paragraph("Input Parameters", section_style))
-    story.append(Spacer(1, 10))
-    
-    parameter_descriptions = {
-        "latitude": "Degrees North",
-        "longitude": "Degrees East",
-        "humidity": "Percentage (%)",
-        "wind_kph": "Kilometers per Hour",
-        "cloud": "Percentage (%)",
-        "pressure_mb": "Millibars",
-        "uv_index": "UV Index Scale",
-        "feels_like_celsius": "Degrees Celsius",
-        "air_quality_Carbon_Monoxide": "μg/m³",
-        "air_quality_Ozone": "μg/m³",
-        "air_quality_Nitrogen_dioxide": "μg/m³",
-        "air_quality_Sulphur_dioxide": "μg/m³",
-        "air_quality_PM2.5": "μg/m³",
-        "air_quality_PM10": "μg/m³"
-    }
-    
-    input_data_list = [['Parameter', 'Value', 'Description']]
-    for param, value in input_data.items():
-        description = parameter_descriptions.get(param, "")
-        formatted_param = param.replace('_', ' ').title()
-        input_data_list.append([formatted_param, f"{value:.4f}", description])
-    
-    input_table = Table(input_data_list, colWidths=[2.2*inch, 1.3*inch, 2.5*inch])
-    input_table.setStyle(TableStyle([
-        # Header row styling
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4CAF50')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 11),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('TOPPADDING', (0, 0), (-1, 0), 12),
-        
-        # Data rows styling  
-        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -1), 9),
-        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#ddd')),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('LEFTPADDING', (0, 0), (-1, -1), 8),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 8),
-        ('TOPPADDING', (0, 1), (-1, -1), 6),
-        ('BOTTOMPADDING', (0, 1), (-1, -1), 6),
-        
-        # Alternating row colors
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f9f9f9')]),
-    ]))
-    
-    story.append(input_table)
-    story.append(Spacer(1, 30))
-    
-    # Environmental Awareness section (PDF only)
-    story.append(Paragraph("Environmental Awareness & Air Quality Impact", section_style))
-    story.append(Spacer(1, 10))
-    
-    env_style = ParagraphStyle(
-        'EnvStyle', 
-        parent=styles['Normal'], 
-        fontSize=10, 
-        spaceAfter=8, 
-        textColor=colors.HexColor('#444'), 
-        leftIndent=10,
-        rightIndent=10,
-        alignment=4  # Justify alignment
-    )
-    
-    story.append(Paragraph("<b>Protecting Our Mother Earth:</b> Our planet's atmosphere is under constant threat from various pollutants that not only harm human health but also disrupt ecological balance. The air quality parameters measured in this weather prediction report directly correlate with environmental degradation and public health crises. Understanding these pollutants and their sources empowers us to make informed decisions that can help preserve our planet for future generations.", env_style))
-    story.append(Spacer(1, 12))
-    
-    story.append(Paragraph("<b>Detailed Air Pollutants & Their Environmental Impact:</b>", env_style))
-    story.append(Spacer(1, 8))
-    
-    story.append(Paragraph("• <b>Carbon Monoxide (CO):</b> A colorless, odorless gas primarily produced by vehicle emissions and industrial processes. It reduces the blood's ability to carry oxygen, leading to headaches, dizziness, and fatigue. In the environment, CO contributes to ground-level ozone formation and climate change.", env_style))
-    story.append(Spacer(1, 6))
-    
-    story.append(Paragraph("• <b>Nitrogen Dioxide (NO<sub>2</sub>):</b> A reddish-brown gas from vehicle exhausts and power plants. It irritates airways, triggers asthma attacks, and reduces lung function. Environmentally, NO<sub>2</sub> contributes to acid rain formation, soil acidification, and eutrophication of water bodies, damaging forests and aquatic ecosystems.", env_style))
-    story.append(Spacer(1, 6))
-    
-    story.append(Paragraph("• <b>Sulphur Dioxide (SO<sub>2</sub>):</b> Released mainly from fossil fuel combustion in power plants and industrial facilities. It causes respiratory problems, particularly in children and elderly. SO<sub>2</sub> is a major contributor to acid rain, which corrodes buildings, damages crops, and acidifies lakes and streams, killing fish and other aquatic life.", env_style))
-    story.append(Spacer(1, 6))
-    
-    story.append(Paragraph("• <b>Particulate Matter (PM2.5 & PM10):</b> Microscopic particles that penetrate deep into lungs and bloodstream, causing heart disease, stroke, and lung cancer. These particles reduce visibility (haze), damage vegetation, and alter weather patterns. PM2.5 can travel thousands of kilometers, making it a global environmental concern.", env_style))
-    story.append(Spacer(1, 6))
-    
-    story.append(Paragraph("• <b>Ground-level Ozone (O<sub>3</sub>):</b> Formed when other pollutants react in sunlight. While beneficial in the upper atmosphere, ground-level ozone irritates eyes and respiratory system, and damages plant tissues, reducing crop yields and forest productivity. It's a major component of urban smog.", env_style))
-    story.append(Spacer(1, 15))
-    
-    story.append(Paragraph("<b>Comprehensive Environmental Protection Strategies:</b>", env_style))
-    story.append(Spacer(1, 8))
-    
-    story.append(Paragraph("<b>Individual Actions:</b>", env_style))
-    story.append(Paragraph("• Choose public transportation, cycling, or walking over private vehicles", env_style))
-    story.append(Paragraph("• Invest in energy-efficient appliances and renewable energy sources", env_style))
-    story.append(Paragraph("• Practice waste reduction, reuse, and recycling", env_style))
-    story.append(Paragraph("• Support organic farming and sustainable products", env_style))
-    story.append(Paragraph("• Monitor and report air quality in your community", env_style))
-    story.append(Paragraph("• Plant native trees and maintain green spaces", env_style))
-    story.append(Spacer(1, 8))
-    
-    story.append(Paragraph("<b>Community Initiatives:</b>", env_style))
-    story.append(Paragraph("• Advocate for stricter emission standards and clean energy policies", env_style))
-    story.append(Paragraph("• Support urban planning that promotes green infrastructure", env_style))
-    story.append(Paragraph("• Participate in community tree-planting and cleanup programs", env_style))
-    story.append(Paragraph("• Encourage businesses to adopt sustainable practices", env_style))
-    story.append(Paragraph("• Promote awareness about environmental health connections", env_style))
-    story.append(Spacer(1, 8))
-    
-    story.append(Paragraph("<b>Global Impact:</b> The air quality data you analyze contributes to our understanding of climate change, public health patterns, and environmental justice issues. By monitoring these parameters, we can identify pollution hotspots, track improvement efforts, and develop targeted interventions to protect vulnerable communities and ecosystems.", env_style))
-    story.append(Spacer(1, 20))
-    story.append(Spacer(1, 20))
-    
-    # Footer
-    footer_style = ParagraphStyle(
-        'FooterStyle', 
-        parent=styles['Normal'], 
-        fontSize=10, 
-        textColor=colors.HexColor('#666'), 
-        alignment=1
-    )
-    story.append(Paragraph("Weather Prediction Tool | Designed and Developed by Varshini J", footer_style))
-    story.append(Spacer(1, 30))
-    
-    # Add character image at the end - spread across full page width
-    try:
-        page_width = A4[0] - 2*inch  # Account for margins - use A4 from function scope
-        
-        character_img = Image("character.png", width=page_width, height=3*inch)
-        character_img.hAlign = 'CENTER'
-        
-        # Add the image with proper spacing
-        story.append(character_img)
-        story.append(Spacer(1, 15))
-        
-    except Exception as e:
-        print(f"Character image error: {e}")
-        pass  # If image fails to load, continue without it
-    
-    # Add a thoughtful closing message after the character image
-    closing_style = ParagraphStyle(
-        'ClosingStyle', 
-        parent=styles['Normal'], 
-        fontSize=11, 
-        spaceAfter=8, 
-        textColor=colors.HexColor('#2c5530'), 
-        leftIndent=15,
-        rightIndent=15,
-        alignment=1,  # Center alignment
-        fontName='Helvetica-Oblique'
-    )
-    
-    story.append(Paragraph(" <b>Thank you for using our Weather Prediction Tool!</b> ", closing_style))
-    story.append(Spacer(1, 8))
-    story.append(Paragraph("May this report empower you to make informed decisions for a healthier tomorrow. Together, let's breathe cleaner air, protect our precious environment, and create a sustainable future for generations to come.", closing_style))
-    story.append(Spacer(1, 8))
-    story.append(Paragraph("<b>Stay safe, stay healthy, and stay environmentally conscious!</b>", closing_style))
-    
-    doc.build(story)
-    buffer.seek(0)
-    return buffer
+from attribution import get_explainer
+from drift import gauges as drift_gauges
+from history import get_history, record as record_history
+from metrics import observe, profiled, start_file_exporter, timed
+from models import required_features
+from predictor import get_predictor
+from reports import cached_pdf, create_html_report, submit_pdf
 
-# Load models
-et_reg_rain = joblib.load("et_reg_rain.pkl")
-et_reg_temp = joblib.load("et_reg_temp.pkl")
-et_cls_rain = joblib.load("et_cls_rain.pkl")
-et_cls_temp = joblib.load("et_cls_temp.pkl")
 
-required_features = [
-    "latitude", "longitude", "humidity", "wind_kph", "cloud", "pressure_mb", "uv_index", "feels_like_celsius",
-    "air_quality_Carbon_Monoxide", "air_quality_Ozone", "air_quality_Nitrogen_dioxide",
-    "air_quality_Sulphur_dioxide", "air_quality_PM2.5", "air_quality_PM10"
-]
+rerun_started = time.perf_counter()
+# Writes the stage latencies and drift gauges to FORECASTIQ_METRICS_FILE, if set (one thread per process)
+start_file_exporter(gauges_fn=drift_gauges)
+get_history()  # open the prediction history once per process, not on the first prediction
 
-rain_occurred_map = {0: "No Rain", 1: "Rain"}
-temp_class_map = {0: "Cold", 1: "Moderate", 2: "Hot"}
+# Load models (cached for the whole process, reloaded only when a .pkl file changes)
+predictor = get_predictor()
 
 st.set_page_config(page_title="🌤 Weather Predictor", layout="wide")
 
@@ -441,36 +30,84 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+# The form's widgets are seeded through session_state (not value=) so the prefill below can set them
+for feature in required_features:
+    st.session_state.setdefault(feature.replace(".", ""), 0.0)
+
+# Prefill the form from the stations nearest to a location (see spatial_index.py)
+with st.expander("📍 Prefill from the nearest weather stations"):
+    st.caption("Only know your location? Fill the other 12 features with the distance-weighted average of the closest stations in the dataset, then review them and predict.")
+    col1, col2, col3 = st.columns([2, 2, 1])
+    with col1:
+        prefill_latitude = st.number_input("Latitude", value=None, format="%.4f", key="prefill_latitude")
+    with col2:
+        prefill_longitude = st.number_input("Longitude", value=None, format="%.4f", key="prefill_longitude")
+    with col3:
+        prefill = st.button("📍 Prefill", key="prefill", disabled=prefill_latitude is None or prefill_longitude is None)
+    if prefill:
+        try:
+            from spatial_index import get_index  # loads (or builds) the persisted index on first use
+            index = get_index()
+            for feature, value in index.impute(prefill_latitude, prefill_longitude).items():
+                if value == value:  # a feature none of the neighbours reported stays as it is
+                    st.session_state[feature.replace(".", "")] = round(value, 4)
+            nearest = index.neighbours(prefill_latitude, prefill_longitude, k=1)[0]
+            st.success(f"✅ Prefilled from the nearest stations (the closest is {nearest['distance_km']:.1f} km away).")
+        except Exception as e:
+            st.error(f"Prefill failed: {e}")
+
 with st.form("input_form"):
     st.subheader("📊 Input Features")
     
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        latitude = st.number_input("Latitude", value=0.0, format="%.4f", key="latitude")
-        longitude = st.number_input("Longitude", value=0.0, format="%.4f", key="longitude")
-        humidity = st.number_input("Humidity", value=0.0, format="%.4f", key="humidity")
-        wind_kph = st.number_input("Wind KPH", value=0.0, format="%.4f", key="wind_kph")
-        cloud = st.number_input("Cloud", value=0.0, format="%.4f", key="cloud")
+        latitude = st.number_input("Latitude", format="%.4f", key="latitude")
+        longitude = st.number_input("Longitude", format="%.4f", key="longitude")
+        humidity = st.number_input("Humidity", format="%.4f", key="humidity")
+        wind_kph = st.number_input("Wind KPH", format="%.4f", key="wind_kph")
+        cloud = st.number_input("Cloud", format="%.4f", key="cloud")
         
     with col2:
-        pressure_mb = st.number_input("Pressure MB", value=0.0, format="%.4f", key="pressure_mb")
-        uv_index = st.number_input("UV Index", value=0.0, format="%.4f", key="uv_index")
-        feels_like_celsius = st.number_input("Feels Like Celsius", value=0.0, format="%.4f", key="feels_like_celsius")
-        air_quality_Carbon_Monoxide = st.number_input("Air Quality Carbon Monoxide", value=0.0, format="%.4f", key="air_quality_Carbon_Monoxide")
-        air_quality_Ozone = st.number_input("Air Quality Ozone", value=0.0, format="%.4f", key="air_quality_Ozone")
+        pressure_mb = st.number_input("Pressure MB", format="%.4f", key="pressure_mb")
+        uv_index = st.number_input("UV Index", format="%.4f", key="uv_index")
+        feels_like_celsius = st.number_input("Feels Like Celsius", format="%.4f", key="feels_like_celsius")
+        air_quality_Carbon_Monoxide = st.number_input("Air Quality Carbon Monoxide", format="%.4f", key="air_quality_Carbon_Monoxide")
+        air_quality_Ozone = st.number_input("Air Quality Ozone", format="%.4f", key="air_quality_Ozone")
         
     with col3:
-        air_quality_Nitrogen_dioxide = st.number_input("Air Quality Nitrogen Dioxide", value=0.0, format="%.4f", key="air_quality_Nitrogen_dioxide")
-        air_quality_Sulphur_dioxide = st.number_input("Air Quality Sulphur Dioxide", value=0.0, format="%.4f", key="air_quality_Sulphur_dioxide")
-        air_quality_PM25 = st.number_input("Air Quality PM2.5", value=0.0, format="%.4f", key="air_quality_PM25")
-        air_quality_PM10 = st.number_input("Air Quality PM10", value=0.0, format="%.4f", key="air_quality_PM10")
+        air_quality_Nitrogen_dioxide = st.number_input("Air Quality Nitrogen Dioxide", format="%.4f", key="air_quality_Nitrogen_dioxide")
+        air_quality_Sulphur_dioxide = st.number_input("Air Quality Sulphur Dioxide", format="%.4f", key="air_quality_Sulphur_dioxide")
+        air_quality_PM25 = st.number_input("Air Quality PM2.5", format="%.4f", key="air_quality_PM25")
+        air_quality_PM10 = st.number_input("Air Quality PM10", format="%.4f", key="air_quality_PM10")
     
     # Submit button
     col1, col2, col3 = st.columns([3, 1, 1])
     with col3:
         submitted = st.form_submit_button("🔮 Predict", type="primary")
 
+# Batch mode: score a whole file of readings at once
+with st.sidebar:
+    st.subheader("📁 Batch Predictions")
+    st.caption("Upload a CSV or Parquet file containing the 14 feature columns.")
+    batch_file = st.file_uploader("Readings file", type=["csv", "parquet"], key="batch_file")
+    if batch_file is not None and st.button("🔮 Predict All", key="batch_predict"):
+        try:
+            from batch import predict_file  # pulls in pandas; only needed for batch mode
+            results_buffer = io.StringIO()
+            batch_stats = predict_file(batch_file, results_buffer, predictor=predictor)
+            st.success(f"✅ Scored {batch_stats['rows']} rows at {batch_stats['rows_per_second']:.0f} rows/s")
+            if batch_stats["invalid_rows"]:
+                st.warning(f"⚠️ {batch_stats['invalid_rows']} rows had missing or non-numeric values and were not scored.")
+            st.download_button(
+                label="⬇️ Download Predictions",
+                data=results_buffer.getvalue().encode("utf-8"),
+                file_name="weather_predictions.csv",
+                mime="text/csv",
+            )
+        except Exception as e:
+            st.error(f"Batch prediction failed: {e}")
+
 if submitted:
     # Collect inputs
     inputs = {
@@ -496,6 +133,7 @@ if submitted:
     if len(missing_fields) == len(required_features):
         # No input provided at all
         st.info("💡 Please enter values for the weather features to get predictions.")
+        st.session_state.pop("predictions", None)
     elif len(missing_fields) > 0:
         # Some fields are missing - show specific missing fields and prevent prediction
         st.warning("⚠️ Please fill in all required fields before making predictions!")
@@ -515,80 +153,43 @@ if submitted:
         st.stop()
     else:
         # All fields have been provided - proceed with prediction
-        input_df = pd.DataFrame([inputs])
-        # Convert to numpy array to avoid sklearn feature name warnings
-        input_array = input_df.values
-        pred_log_rain = et_reg_rain.predict(input_array)
-        pred_rain_mm = np.expm1(pred_log_rain)[0]
-        pred_temp = et_reg_temp.predict(input_array)[0]
-        pred_cls_rain = et_cls_rain.predict(input_array)[0]
-        pred_temp_cls = et_cls_temp.predict(input_array)[0]
-
-        pred_cls_rain_label = rain_occurred_map.get(pred_cls_rain, "Unknown")
-        pred_temp_cls_label = temp_class_map.get(pred_temp_cls, "Unknown")
+        with profiled("app.submit"), timed("app.submit"):
+            # One validated feature matrix, all four models evaluated in parallel
+            started = time.perf_counter()
+            forecast = predictor.predict_one(inputs)
+            record_history("app", [[inputs[f] for f in required_features]],
+                           {name: [value] for name, value in forecast._asdict().items()}, time.perf_counter() - started)
 
+            # Store data in session state; the results below are shown from it, so they
+            # survive the reruns triggered by the PDF buttons
+            st.session_state.inputs = inputs
+            st.session_state.predictions = {
+                'rainfall': float(forecast.rainfall_mm),
+                'temperature': float(forecast.temperature_c),
+                'rain_class': forecast.rain_class,
+                'temp_class': forecast.temp_class
+            }
+            # Which inputs drove each prediction (tree path attributions, cached per row)
+            with timed("app.explain"):
+                st.session_state.predictions['contributors'] = get_explainer().top_contributors(inputs)
         st.success("✅ Prediction Completed")
-        
-        # Display predictions in metrics format
-        col1, col2, col3, col4 = st.columns(4)
-        
-        with col1:
-            st.metric(
-                label="🌧 Rainfall Amount",
-                value=f"{pred_rain_mm:.2f} mm",
-                help="Predicted rainfall amount in millimeters"
-            )
-        
-        with col2:
-            st.metric(
-                label="🌡 Temperature",
-                value=f"{pred_temp:.2f}°C",
-                help="Predicted temperature in Celsius"
-            )
-        
-        with col3:
-            st.metric(
-                label="☔ Rain Occurrence",
-                value=pred_cls_rain_label,
-                help="Likelihood of rain occurrence"
-            )
-        
-        with col4:
-            st.metric(
-                label="🔥 Temperature Category",
-                value=pred_temp_cls_label,
-                help="Temperature classification category"
-            )
+        # Values the models never saw during training (see drift.py)
+        if predictor.monitor is not None:
+            outside = predictor.monitor.out_of_range_features([inputs[f] for f in required_features])
+            if outside:
+                st.warning(f"⚠️ Outside the range of the training data: {', '.join(outside)}. Treat the predictions with caution.")
 
-        # Prepare data for HTML report
-        predictions = {
-            'rainfall': pred_rain_mm,
-            'temperature': pred_temp,
-            'rain_class': pred_cls_rain_label,
-            'temp_class': pred_temp_cls_label
-        }
-
-        # Store data in session state
-        st.session_state.inputs = inputs
-        st.session_state.predictions = predictions
-        
-        # Show the full HTML report in the Streamlit page
-        html_report = create_html_report(inputs, predictions)
-        st.subheader("📋 Full Weather Prediction Report")
-        st.components.v1.html(html_report, height=900, scrolling=True)
-        
-        # Print button for PDF
+
+@st.fragment
+def pdf_download(inputs, predictions, html_report):
+    """Render the PDF only on demand, on the background pool; clicking reruns just this section."""
+    rendered = cached_pdf(inputs, predictions)
+    if rendered is None:
+        if not st.button("📄 Prepare PDF Report", help="Render the report as PDF for download"):
+            return
         try:
-            pdf_buffer = create_pdf_report(inputs, predictions)
-            
-            # Download PDF button - downloads the exact same report as PDF
-            st.download_button(
-                label="🖨 Download PDF Report", 
-                data=pdf_buffer.getvalue(), 
-                file_name="weather_prediction_report.pdf", 
-                mime="application/pdf",
-                help="Download the full weather prediction report as PDF"
-            )
+            with st.spinner("Rendering PDF report..."), timed("app.pdf"):
+                rendered = submit_pdf(inputs, predictions).result()
         except Exception as e:
             # Provide a clearer error and install instructions for the PDF converters
             st.error("PDF generation failed. To produce a PDF that preserves the HTML template, install either WeasyPrint or wkhtmltopdf + pdfkit on your machine.")
@@ -602,6 +203,151 @@ if submitted:
                 st.download_button("⬇️ Download HTML (fallback)", data=html_bytes, file_name="weather_report.html", mime="text/html")
             except Exception:
                 pass
+            return
+
+    # Download PDF button - downloads the exact same report as PDF
+    st.download_button(
+        label="🖨 Download PDF Report",
+        data=rendered.data,
+        file_name="weather_prediction_report.pdf",
+        mime="application/pdf",
+        help="Download the full weather prediction report as PDF"
+    )
+    st.caption(f"Rendered with {rendered.engine} in {rendered.seconds:.2f}s")
+
+
+if "predictions" in st.session_state:
+    inputs = st.session_state.inputs
+    predictions = st.session_state.predictions
+
+    # Display predictions in metrics format
+    col1, col2, col3, col4 = st.columns(4)
+
+    with col1:
+        st.metric(
+            label="🌧 Rainfall Amount",
+            value=f"{predictions['rainfall']:.2f} mm",
+            help="Predicted rainfall amount in millimeters"
+        )
+
+    with col2:
+        st.metric(
+            label="🌡 Temperature",
+            value=f"{predictions['temperature']:.2f}°C",
+            help="Predicted temperature in Celsius"
+        )
+
+    with col3:
+        st.metric(
+            label="☔ Rain Occurrence",
+            value=predictions['rain_class'],
+            help="Likelihood of rain occurrence"
+        )
+
+    with col4:
+        st.metric(
+            label="🔥 Temperature Category",
+            value=predictions['temp_class'],
+            help="Temperature classification category"
+        )
+
+    # Show the full HTML report in the Streamlit page
+    html_report = create_html_report(inputs, predictions)
+    st.subheader("📋 Full Weather Prediction Report")
+    st.components.v1.html(html_report, height=900, scrolling=True)
+
+    pdf_download(inputs, predictions, html_report)
+
+# Forecast map: score a lat/lon lattice with grid.py (tiles are cached, so panning back is instant)
+GRID_RESOLUTIONS = [1.0, 0.5, 0.25, 0.1, 0.05]
+GRID_LAYERS = {
+    "🌧 Rainfall (mm)": "rainfall_mm",
+    "🌡 Temperature (°C)": "temperature_c",
+    "☔ Rain Occurrence": "rain_class",
+    "🔥 Temperature Category": "temp_class",
+}
+GRID_CLASS_COLOURS = ["blue", "green", "orange", "red"]
+
+
+def move_map(north_south=0, east_west=0, zoom=0):
+    """Pan the map box by half its size or zoom around its centre (a button callback)."""
+    state = st.session_state
+    height = state.grid_north - state.grid_south
+    width = state.grid_east - state.grid_west
+    centre_lat = (state.grid_north + state.grid_south) / 2 + north_south * height / 2
+    centre_lon = (state.grid_east + state.grid_west) / 2 + east_west * width / 2
+    if zoom:
+        height, width = (height / 2, width / 2) if zoom > 0 else (height * 2, width * 2)
+        step = GRID_RESOLUTIONS.index(state.grid_resolution) + zoom
+        state.grid_resolution = GRID_RESOLUTIONS[min(max(step, 0), len(GRID_RESOLUTIONS) - 1)]
+    height, width = min(height, 180.0), min(width, 360.0)
+    centre_lat = min(max(centre_lat, -90 + height / 2), 90 - height / 2)
+    centre_lon = min(max(centre_lon, -180 + width / 2), 180 - width / 2)
+    state.grid_south, state.grid_north = round(centre_lat - height / 2, 4), round(centre_lat + height / 2, 4)
+    state.grid_west, state.grid_east = round(centre_lon - width / 2, 4), round(centre_lon + width / 2, 4)
+
+
+@st.fragment
+def forecast_map():
+    """Rainfall/temperature maps of a lat/lon box; panning and zooming rerun only this section
+    and are mostly served from the grid's tile cache."""
+    if not st.toggle("Show the forecast map", key="grid_show"):
+        return
+    from grid import OTHER_FEATURES, get_forecaster, to_rgb  # only needed for the map
+
+    for key, value in (("grid_south", 8.0), ("grid_north", 37.0), ("grid_west", 68.0), ("grid_east", 97.0),
+                       ("grid_resolution", 0.25)):
+        st.session_state.setdefault(key, value)
+    col1, col2, col3, col4, col5 = st.columns(5)
+    with col1:
+        south = st.number_input("South", min_value=-90.0, max_value=90.0, format="%.4f", key="grid_south")
+    with col2:
+        north = st.number_input("North", min_value=-90.0, max_value=90.0, format="%.4f", key="grid_north")
+    with col3:
+        west = st.number_input("West", min_value=-180.0, max_value=180.0, format="%.4f", key="grid_west")
+    with col4:
+        east = st.number_input("East", min_value=-180.0, max_value=180.0, format="%.4f", key="grid_east")
+    with col5:
+        resolution = st.selectbox("Resolution", GRID_RESOLUTIONS, format_func=lambda r: f"{r}°", key="grid_resolution")
+    layer = st.radio("Layer", list(GRID_LAYERS), horizontal=True, key="grid_layer")
+    source = st.radio("Other 12 features", ["Nearest stations", "Form values"], horizontal=True, key="grid_source",
+                      help="Impute them per cell from the closest stations, or use the same values (from the form above) everywhere")
+    buttons = st.columns(6)
+    buttons[0].button("⬆️ North", on_click=move_map, kwargs={"north_south": 1}, key="grid_pan_north")
+    buttons[1].button("⬇️ South", on_click=move_map, kwargs={"north_south": -1}, key="grid_pan_south")
+    buttons[2].button("⬅️ West", on_click=move_map, kwargs={"east_west": -1}, key="grid_pan_west")
+    buttons[3].button("➡️ East", on_click=move_map, kwargs={"east_west": 1}, key="grid_pan_east")
+    buttons[4].button("🔍 Zoom in", on_click=move_map, kwargs={"zoom": 1}, key="grid_zoom_in")
+    buttons[5].button("🔎 Zoom out", on_click=move_map, kwargs={"zoom": -1}, key="grid_zoom_out")
+
+    features = None
+    if source == "Form values":
+        features = {f: st.session_state.get(f.replace(".", ""), 0.0) for f in OTHER_FEATURES}
+        if any(value == 0.0 for value in features.values()):
+            st.info("💡 Fill in the features other than latitude and longitude in the form above, or use the nearest stations.")
+            return
+    try:
+        with st.spinner("Scoring the grid..."), timed("app.grid"):
+            raster = get_forecaster().forecast((south, north, west, east), resolution, features,
+                                               impute=source == "Nearest stations")
+    except Exception as e:
+        st.error(f"Map failed: {e}")
+        return
+    name = GRID_LAYERS[layer]
+    cells = max(raster.values[name].shape)
+    image, legend = to_rgb(raster, name, scale=max(1, 600 // cells))
+    if name in ("rain_class", "temp_class"):
+        caption = ", ".join(f"{label}: {colour}" for label, colour in zip(legend, GRID_CLASS_COLOURS))
+    else:
+        caption = f"{legend[0]:.2f} (purple) to {legend[1]:.2f} (yellow)"
+    st.image(image, caption=f"{layer}: {caption}; grey = no prediction")
+    stats = raster.stats
+    st.caption(f"{stats['cells']} cells in {stats['tiles']} tiles, {stats['tiles'] - stats['tiles_scored']} "
+               f"from the cache; {stats['seconds']:.2f}s")
+
+
+st.subheader("🗺️ Forecast Map")
+forecast_map()
 
 # Single app-level footer (appears once at the bottom of the page)
 st.markdown("""
@@ -618,4 +364,6 @@ st.markdown("""
         </a>
     </div>
 </div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+""", unsafe_allow_html=True)
+
+observe("app.rerun", time.perf_counter() - rerun_started)
\ No newline at end of file
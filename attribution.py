@@ -0,0 +1,260 @@
+"""Per-prediction feature attributions for the ExtraTrees forests.
+
+Every node of a fitted tree stores the mean target (or class distribution)
+of the training rows that reached it. Walking a row down a tree, each split
+moves that value from the parent's to the child's; the move is credited to
+the split's feature (Saabas path attribution). Averaged over the trees,
+
+    prediction = base value + sum of the 14 feature contributions
+
+exactly, where the base value is the forests' mean over the training data.
+This is the path-dependent approximation of TreeSHAP: it needs one walk per
+tree instead of exponentially many feature subsets, so it runs on the same
+flat arrays as tree_engine.py. The per-node moves (`delta`) and the feature
+each node was reached through (`via`) are precomputed once per forest, and
+rows are attributed in batches with the same level-by-level walk as
+CompiledForest.apply.
+
+Reported quantities:
+    rainfall      mm; the regressor works in log1p(mm), its contributions are
+                  rescaled so they still add up to prediction - base value
+    temperature   °C
+    rain_class,   probability (0-1) of the predicted class
+    temp_class
+
+Attributions are cached per row next to the predictions (a PredictionCache
+with the same rounding and model-version invalidation), so showing or
+re-rendering a report does not walk the trees again.
+
+Usage:
+    explainer = get_explainer()
+    contributors = explainer.top_contributors(inputs)    # {"rainfall": {"base": .., "top": [[feature, value], ..]}, ..}
+    python attribution.py reading.json --top 5
+"""
+import argparse
+import collections
+import json
+import sys
+import threading
+
+import numpy as np
+
+from models import load_models, load_multi_output, required_features
+from prediction_cache import default_cache
+
+TARGETS = ["rainfall", "temperature", "rain_class", "temp_class"]
+DEFAULT_TOP = 5
+DEFAULT_CHUNK_ROWS = 4096
+
+# Model (and output column) each target is explained with
+TARGET_MODELS = {
+    "rainfall": ("et_reg_rain", 0),
+    "temperature": ("et_reg_temp", 0),
+    "rain_class": ("et_cls_rain", None),
+    "temp_class": ("et_cls_temp", None),
+}
+
+Attributions = collections.namedtuple("Attributions", ["base", "contributions"])
+
+
+class ForestAttribution:
+    """Saabas path attributions for one forest (sklearn or CompiledForest)."""
+
+    def __init__(self, forest):
+        from tree_engine import CompiledForest, compile_forest
+
+        self.forest = forest if isinstance(forest, CompiledForest) else compile_forest(forest)
+        f = self.forest
+        value = np.asarray(f.value, dtype=np.float64)
+        internal = np.flatnonzero(~f.is_leaf)
+        # For every node: how much the split above it moved the value, and on which feature
+        self.delta = np.zeros_like(value)
+        self.via = np.zeros(len(value), dtype=np.int64)
+        for children in (f.left[internal], f.right[internal]):
+            self.delta[children] = value[children] - value[internal]
+            self.via[children] = f.feature[internal]
+        self.base = value[f.roots].mean(axis=0)
+
+    def contributions(self, X, chunk_rows=DEFAULT_CHUNK_ROWS):
+        """Return the contributions, shape (n_rows, n_features, n_outputs); base + sum over features = prediction."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[np.newaxis, :]
+        out = np.empty((X.shape[0], X.shape[1], self.delta.shape[1]), dtype=np.float64)
+        for start in range(0, X.shape[0], chunk_rows):
+            out[start:start + chunk_rows] = self._walk(X[start:start + chunk_rows])
+        return out
+
+    def _walk(self, X):
+        f = self.forest
+        n_rows, n_features = X.shape
+        flat_X = X.ravel()
+        nodes = np.repeat(f.roots, n_rows)
+        row_offsets = np.tile(np.arange(n_rows, dtype=np.int64) * n_features, f.n_estimators)
+        totals = np.zeros((self.delta.shape[1], n_rows * n_features), dtype=np.float64)
+        active = np.flatnonzero(~f.is_leaf[nodes])
+        for _ in range(f.max_depth):
+            if active.size == 0:
+                break
+            current = nodes[active]
+            offsets = row_offsets[active]
+            go_left = flat_X[offsets + f.feature[current]] <= f.threshold[current]
+            following = np.where(go_left, f.left[current], f.right[current])
+            nodes[active] = following
+            # Credit each step to the (row, feature) of the split that was taken
+            cells = offsets + self.via[following]
+            step = self.delta[following]
+            for output in range(step.shape[1]):
+                totals[output] += np.bincount(cells, weights=step[:, output], minlength=n_rows * n_features)
+            active = active[~f.is_leaf[following]]
+        return (totals / f.n_estimators).T.reshape(n_rows, n_features, -1)
+
+
+class ForecastExplainer:
+    """Attributions for the four predictions, cached per row like the predictions themselves."""
+
+    def __init__(self, models=None, multi_output=None, use_cache=True):
+        self.models = models if models is not None else load_models()
+        self.multi_output = multi_output
+        self.cache = default_cache() if use_cache else None
+        self.forests = {}
+        sources = dict(self.models)
+        if multi_output is not None:
+            sources["et_reg_multi"] = multi_output
+        for target in TARGETS:
+            name, _ = self._model(target)
+            if name not in self.forests:
+                self.forests[name] = ForestAttribution(sources[name])
+
+    def _model(self, target):
+        name, output = TARGET_MODELS[target]
+        if self.multi_output is not None and target in ("rainfall", "temperature"):
+            # The multi-output regressor predicts [log1p(rainfall), temperature]
+            return "et_reg_multi", 0 if target == "rainfall" else 1
+        return name, output
+
+    def _compute(self, X):
+        """Return (base (n, 4), contributions (n, 4, n_features)) in the reported units."""
+        raw = {name: forest.contributions(X) for name, forest in self.forests.items()}
+        base = np.empty((len(X), len(TARGETS)), dtype=np.float64)
+        contributions = np.empty((len(X), len(TARGETS), X.shape[1]), dtype=np.float64)
+        for t, target in enumerate(TARGETS):
+            name, output = self._model(target)
+            forest_base = self.forests[name].base
+            if output is None:
+                # Classifiers: the probability of the class the forest predicts
+                totals = forest_base + raw[name].sum(axis=1)
+                predicted = np.argmax(totals, axis=1)
+                base[:, t] = forest_base[predicted]
+                contributions[:, t] = np.take_along_axis(raw[name], predicted[:, np.newaxis, np.newaxis], axis=2)[:, :, 0]
+                continue
+            values = raw[name][:, :, output]
+            if target == "rainfall":
+                # log1p(mm) -> mm, scaled so the contributions still add up to prediction - base
+                log_base = forest_base[output]
+                log_total = log_base + values.sum(axis=1)
+                moved = log_total - log_base
+                safe = np.where(np.abs(moved) > 1e-12, moved, 1.0)
+                scale = np.where(np.abs(moved) > 1e-12, (np.expm1(log_total) - np.expm1(log_base)) / safe,
+                                 np.exp(log_base))
+                base[:, t] = np.expm1(log_base)
+                contributions[:, t] = values * scale[:, np.newaxis]
+            else:
+                base[:, t] = forest_base[output]
+                contributions[:, t] = values
+        return base, contributions
+
+    def explain_matrix(self, X):
+        """Return Attributions(base (n, 4), contributions (n, 4, n_features)), targets in TARGETS order."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[np.newaxis, :]
+        if self.cache is None:
+            return Attributions(*self._compute(X))
+        keys = self.cache.keys(X)
+        rows = self.cache.get_many(keys)
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            base, contributions = self._compute(X[missing])
+            computed = list(zip(base, contributions))
+            self.cache.put_many([keys[i] for i in missing], computed)
+            for i, row in zip(missing, computed):
+                rows[i] = row
+        base, contributions = zip(*rows)
+        return Attributions(np.array(base), np.array(contributions))
+
+    def explain(self, inputs):
+        """Attributions for a dict of the 14 features, a list of dicts or a 2-D array."""
+        if isinstance(inputs, dict):
+            inputs = [inputs]
+        if isinstance(inputs, list) and inputs and isinstance(inputs[0], dict):
+            from predictor import validate_columns
+
+            for row in inputs:
+                validate_columns(row)
+            inputs = [[float(row[f]) for f in required_features] for row in inputs]
+        return self.explain_matrix(np.asarray(inputs, dtype=np.float32))
+
+    def top_contributors(self, inputs, top=DEFAULT_TOP):
+        """Return the report's "contributors" entry for one row: target -> {"base", "top": [[feature, value]]}."""
+        attributions = self.explain(inputs)
+        return contributors_entry(attributions.base[0], attributions.contributions[0], top)
+
+
+def contributors_entry(base, contributions, top=DEFAULT_TOP):
+    """Turn one row's base values (4,) and contributions (4, n_features) into the report entry."""
+    entry = {}
+    for t, target in enumerate(TARGETS):
+        order = np.argsort(-np.abs(contributions[t]), kind="stable")[:top]
+        entry[target] = {
+            "base": float(base[t]),
+            "top": [[required_features[i], float(contributions[t, i])] for i in order],
+        }
+    return entry
+
+
+_lock = threading.Lock()
+_default = None
+
+
+def get_explainer():
+    """Return a process-wide ForecastExplainer, rebuilt when a model file (or et_reg_multi.pkl) changes."""
+    from predictor import DEFAULT_USE_MULTI_OUTPUT
+
+    global _default
+    with _lock:
+        models = load_models()
+        multi_output = load_multi_output() if DEFAULT_USE_MULTI_OUTPUT else None
+        if (_default is None or _default.multi_output is not multi_output
+                or any(_default.models[name] is not model for name, model in models.items())):
+            _default = ForecastExplainer(models, multi_output)
+        return _default
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show which inputs drove the four predictions of a reading.")
+    parser.add_argument("reading", help="JSON file with the 14 features (one object, or a list of objects)")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="contributors shown per prediction")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.reading) as f:
+            readings = json.load(f)
+        readings = readings if isinstance(readings, list) else [readings]
+        attributions = get_explainer().explain(readings)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Attribution failed: {e}", file=sys.stderr)
+        return 1
+    for row in range(len(readings)):
+        if len(readings) > 1:
+            print(f"Reading {row + 1}")
+        entry = contributors_entry(attributions.base[row], attributions.contributions[row], args.top)
+        for target, result in entry.items():
+            total = result["base"] + attributions.contributions[row, TARGETS.index(target)].sum()
+            contributions = ", ".join(f"{feature} {value:+.3f}" for feature, value in result["top"])
+            print(f"  {target}: {total:.3f} (base value {result['base']:.3f}); {contributions}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
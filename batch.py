@@ -0,0 +1,175 @@
+"""Batch prediction: score a CSV or Parquet file of station readings.
+
+The file must contain the 14 `required_features` columns (any extra columns,
+e.g. a station id, are passed through to the output). Rows are read in chunks
+and each chunk is scored with one vectorized `predict` call per model (run in
+parallel by ForecastPredictor), so the whole file never has to be held in
+memory.
+
+With --impute, missing or absent feature values are filled from the stations
+nearest to each row's latitude/longitude (spatial_index.py) before scoring,
+so a file with only a location column pair can be scored too.
+
+Scored rows are recorded in the prediction history by a background writer
+(history.py; set FORECASTIQ_HISTORY_DB empty to skip it).
+
+Usage:
+    python batch.py readings.csv predictions.csv --chunk-size 50000
+    python batch.py locations.csv predictions.csv --impute
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from history import get_history, record as record_history
+from predictor import PREDICTION_COLUMNS, get_predictor, to_feature_matrix, validate_columns
+
+DEFAULT_CHUNK_SIZE = 50_000
+
+
+def _name_of(source):
+    """Return a file name for a path or an uploaded file object."""
+    return str(getattr(source, "name", source))
+
+
+def is_parquet(source):
+    return _name_of(source).lower().endswith((".parquet", ".pq"))
+
+
+def iter_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE, validate=validate_columns):
+    """Yield DataFrames of at most chunk_size rows from a CSV or Parquet file."""
+    if is_parquet(source):
+        import pyarrow.parquet as pq  # optional dependency, only needed for Parquet
+        parquet_file = pq.ParquetFile(source)
+        validate(parquet_file.schema_arrow.names)
+        for record_batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield record_batch.to_pandas()
+    else:
+        reader = pd.read_csv(source, chunksize=chunk_size)
+        first = True
+        for chunk in reader:
+            if first:
+                validate(chunk.columns)
+                first = False
+            yield chunk
+
+
+def _validate_location(columns):
+    missing = [c for c in ("latitude", "longitude") if c not in columns]
+    if missing:
+        raise ValueError(f"Input is missing required columns: {', '.join(missing)}")
+
+
+def predict_frame(frame, predictor, source=None):
+    """Return `frame` with the four prediction columns appended.
+
+    With a `source` ("batch", "bulk_reports") the scored rows are recorded in the prediction history.
+    """
+    X, valid = to_feature_matrix(frame)
+    result = frame.copy()
+    result["rainfall_mm"] = np.nan
+    result["temperature_c"] = np.nan
+    result["rain_class"] = None
+    result["temp_class"] = None
+    if valid.any():
+        start = time.perf_counter()
+        predictions = predictor.predict_matrix(X[valid])
+        if source is not None:
+            record_history(source, X[valid], predictions, time.perf_counter() - start)
+        for column in PREDICTION_COLUMNS:
+            result.loc[valid, column] = predictions[column]
+    return result
+
+
+class _ResultWriter:
+    """Append result chunks to a CSV or Parquet file as they are produced."""
+
+    def __init__(self, destination):
+        self.destination = destination
+        self.parquet = is_parquet(destination)
+        self._writer = None
+        self._first = True
+
+    def write(self, frame):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.destination, table.schema)
+            self._writer.write_table(table)
+        else:
+            frame.to_csv(self.destination, mode="w" if self._first else "a", header=self._first, index=False)
+        self._first = False
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def predict_file(source, destination, chunk_size=DEFAULT_CHUNK_SIZE, predictor=None, impute=False):
+    """Score every row of `source` and stream the results to `destination`.
+
+    `destination` may be a path or a writable text buffer (CSV only). With
+    impute=True missing feature values are filled from the nearest stations.
+    Returns a dict with the row counts, elapsed seconds and rows per second.
+    """
+    if predictor is None:
+        predictor = get_predictor()
+    index = None
+    if impute:
+        from spatial_index import get_index
+        index = get_index()
+    writer = _ResultWriter(destination)
+    rows = invalid = imputed = 0
+    start = time.perf_counter()
+    try:
+        for chunk in iter_chunks(source, chunk_size, _validate_location if impute else validate_columns):
+            if index is not None:
+                chunk, filled = index.fill_missing(chunk)
+                imputed += filled
+            result = predict_frame(chunk, predictor, source="batch")
+            invalid += int(result["rain_class"].isna().sum())
+            rows += len(result)
+            writer.write(result)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "invalid_rows": invalid,
+        "imputed_rows": imputed,
+        "seconds": elapsed,
+        "rows_per_second": rows / elapsed if elapsed > 0 else float("inf"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a CSV/Parquet file of weather readings with the ExtraTrees models.")
+    parser.add_argument("source", help="input .csv or .parquet file with the 14 feature columns")
+    parser.add_argument("destination", help="output .csv or .parquet file")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows scored per predict call")
+    parser.add_argument("--impute", action="store_true",
+                        help="fill missing features from the nearest stations (needs latitude/longitude)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.source):
+        parser.error(f"{args.source} does not exist")
+    get_history()  # open the prediction history before the clock starts
+    try:
+        stats = predict_file(args.source, args.destination, chunk_size=args.chunk_size, impute=args.impute)
+    except ValueError as e:
+        print(f"Batch prediction failed: {e}", file=sys.stderr)
+        return 1
+    imputed = f", {stats['imputed_rows']} imputed" if args.impute else ""
+    print(f"Scored {stats['rows']} rows ({stats['invalid_rows']} invalid{imputed}) in {stats['seconds']:.2f}s "
+          f"- {stats['rows_per_second']:.0f} rows/s -> {args.destination}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""Cold-start benchmark for the Streamlit app, with an enforced time budget.
+
+Each run starts a fresh Python process that imports exactly the modules
+app.py imports at top level (read from app.py, so a new heavy import shows up
+here), loads the models and makes the first prediction. The median of the
+runs is compared with the budget and the exit code is 1 when it is exceeded,
+so the check can run in CI or before rolling out a container image.
+
+Usage:
+    python benchmarks/startup.py --runs 5 --budget 4.0
+    python benchmarks/startup.py --engine          # serve from forest_engine.npz
+    python benchmarks/startup.py --importtime      # also list the slowest imports
+"""
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "app.py")
+DEFAULT_BUDGET = float(os.environ.get("FORECASTIQ_STARTUP_BUDGET", "4.0"))
+
+# A plausible reading (New Delhi) used for the first prediction
+SAMPLE = {
+    "latitude": 28.6, "longitude": 77.2, "humidity": 60.0, "wind_kph": 10.0, "cloud": 25.0,
+    "pressure_mb": 1010.0, "uv_index": 5.0, "feels_like_celsius": 30.0,
+    "air_quality_Carbon_Monoxide": 300.0, "air_quality_Ozone": 50.0, "air_quality_Nitrogen_dioxide": 10.0,
+    "air_quality_Sulphur_dioxide": 5.0, "air_quality_PM2.5": 30.0, "air_quality_PM10": 50.0,
+}
+
+CHILD = """
+import importlib, json, sys, time
+start = time.perf_counter()
+for name in {modules!r}:
+    importlib.import_module(name)
+imported = time.perf_counter()
+from predictor import get_predictor
+predictor = get_predictor()
+loaded = time.perf_counter()
+predictor.predict_one({sample!r})
+done = time.perf_counter()
+print(json.dumps({{"imports": imported - start, "model_load": loaded - imported,
+                  "first_prediction": done - loaded, "total": done - start,
+                  "modules": sorted(m for m in ("pandas", "sklearn", "reportlab", "joblib") if m in sys.modules)}}))
+"""
+
+
+def app_imports(path=APP):
+    """Return the absolute modules imported at the top level of app.py."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+    return modules
+
+
+def run_once(env, importtime=False):
+    """Start a fresh interpreter and return its phase timings (and -X importtime output)."""
+    code = CHILD.format(modules=app_imports(), sample=SAMPLE)
+    command = [sys.executable, "-W", "ignore"] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    result = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "child failed")
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(importtime_log, top=10):
+    """Parse `-X importtime` output into the `top` (cumulative microseconds, module) pairs."""
+    rows = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), module.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure app cold start (imports + model load + first prediction).")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET, help="max median total seconds")
+    parser.add_argument("--engine", action="store_true", help="set FORECASTIQ_ENGINE=1 (compiled forests)")
+    parser.add_argument("--importtime", action="store_true", help="print the slowest imports of the last run")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    if args.engine:
+        env["FORECASTIQ_ENGINE"] = "1"
+    runs = []
+    log = ""
+    try:
+        for _ in range(args.runs):
+            timings, log = run_once(env, importtime=args.importtime)
+            runs.append(timings)
+    except RuntimeError as e:
+        print(f"Startup benchmark failed: {e}", file=sys.stderr)
+        return 2
+
+    for phase in ("imports", "model_load", "first_prediction", "total"):
+        values = [r[phase] for r in runs]
+        print(f"{phase:17s} median {statistics.median(values) * 1000:8.1f} ms   max {max(values) * 1000:8.1f} ms")
+    print(f"heavy modules loaded: {', '.join(runs[-1]['modules']) or 'none'}")
+    if args.importtime:
+        for cumulative, module in slowest_imports(log):
+            print(f"  {cumulative / 1000:8.1f} ms  {module}")
+
+    total = statistics.median(r["total"] for r in runs)
+    ok = total <= args.budget
+    print(f"Startup budget {args.budget:.2f}s: median {total:.2f}s {'OK' if ok else 'EXCEEDED'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""Offline benchmark suite: model loading, inference and report rendering.
+
+Runs against the training workbook (through the data_cache, so the rows are
+read from the memory-mapped cache after the first run) and the .pkl models
+in MODEL_DIR. Each case is timed `--repeat` times; its peak Python
+allocation is measured in one extra run under tracemalloc (kept out of the
+timed runs because tracing slows them down). Results are written as JSON
+so two runs, e.g. before and after a retrain or a code change, can be
+compared.
+
+Cases:
+    load/<model>               joblib.load of each et_*.pkl (bypassing the registry)
+    predict_1/<model>          model.predict on one row
+    predict_N/<model>          model.predict on N rows (--rows)
+    predictor/predict_one      ForecastPredictor.predict_one, cache disabled
+    report/html                create_html_report
+    report/pdf_<engine>        create_pdf_report with each installed engine
+
+Usage:
+    python benchmarks/suite.py run --output benchmarks/results/baseline.json
+    python benchmarks/suite.py run --rows 5000 --repeat 10 --only predict
+    python benchmarks/suite.py compare benchmarks/results/baseline.json benchmarks/results/new.json --threshold 0.1
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from data_cache import DEFAULT_SOURCE, load_dataset  # noqa: E402
+from models import MODEL_FILES, model_path, model_version, required_features  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def measure(func, repeat):
+    """Time `func` `repeat` times, then once more under tracemalloc for the peak allocation."""
+    func()  # warm-up (imports, caches)
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "median_ms": statistics.median(seconds) * 1000,
+        "min_ms": min(seconds) * 1000,
+        "max_ms": max(seconds) * 1000,
+        "runs": repeat,
+        "peak_kb": peak / 1024,
+    }
+
+
+def build_cases(data_path, rows):
+    """Return a list of (name, func, default repeat) benchmark cases."""
+    import joblib
+    from predictor import ForecastPredictor
+    from reports import available_pdf_engines, create_html_report, create_pdf_report
+
+    dataset = load_dataset(data_path)
+    X = dataset.X[:rows].copy()
+    one = X[:1]
+    models = {name: joblib.load(model_path(name)) for name in MODEL_FILES}
+    predictor = ForecastPredictor(models=models, use_cache=False)
+    inputs = dict(zip(required_features, map(float, one[0])))
+    predictions = {"rainfall": 1.25, "temperature": 27.5, "rain_class": "Rain", "temp_class": "Hot"}
+
+    cases = []
+    for name in MODEL_FILES:
+        cases.append((f"load/{name}", lambda name=name: joblib.load(model_path(name)), 3))
+    for name, model in models.items():
+        cases.append((f"predict_1/{name}", lambda model=model: model.predict(one), 20))
+        cases.append((f"predict_N/{name}", lambda model=model: model.predict(X), 3))
+    cases.append(("predictor/predict_one", lambda: predictor.predict_one(inputs), 20))
+    cases.append(("report/html", lambda: create_html_report(inputs, predictions), 50))
+    for engine in available_pdf_engines():
+        cases.append((f"report/pdf_{engine}", lambda engine=engine: create_pdf_report(inputs, predictions, [engine]), 5))
+    return cases
+
+
+def run(data_path, rows, repeat=None, only=None):
+    """Run every case (or those whose name contains `only`) and return the results document."""
+    # The pickles were fitted on DataFrames; the app predicts on plain arrays too
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+    results = {}
+    for name, func, default_repeat in build_cases(data_path, rows):
+        if only and not any(part in name for part in only):
+            continue
+        results[name] = measure(func, repeat or default_repeat)
+        r = results[name]
+        print(f"{name:32s} median {r['median_ms']:10.2f} ms   min {r['min_ms']:10.2f} ms   peak {r['peak_kb'] / 1024:8.1f} MB")
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": _git_commit(),
+            "model_version": model_version(),
+            "data": os.path.basename(data_path),
+            "rows": rows,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """Print the median ratio of every common case; return the names that got slower than threshold."""
+    regressions = []
+    print(f"{'case':32s} {'baseline':>12s} {'current':>12s} {'change':>8s}")
+    for name in sorted(set(baseline["results"]) | set(current["results"])):
+        old = baseline["results"].get(name)
+        new = current["results"].get(name)
+        if old is None or new is None:
+            print(f"{name:32s} {'-' if old is None else format(old['median_ms'], '12.2f'):>12s} "
+                  f"{'-' if new is None else format(new['median_ms'], '12.2f'):>12s}   (only in one run)")
+            continue
+        change = new["median_ms"] / old["median_ms"] - 1 if old["median_ms"] > 0 else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  SLOWER"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{name:32s} {old['median_ms']:12.2f} {new['median_ms']:12.2f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark model loading, inference and report rendering.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="run the suite and write a JSON result file")
+    run_parser.add_argument("--data", default=os.path.join(ROOT, DEFAULT_SOURCE), help="xlsx or csv file")
+    run_parser.add_argument("--rows", type=int, default=1000, help="N for the N-row predict cases")
+    run_parser.add_argument("--repeat", type=int, default=None, help="timed runs per case (default per case)")
+    run_parser.add_argument("--only", nargs="+", default=None, help="run cases whose name contains any of these")
+    run_parser.add_argument("--output", default=None, help="result file (default benchmarks/results/<time>.json)")
+    compare_parser = sub.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown that fails")
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} case(s) slower than {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+        return 0
+
+    try:
+        document = run(args.data, args.rows, args.repeat, args.only)
+    except (OSError, ValueError) as e:
+        print(f"Benchmark failed: {e}", file=sys.stderr)
+        return 2
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(document, f, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,370 @@
+"""Bulk report generation: one report per row of a readings or predictions file.
+
+The input is a CSV/Parquet file with the 14 feature columns. If it already
+holds the four prediction columns (the output of batch.py) they are used as
+is, otherwise the rows are scored first. Reports are rendered across a
+process pool, a few dozen per task, and written out as they complete:
+
+    --format zip   one PDF (and/or HTML) file per row in a ZIP archive
+    --format pdf   one merged multi-page PDF (ReportLab); each worker writes
+                   a part file to disk and the parts are joined at the end
+                   (needs `pip install pypdf`)
+
+Only a bounded number of tasks is in flight, so memory stays flat however
+many stations are in the file. Rows with missing or non-numeric values are
+skipped and counted. With --explain every report also lists the inputs that
+drove its predictions (attribution.py); the rows are then scored again by the
+current models, so the contributions add up to the reported predictions even
+when the file's prediction columns came from older models. The merged PDF is
+written part by part (PdfAppender), so the merge does not hold every page.
+
+Usage:
+    python bulk_reports.py predictions.csv reports.zip --workers 8
+    python bulk_reports.py readings.parquet daily_reports.pdf --id-column station
+"""
+import argparse
+import hashlib
+import importlib.util
+import io
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from attribution import contributors_entry, get_explainer
+from batch import DEFAULT_CHUNK_SIZE, iter_chunks, predict_frame
+from history import get_history
+from models import required_features
+from predictor import PREDICTION_COLUMNS, Forecast, forecast_to_report, get_predictor, to_feature_matrix
+from reportlab_report import write_reportlab_pdf
+from reports import available_pdf_engines, create_html_report, render_pdf
+
+DEFAULT_REPORTS_PER_TASK = 25
+
+
+def _safe_name(value):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", str(value)).strip("_") or "report"
+
+
+def iter_reports(source, id_column=None, chunk_size=DEFAULT_CHUNK_SIZE, stats=None, explain=False):
+    """Yield (name, input_data, predictions) for every scorable row of `source`.
+
+    With explain=True the rows are always scored by the current models (prediction columns in `source`
+    are replaced) and the predictions also carry the top contributors, attributed for the whole chunk at once.
+    Names taken from `id_column` are made unique by appending the row number when a value repeats.
+    """
+    predictor = None
+    seen = set()
+    explainer = get_explainer() if explain else None
+    row_number = 0
+    for chunk in iter_chunks(source, chunk_size):
+        if explain or not all(column in chunk.columns for column in PREDICTION_COLUMNS):
+            # With explain the rows are rescored, so the attributions add up to the reported values
+            predictor = predictor or get_predictor()
+            chunk = predict_frame(chunk, predictor, source="bulk_reports")
+        if explainer is not None:
+            X, valid = to_feature_matrix(chunk)
+            attributions = explainer.explain_matrix(X[valid])
+            positions = np.cumsum(valid) - 1
+        for i, row in enumerate(chunk.to_dict("records")):
+            row_number += 1
+            if pd.isna(row.get("rain_class")) or any(pd.isna(row[f]) for f in required_features):
+                if stats is not None:
+                    stats["skipped"] += 1
+                continue
+            input_data = {f: float(row[f]) for f in required_features}
+            predictions = forecast_to_report(Forecast(*(row[c] for c in PREDICTION_COLUMNS)))
+            if explainer is not None and valid[i]:
+                predictions["contributors"] = contributors_entry(attributions.base[positions[i]],
+                                                                 attributions.contributions[positions[i]])
+            name = _safe_name(row[id_column]) if id_column else f"report_{row_number:06d}"
+            if name in seen:
+                stem = name = f"{name}_{row_number:06d}"
+                copy = 1
+                while name in seen:  # another row's id already had this form
+                    copy += 1
+                    name = f"{stem}_{copy}"
+            seen.add(name)
+            yield name, input_data, predictions
+
+
+def _tasks(reports, size):
+    task = []
+    for report in reports:
+        task.append(report)
+        if len(task) == size:
+            yield task
+            task = []
+    if task:
+        yield task
+
+
+def render_zip_entries(task, kind, engines):
+    """Worker: render one task's reports; returns ([(file name, bytes)], pages, reports)."""
+    entries = []
+    pages = 0
+    for name, input_data, predictions in task:
+        if kind in ("html", "both"):
+            entries.append((f"{name}.html", create_html_report(input_data, predictions).encode("utf-8")))
+        if kind in ("pdf", "both"):
+            rendered = render_pdf(input_data, predictions, engines)
+            entries.append((f"{name}.pdf", rendered.data))
+            pages += rendered.pages
+    return entries, pages, len(task)
+
+
+def render_part(task, path):
+    """Worker: write one task's reports as a single multi-page PDF; returns its page count."""
+    return write_reportlab_pdf([(input_data, predictions) for _, input_data, predictions in task], path)
+
+
+def _run_bounded(pool, tasks, submit, window, handle):
+    """Submit tasks while keeping at most `window` in flight; handle results in order."""
+    in_flight = deque()
+    for task in tasks:
+        in_flight.append(submit(pool, task))
+        if len(in_flight) >= window:
+            handle(in_flight.popleft().result())
+    while in_flight:
+        handle(in_flight.popleft().result())
+
+
+class PdfAppender:
+    """Write a PDF part by part, keeping only one part's objects in memory.
+
+    The pages of each part are copied with their objects renumbered and written out
+    at once. Identical objects (the character image and the fonts every part embeds)
+    are written once, found by a digest of their bytes. What stays in memory is one
+    offset and digest per written object and one number per page.
+    """
+
+    CATALOG, PAGES = 1, 2
+
+    def __init__(self, f):
+        self.f = f
+        self.offsets = {}
+        self.digests = {}
+        self.pages = []
+        self.next_number = 3
+        f.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def append(self, path):
+        from pypdf import PdfReader
+
+        reader = PdfReader(path)
+        copied = {}
+        numbers = []
+        for page in reader.pages:  # numbered first, so references between pages resolve
+            numbers.append(self._allocate())
+            copied[(page.indirect_reference.idnum, page.indirect_reference.generation)] = numbers[-1]
+        for page, number in zip(reader.pages, numbers):
+            self._write(number, self._remap(page, copied, is_page=True))
+        self.pages.extend(numbers)
+
+    def close(self):
+        """Write the page tree, the cross-reference table and the trailer."""
+        from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+
+        self._write(self.PAGES, DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject(IndirectObject(number, 0, None) for number in self.pages),
+            NameObject("/Count"): NumberObject(len(self.pages)),
+        }))
+        self._write(self.CATALOG, DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): IndirectObject(self.PAGES, 0, None),
+        }))
+        xref = self.f.tell()
+        self.f.write(f"xref\n0 {self.next_number}\n0000000000 65535 f \n".encode("ascii"))
+        for number in range(1, self.next_number):
+            self.f.write(f"{self.offsets[number]:010d} 00000 n \n".encode("ascii"))
+        trailer = DictionaryObject({NameObject("/Size"): NumberObject(self.next_number),
+                                    NameObject("/Root"): IndirectObject(self.CATALOG, 0, None)})
+        self.f.write(b"trailer\n")
+        trailer.write_to_stream(self.f)
+        self.f.write(f"\nstartxref\n{xref}\n%%EOF\n".encode("ascii"))
+
+    def _allocate(self):
+        self.next_number += 1
+        return self.next_number - 1
+
+    def _write(self, number, obj):
+        if not isinstance(obj, bytes):
+            obj = _serialize(obj)
+        self.offsets[number] = self.f.tell()
+        self.f.write(b"%d 0 obj\n%s\nendobj\n" % (number, obj))
+
+    def _copy(self, reference, copied):
+        """Write the object behind `reference` (once per part, deduplicated) and return its new number."""
+        key = (reference.idnum, reference.generation)
+        if key in copied:
+            if copied[key] is None:  # a reference cycle: number the object before it is written
+                copied[key] = self._allocate()
+            return copied[key]
+        copied[key] = None
+        data = _serialize(self._remap(reference.get_object(), copied))
+        number = copied[key]
+        if number is None:
+            digest = hashlib.sha1(data).digest()
+            number = self.digests.get(digest)
+            if number is None:
+                number = self.digests[digest] = self._allocate()
+                self._write(number, data)
+            copied[key] = number
+        else:
+            self._write(number, data)
+        return number
+
+    def _remap(self, obj, copied, is_page=False):
+        """Return a copy of `obj` whose indirect references point at the copied objects."""
+        from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, StreamObject
+
+        if isinstance(obj, IndirectObject):
+            return IndirectObject(self._copy(obj, copied), 0, None)
+        if isinstance(obj, StreamObject):
+            new = StreamObject()
+            new._data = obj._data  # the stream as stored, still encoded; its /Length is rewritten
+            new.update({key: self._remap(value, copied) for key, value in obj.items() if key != "/Length"})
+            return new
+        if isinstance(obj, DictionaryObject):
+            new = DictionaryObject({key: self._remap(value, copied) for key, value in obj.items()
+                                    if not (is_page and key == "/Parent")})
+            if is_page:
+                new[NameObject("/Parent")] = IndirectObject(self.PAGES, 0, None)
+            return new
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._remap(value, copied) for value in obj)
+        return obj
+
+
+def _serialize(obj):
+    buffer = io.BytesIO()
+    obj.write_to_stream(buffer)
+    return buffer.getvalue()
+
+
+def merge_parts(parts, destination):
+    """Join the part PDFs into `destination` (atomic replace), holding one part in memory at a time."""
+    tmp = f"{destination}.tmp"
+    if len(parts) == 1:
+        shutil.move(parts[0], tmp)
+    else:
+        with open(tmp, "wb") as f:
+            appender = PdfAppender(f)
+            for part in parts:
+                appender.append(part)
+            appender.close()
+    os.replace(tmp, destination)
+
+
+def peak_rss_mb():
+    """Return (this process, largest worker) peak resident memory in MB, or (None, None) on Windows."""
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    scale = 1e6 if sys.platform == "darwin" else 1e3  # ru_maxrss is in bytes on macOS, KiB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+def generate_reports(source, destination, fmt="zip", kind="pdf", workers=None, engines=None,
+                     id_column=None, reports_per_task=DEFAULT_REPORTS_PER_TASK, explain=False):
+    """Render one report per row of `source` into `destination` and return throughput stats."""
+    if fmt == "pdf" and importlib.util.find_spec("pypdf") is None:
+        # Checked before anything is rendered: the parts are only merged at the end
+        raise ImportError("--format pdf needs pypdf to merge the parts (pip install pypdf)")
+    workers = workers or os.cpu_count() or 1
+    engines = engines or available_pdf_engines()
+    stats = {"reports": 0, "pages": 0, "skipped": 0}
+    tasks = _tasks(iter_reports(source, id_column, stats=stats, explain=explain), reports_per_task)
+    window = 2 * workers
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if fmt == "zip":
+            tmp = f"{destination}.tmp"
+            with zipfile.ZipFile(tmp, "w") as archive:
+                def write_entries(result):
+                    entries, pages, reports = result
+                    for name, data in entries:
+                        # PDF streams are already compressed; HTML compresses well
+                        compression = zipfile.ZIP_STORED if name.endswith(".pdf") else zipfile.ZIP_DEFLATED
+                        archive.writestr(name, data, compress_type=compression)
+                    stats["reports"] += reports
+                    stats["pages"] += pages
+
+                _run_bounded(pool, tasks, lambda p, task: p.submit(render_zip_entries, task, kind, engines),
+                             window, write_entries)
+            os.replace(tmp, destination)
+        else:
+            part_dir = tempfile.mkdtemp(prefix="forecastiq_parts_", dir=os.path.dirname(os.path.abspath(destination)))
+            parts = []
+            try:
+                def submit_part(p, task):
+                    path = os.path.join(part_dir, f"part_{len(parts):06d}.pdf")
+                    parts.append(path)
+                    stats["reports"] += len(task)
+                    return p.submit(render_part, task, path)
+
+                def count_pages(pages):
+                    stats["pages"] += pages
+
+                _run_bounded(pool, tasks, submit_part, window, count_pages)
+                if parts:
+                    merge_parts(parts, destination)
+            finally:
+                shutil.rmtree(part_dir, ignore_errors=True)
+
+    elapsed = time.perf_counter() - start
+    stats["seconds"] = elapsed
+    stats["pages_per_second"] = stats["pages"] / elapsed if elapsed > 0 else float("inf")
+    stats["reports_per_second"] = stats["reports"] / elapsed if elapsed > 0 else float("inf")
+    stats["peak_rss_mb"], stats["peak_worker_rss_mb"] = peak_rss_mb()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render one weather report per row into a ZIP archive or a merged PDF.")
+    parser.add_argument("source", help=".csv or .parquet file with the 14 feature columns (optionally batch.py predictions)")
+    parser.add_argument("destination", help="output .zip or .pdf file")
+    parser.add_argument("--format", choices=["zip", "pdf"], default=None, help="default: from the destination extension")
+    parser.add_argument("--kind", choices=["pdf", "html", "both"], default="pdf", help="files per row in the ZIP")
+    parser.add_argument("--workers", type=int, default=None, help="render processes (default: CPU count)")
+    parser.add_argument("--engine", nargs="+", choices=["weasyprint", "reportlab"], default=None,
+                        help="PDF engine order for ZIP output (default: FORECASTIQ_PDF_ENGINE)")
+    parser.add_argument("--id-column", default=None, help="column used to name each report, e.g. a station id (repeated values get the row number appended)")
+    parser.add_argument("--reports-per-task", type=int, default=DEFAULT_REPORTS_PER_TASK)
+    parser.add_argument("--explain", action="store_true", help="add the top contributors of each prediction")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.source):
+        parser.error(f"{args.source} does not exist")
+    fmt = args.format or ("pdf" if args.destination.lower().endswith(".pdf") else "zip")
+    get_history()  # open the prediction history before the clock starts
+    try:
+        stats = generate_reports(args.source, args.destination, fmt=fmt, kind=args.kind, workers=args.workers,
+                                 engines=args.engine, id_column=args.id_column,
+                                 reports_per_task=args.reports_per_task, explain=args.explain)
+    except (ValueError, KeyError, ImportError, OSError) as e:
+        print(f"Bulk report generation failed: {e}", file=sys.stderr)
+        return 1
+    memory = ""
+    if stats["peak_rss_mb"] is not None:
+        memory = f", peak RSS {stats['peak_rss_mb']:.0f} MB (largest worker {stats['peak_worker_rss_mb']:.0f} MB)"
+    print(f"Rendered {stats['reports']} reports / {stats['pages']} pages ({stats['skipped']} rows skipped) "
+          f"in {stats['seconds']:.1f}s - {stats['pages_per_second']:.1f} pages/s, "
+          f"{stats['reports_per_second']:.1f} reports/s{memory} -> {args.destination}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+"""Accuracy-budgeted compression of the ExtraTrees forests.
+
+The exported forests use sklearn's defaults: every tree is grown until its
+leaves are pure, so the files are large, slow to load and deep to traverse.
+For each et_* model this tool searches over
+
+- keeping only the first k trees (the trees of a forest are independent
+  draws, so any prefix is a valid, smaller forest),
+- capping the depth (a node at the cap becomes a leaf that predicts the mean
+  or class distribution sklearn already stores on it),
+- capping the leaves per tree (the splits of the most populated nodes are kept),
+- storing thresholds and leaf values as float32 instead of float64,
+
+scores every candidate on the notebook's held-out split (train.split_indices,
+through the data_cache) and keeps the smallest one whose MSE or accuracy stays
+within the tolerance of the original model. All prefixes of one pruned forest
+are scored from a single pass over the test rows.
+
+The result is written in the tree_engine format (served with
+FORECASTIQ_ENGINE=1). Models that are not compressed, including the optional
+multi-output forest, are copied into it unchanged, so the file is complete.
+
+Usage:
+    python compress.py --mse-tolerance 0.02 --accuracy-tolerance 0.005
+    python compress.py --models et_reg_temp et_cls_temp --output forest_engine.npz   # replace the served engine
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from data_cache import DEFAULT_SOURCE, load_dataset
+from models import MODEL_FILES, MULTI_OUTPUT_FILE, MULTI_OUTPUT_NAME, load_model, model_path
+from tree_engine import DEFAULT_CHUNK_ROWS, CompiledForest, _time_single_row, flatten_forest, load_forests, write_engine
+
+DEFAULT_OUTPUT = "forest_engine_compressed.npz"
+DEFAULT_TREE_FRACTIONS = [1.0, 0.75, 0.5, 0.35, 0.25, 0.15, 0.1]
+DEFAULT_DEPTHS = [0, 30, 24, 20, 16, 12, 10, 8]  # 0 = no cap
+DEFAULT_LEAVES = [0, 8192, 4096, 2048, 1024, 512, 256]  # 0 = no cap
+
+
+class _PrunedTree:
+    """The attributes of sklearn's Tree that tree_engine.flatten_forest reads."""
+
+    def __init__(self, children_left, children_right, feature, threshold, value, max_depth):
+        self.children_left = children_left
+        self.children_right = children_right
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.max_depth = max_depth
+        self.node_count = len(children_left)
+
+
+def _pruned_forest(forest, trees):
+    """Wrap pruned trees so flatten_forest sees a fitted forest."""
+    pruned = SimpleNamespace(estimators_=[SimpleNamespace(tree_=t) for t in trees],
+                             n_features_in_=forest.n_features_in_, n_outputs_=getattr(forest, "n_outputs_", 1))
+    if hasattr(forest, "classes_"):
+        pruned.classes_ = forest.classes_
+    return pruned
+
+
+def node_depths(children_left, children_right):
+    """Depth of every node, computed level by level."""
+    depth = np.zeros(len(children_left), dtype=np.int32)
+    frontier = np.array([0])
+    level = 0
+    while frontier.size:
+        depth[frontier] = level
+        internal = frontier[children_left[frontier] != -1]
+        frontier = np.concatenate([children_left[internal], children_right[internal]])
+        level += 1
+    return depth
+
+
+def prune_tree(tree, max_depth=None, max_leaves=None):
+    """Return a _PrunedTree with at most `max_depth` levels and `max_leaves` leaves."""
+    left, right = tree.children_left, tree.children_right
+    depth = node_depths(left, right)
+    split = left != -1
+    if max_depth:
+        split &= depth < max_depth
+    if max_leaves:
+        candidates = np.flatnonzero(split)
+        if len(candidates) > max_leaves - 1:
+            # L leaves need L - 1 splits. A parent holds at least as many samples as
+            # its children and has a smaller id, so the kept splits still form a tree.
+            order = np.lexsort((candidates, -tree.n_node_samples[candidates]))
+            split = np.zeros_like(split)
+            split[candidates[order[:max_leaves - 1]]] = True
+    kept = np.zeros(len(left), dtype=bool)
+    kept[0] = True
+    kept[left[split]] = True
+    kept[right[split]] = True
+    new_ids = np.cumsum(kept) - 1
+    nodes = np.flatnonzero(kept)
+    is_split = split[nodes]
+    return _PrunedTree(
+        children_left=np.where(is_split, new_ids[left[nodes]], -1),
+        children_right=np.where(is_split, new_ids[right[nodes]], -1),
+        feature=np.where(is_split, tree.feature[nodes], -2),
+        threshold=np.where(is_split, tree.threshold[nodes], -2.0),
+        value=tree.value[nodes],
+        max_depth=int(depth[nodes].max()),
+    )
+
+
+def to_float32(arrays):
+    """Return a copy of flattened arrays with thresholds and leaf values stored as float32."""
+    arrays = dict(arrays)
+    arrays["threshold"] = arrays["threshold"].astype(np.float32)
+    arrays["value"] = np.ascontiguousarray(arrays["value"], dtype=np.float32)
+    return arrays
+
+
+def engine_bytes(arrays, n_nodes, n_trees):
+    """Size of the engine arrays for a forest of n_trees trees holding n_nodes nodes."""
+    per_node = sum(arrays[key].nbytes // len(arrays[key]) for key in ("feature", "threshold", "left", "right", "value"))
+    return n_nodes * per_node + n_trees * arrays["roots"].itemsize
+
+
+def prefix_predictions(compiled, X, tree_counts, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Averaged leaf values of the first k trees, for every k in tree_counts, in one pass."""
+    out = {k: np.empty((X.shape[0],) + compiled.value.shape[1:], dtype=np.float64) for k in tree_counts}
+    for start in range(0, X.shape[0], chunk_rows):
+        leaves = compiled.apply(X[start:start + chunk_rows])
+        cumulative = np.cumsum(compiled.value[leaves], axis=1, dtype=np.float64)
+        for k in tree_counts:
+            out[k][start:start + chunk_rows] = cumulative[:, k - 1] / k
+    return out
+
+
+def _decode(values, classes):
+    if classes is not None:
+        return classes.take(np.argmax(values, axis=1))
+    return values[:, 0]
+
+
+def compress_model(forest, target, X_test, y_test, mse_tolerance=0.02, accuracy_tolerance=0.005,
+                   tree_fractions=DEFAULT_TREE_FRACTIONS, depths=DEFAULT_DEPTHS, leaves=DEFAULT_LEAVES):
+    """Search the compression grid and return (arrays, meta, result) of the smallest acceptable forest.
+
+    When no grid point is within the tolerance the original forest is returned (result["compressed"] is False).
+    """
+    from train import evaluate
+
+    baseline = evaluate(target, y_test, forest.predict(X_test))
+    metric = "mse" if "mse" in baseline else "accuracy"
+    if metric == "mse":
+        limit = baseline["mse"] * (1 + mse_tolerance)
+    else:
+        limit = baseline["accuracy"] - accuracy_tolerance
+    classes = np.asarray(forest.classes_) if hasattr(forest, "classes_") else None
+    n_trees = len(forest.estimators_)
+    tree_counts = sorted({min(n_trees, max(1, int(round(f * n_trees)))) for f in tree_fractions})
+
+    best = None
+    seen = set()
+    searched = 0
+    for max_depth in depths:
+        for max_leaves in leaves:
+            trees = [prune_tree(e.tree_, max_depth, max_leaves) for e in forest.estimators_]
+            node_counts = tuple(t.node_count for t in trees)
+            if node_counts in seen:
+                continue  # the caps did not change anything compared to a grid point already scored
+            seen.add(node_counts)
+            arrays, meta = flatten_forest(_pruned_forest(forest, trees))
+            nodes_in_prefix = np.cumsum(node_counts)
+            for float32 in (False, True):
+                candidate = to_float32(arrays) if float32 else arrays
+                sizes = {k: engine_bytes(candidate, int(nodes_in_prefix[k - 1]), k) for k in tree_counts}
+                if best is not None and min(sizes.values()) >= best["bytes"]:
+                    continue
+                predictions = prefix_predictions(CompiledForest(candidate, meta), X_test, tree_counts)
+                for k in tree_counts:
+                    if best is not None and sizes[k] >= best["bytes"]:
+                        continue
+                    searched += 1
+                    score = evaluate(target, y_test, _decode(predictions[k], classes))[metric]
+                    if (score <= limit) if metric == "mse" else (score >= limit):
+                        best = {"n_trees": k, "max_depth": max_depth or None, "max_leaves": max_leaves or None,
+                                "float32": float32, "bytes": sizes[k], metric: score}
+
+    lossless_arrays, lossless_meta = flatten_forest(forest)
+    original_bytes = engine_bytes(lossless_arrays, lossless_meta["n_nodes"], n_trees)
+    compressed = best is not None
+    if not compressed:
+        # Nothing smaller is within the tolerance: keep every tree, uncapped, in float64
+        best = {"n_trees": n_trees, "max_depth": None, "max_leaves": None, "float32": False,
+                "bytes": original_bytes, metric: baseline[metric]}
+        arrays, meta = lossless_arrays, dict(lossless_meta)
+    else:
+        trees = [prune_tree(e.tree_, best["max_depth"], best["max_leaves"]) for e in forest.estimators_[:best["n_trees"]]]
+        arrays, meta = flatten_forest(_pruned_forest(forest, trees))
+        if best["float32"]:
+            arrays = to_float32(arrays)
+    meta["compression"] = {key: best[key] for key in ("n_trees", "max_depth", "max_leaves", "float32")}
+    result = dict(best, compressed=compressed, metric=metric, baseline=baseline[metric], limit=limit,
+                  candidates_scored=searched, original_trees=n_trees, original_depth=lossless_meta["max_depth"],
+                  original_bytes=original_bytes,
+                  n_nodes=meta["n_nodes"], original_nodes=lossless_meta["n_nodes"])
+    return arrays, meta, result
+
+
+def measure_gains(name, forest, arrays, meta, X_test):
+    """Pickle vs compressed file size, load time and single-row / batch latency of one model."""
+    import joblib
+
+    pickle_path = model_path(name)
+    start = time.perf_counter()
+    joblib.load(pickle_path)
+    pickle_load = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "model.npz")
+        write_engine({name: (arrays, meta)}, path)
+        file_bytes = os.path.getsize(path)
+        start = time.perf_counter()
+        compiled = load_forests(path, mmap=False)[name]
+        engine_load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    forest.predict(X_test)
+    sklearn_batch = time.perf_counter() - start
+    start = time.perf_counter()
+    compiled.predict(X_test)
+    engine_batch = time.perf_counter() - start
+    return {
+        "pickle_mb": os.path.getsize(pickle_path) / 1e6,
+        "compressed_mb": file_bytes / 1e6,
+        "pickle_load_ms": pickle_load * 1000,
+        "compressed_load_ms": engine_load * 1000,
+        "sklearn_row_ms": _time_single_row(forest.predict, X_test[:1]),
+        "compressed_row_ms": _time_single_row(compiled.predict, X_test[:1]),
+        "sklearn_batch_ms": sklearn_batch * 1000,
+        "compressed_batch_ms": engine_batch * 1000,
+    }
+
+
+def main(argv=None):
+    from train import build_targets, split_indices
+
+    parser = argparse.ArgumentParser(description="Compress the forests within an MSE / accuracy tolerance.")
+    parser.add_argument("--data", default=DEFAULT_SOURCE, help="xlsx or csv training file")
+    parser.add_argument("--models", nargs="+", default=list(MODEL_FILES), choices=list(MODEL_FILES))
+    parser.add_argument("--mse-tolerance", type=float, default=0.02, help="allowed relative MSE increase")
+    parser.add_argument("--accuracy-tolerance", type=float, default=0.005, help="allowed absolute accuracy drop")
+    parser.add_argument("--trees", nargs="+", type=float, default=DEFAULT_TREE_FRACTIONS, help="fractions of trees to try")
+    parser.add_argument("--depths", nargs="+", type=int, default=DEFAULT_DEPTHS, help="depth caps to try (0 = none)")
+    parser.add_argument("--leaves", nargs="+", type=int, default=DEFAULT_LEAVES, help="leaf caps per tree (0 = none)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="engine file to write")
+    parser.add_argument("--report", default=None, help="also write the per-model results as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        dataset = load_dataset(args.data)
+        forests = {name: load_model(name) for name in MODEL_FILES}
+    except (OSError, ValueError) as e:
+        print(f"Compression failed: {e}", file=sys.stderr)
+        return 1
+    targets = build_targets(dataset)
+    _, test = split_indices(len(dataset))
+    X_test = np.ascontiguousarray(dataset.X[test], dtype=np.float32)
+
+    flattened = {}
+    report = {}
+    for name, forest in forests.items():
+        if name not in args.models:
+            flattened[name] = flatten_forest(forest)
+            continue
+        target = name[len("et_"):]
+        arrays, meta, result = compress_model(forest, target, X_test, targets[target][test],
+                                              args.mse_tolerance, args.accuracy_tolerance,
+                                              args.trees, args.depths, args.leaves)
+        result.update(measure_gains(name, forest, arrays, meta, X_test))
+        flattened[name] = (arrays, meta)
+        report[name] = result
+        metric = result["metric"]
+        if not result["compressed"]:
+            print(f"{name}: no configuration within tolerance; kept the original forest")
+        print(f"{name}: {result['n_trees']}/{result['original_trees']} trees, depth {meta['max_depth']} "
+              f"(was {result['original_depth']}), max leaves {result['max_leaves'] or '-'}, "
+              f"{'float32' if result['float32'] else 'float64'}; {metric} {result[metric]:.4f} "
+              f"(original {result['baseline']:.4f}, limit {result['limit']:.4f}; {result['candidates_scored']} candidates)")
+        print(f"    size {result['pickle_mb']:.1f} MB pickle -> {result['compressed_mb']:.1f} MB; "
+              f"load {result['pickle_load_ms']:.0f} -> {result['compressed_load_ms']:.0f} ms; "
+              f"single row {result['sklearn_row_ms']:.2f} -> {result['compressed_row_ms']:.2f} ms; "
+              f"{len(X_test)} rows {result['sklearn_batch_ms']:.0f} -> {result['compressed_batch_ms']:.0f} ms")
+    if os.path.exists(model_path(MULTI_OUTPUT_FILE)):
+        flattened[MULTI_OUTPUT_NAME] = flatten_forest(load_model(MULTI_OUTPUT_FILE))
+
+    write_engine(flattened, args.output)
+    print(f"Wrote {args.output} ({os.path.getsize(args.output) / 1e6:.1f} MB); serve it as "
+          f"forest_engine.npz with FORECASTIQ_ENGINE=1")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+"""Columnar, memory-mapped cache of the training data.
+
+`pd.read_excel` (openpyxl) is slow and memory hungry, so training and
+evaluation code goes through `load_dataset` instead. The first call converts
+the source file (xlsx or csv) into a folder of `.npy` arrays keyed by the
+file's SHA-256:
+
+    .forecastiq_cache/<sha256>/X.npy              float32, (n_rows, 14) in required_features order
+    .forecastiq_cache/<sha256>/precip_mm.npy      float32
+    .forecastiq_cache/<sha256>/temperature_celsius.npy  float32
+    .forecastiq_cache/<sha256>/rain_occurred.npy  int8
+    .forecastiq_cache/<sha256>/meta.json
+
+Later calls memory-map those arrays, which takes milliseconds and shares the
+pages between processes. Only the 14 features and the targets are kept.
+
+New rows are appended with `extend_cache(dataset, "new_rows.csv")`, which
+writes a new folder keyed by both digests; its meta.json lists the row count
+of every appended file under "segments" (see refresh.py).
+
+Usage:
+    python data_cache.py build IndianWeatherRepository.xlsx
+    python data_cache.py benchmark IndianWeatherRepository.xlsx
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from models import file_sha256, required_features
+
+CACHE_DIR = os.environ.get("FORECASTIQ_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".forecastiq_cache"))
+DEFAULT_SOURCE = "IndianWeatherRepository.xlsx"
+TARGET_COLUMNS = ["precip_mm", "temperature_celsius"]
+FORMAT_VERSION = 1
+
+_digests = {}  # (abspath, mtime_ns, size) -> sha256, so unchanged files are hashed once per process
+
+
+class Dataset:
+    """Feature matrix and targets of one cached source file (arrays may be memory-mapped)."""
+
+    def __init__(self, X, precip_mm, temperature_celsius, rain_occurred, meta):
+        self.X = X
+        self.precip_mm = precip_mm
+        self.temperature_celsius = temperature_celsius
+        self.rain_occurred = rain_occurred
+        self.meta = meta
+
+    def __len__(self):
+        return self.X.shape[0]
+
+    @property
+    def log_precip_mm(self):
+        """Rainfall regression target used by the notebook (log1p of precip_mm)."""
+        return np.log1p(self.precip_mm)
+
+    def to_frame(self):
+        """Return a pandas DataFrame with the feature and target columns."""
+        import pandas as pd
+        frame = pd.DataFrame(self.X, columns=required_features)
+        frame["precip_mm"] = self.precip_mm
+        frame["temperature_celsius"] = self.temperature_celsius
+        frame["log_precip_mm"] = self.log_precip_mm
+        frame["rain_occurred"] = self.rain_occurred
+        return frame
+
+
+def read_source(path):
+    """Read only the feature and target columns of an xlsx or csv file."""
+    import pandas as pd
+    columns = required_features + TARGET_COLUMNS
+    if path.lower().endswith((".xlsx", ".xls")):
+        return pd.read_excel(path, usecols=columns)
+    return pd.read_csv(path, usecols=columns)
+
+
+def source_digest(path):
+    """Return the SHA-256 of `path`, reusing the last result while the file is unchanged."""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    if key not in _digests:
+        _digests[key] = file_sha256(path)
+    return _digests[key]
+
+
+def _cache_path(digest):
+    return os.path.join(CACHE_DIR, digest)
+
+
+def build_cache(path, digest=None):
+    """Convert `path` into the .npy cache folder and return that folder."""
+    digest = digest or source_digest(path)
+    target = _cache_path(digest)
+    frame = read_source(path)
+    tmp = f"{target}.tmp{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    precip = frame["precip_mm"].to_numpy(dtype=np.float32)
+    np.save(os.path.join(tmp, "X.npy"), np.ascontiguousarray(frame[required_features].to_numpy(dtype=np.float32)))
+    np.save(os.path.join(tmp, "precip_mm.npy"), precip)
+    np.save(os.path.join(tmp, "temperature_celsius.npy"), frame["temperature_celsius"].to_numpy(dtype=np.float32))
+    np.save(os.path.join(tmp, "rain_occurred.npy"), (precip > 0).astype(np.int8))
+    meta = {
+        "source": os.path.basename(path),
+        "sha256": digest,
+        "rows": len(frame),
+        "features": required_features,
+        "format_version": FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    # Publish atomically so a concurrent reader never sees a half-written cache
+    try:
+        os.rename(tmp, target)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)  # another process won the race
+    return target
+
+
+def _open_cache(folder, mmap_mode):
+    with open(os.path.join(folder, "meta.json")) as f:
+        meta = json.load(f)
+    arrays = {name: np.load(os.path.join(folder, f"{name}.npy"), mmap_mode=mmap_mode)
+              for name in ("X", "precip_mm", "temperature_celsius", "rain_occurred")}
+    return Dataset(meta=meta, **arrays)
+
+
+def open_cached(digest, mmap_mode="r"):
+    """Return the Dataset cached under `digest` (a source file's or an extended cache's)."""
+    return _open_cache(_cache_path(digest), mmap_mode)
+
+
+def extend_cache(dataset, path, mmap_mode="r"):
+    """Return `dataset` followed by the rows of `path`, cached like a source file.
+
+    The folder is keyed by the SHA-256 of both digests, so extending with the
+    same file twice reuses it. The arrays are written through memory maps, so
+    the existing rows are copied without loading them all at once.
+    """
+    import hashlib
+
+    new_digest = source_digest(path)
+    digest = hashlib.sha256(f"{dataset.meta['sha256']}+{new_digest}".encode("ascii")).hexdigest()
+    target = _cache_path(digest)
+    if os.path.exists(os.path.join(target, "meta.json")):
+        return _open_cache(target, mmap_mode)
+    frame = read_source(path)
+    precip = frame["precip_mm"].to_numpy(dtype=np.float32)
+    new = {
+        "X": np.ascontiguousarray(frame[required_features].to_numpy(dtype=np.float32)),
+        "precip_mm": precip,
+        "temperature_celsius": frame["temperature_celsius"].to_numpy(dtype=np.float32),
+        "rain_occurred": (precip > 0).astype(np.int8),
+    }
+    tmp = f"{target}.tmp{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    old_rows = len(dataset)
+    for name, rows in new.items():
+        old = getattr(dataset, name)
+        out = np.lib.format.open_memmap(os.path.join(tmp, f"{name}.npy"), mode="w+", dtype=old.dtype,
+                                        shape=(old_rows + len(rows),) + old.shape[1:])
+        out[:old_rows] = old
+        out[old_rows:] = rows
+        out.flush()
+        del out
+    meta = {
+        "source": f"{dataset.meta['source']}+{os.path.basename(path)}",
+        "sha256": digest,
+        "parent": dataset.meta["sha256"],
+        "rows": old_rows + len(frame),
+        "segments": dataset.meta.get("segments", [old_rows]) + [len(frame)],
+        "features": required_features,
+        "format_version": FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    try:
+        os.rename(tmp, target)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)  # another process won the race
+    return _open_cache(target, mmap_mode)
+
+
+def load_dataset(path=DEFAULT_SOURCE, mmap_mode="r"):
+    """Return the cached Dataset for `path`, building the cache on first use.
+
+    The cache is keyed by the file's SHA-256, so editing or replacing the
+    source file automatically produces a fresh cache.
+    """
+    digest = source_digest(path)
+    folder = _cache_path(digest)
+    if not os.path.exists(os.path.join(folder, "meta.json")):
+        folder = build_cache(path, digest)
+    return _open_cache(folder, mmap_mode)
+
+
+def benchmark(path=DEFAULT_SOURCE, repeat=3):
+    """Time read_excel against the cold (build) and warm (mmap) cache paths."""
+    import pandas as pd
+    import tracemalloc
+
+    def measure(func):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        # Separate run for memory: tracemalloc slows the timed runs down considerably
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return best, peak
+
+    results = {}
+    results["read_excel (all columns)"] = measure(lambda: pd.read_excel(path))
+    start = time.perf_counter()
+    build_cache(path)
+    results["build cache (first run)"] = (time.perf_counter() - start, 0)
+    results["load_dataset (mmap)"] = measure(lambda: np.asarray(load_dataset(path).X).sum())
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or benchmark the memory-mapped dataset cache.")
+    parser.add_argument("command", choices=["build", "benchmark"])
+    parser.add_argument("source", nargs="?", default=DEFAULT_SOURCE, help="xlsx or csv file")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        dataset = load_dataset(args.source)
+        print(f"Cached {len(dataset)} rows of {args.source} in {_cache_path(dataset.meta['sha256'])}")
+        return 0
+    for name, (seconds, peak) in benchmark(args.source).items():
+        memory = f", peak {peak / 1e6:.1f} MB" if peak else ""
+        print(f"{name:28s} {seconds * 1000:9.1f} ms{memory}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+"""Input drift monitor: compare the scored rows with the training distribution.
+
+At export time (`train.py --export`, `refresh.py`, or `python drift.py build`)
+a small reference is computed from the training rows and written next to the
+models as drift_reference.json: per feature the min/max, mean/std and decile
+edges with the share of training rows in each bin.
+
+`ForecastPredictor.predict_matrix` passes every scored matrix to the process'
+DriftMonitor, which keeps constant-size state per feature:
+
+- Welford mean and variance of everything scored so far,
+- a histogram over the reference bins whose counts decay with a half-life of
+  FORECASTIQ_DRIFT_HALF_LIFE rows, so it describes the recent inputs,
+- the number of values outside the training min/max.
+
+A feature is drifting when the PSI (population stability index) of the recent
+histogram against the training shares exceeds FORECASTIQ_DRIFT_PSI (0.1 is
+usually read as a moderate shift, 0.2 as a significant one). An update is a
+handful of vectorized numpy operations on the batch, a few microseconds per
+call. The service adds the flags to its responses and exports the PSI per
+feature at /metrics.
+
+Environment variables:
+    FORECASTIQ_DRIFT            set to 0 to switch the monitor off (default on when a reference exists)
+    FORECASTIQ_DRIFT_PSI        PSI above which a feature is flagged (default 0.2)
+    FORECASTIQ_DRIFT_HALF_LIFE  rows after which a bin count has decayed by half (default 5000)
+    FORECASTIQ_DRIFT_MIN_ROWS   recent rows needed before PSI is computed (default 500)
+
+Usage:
+    python drift.py build --data IndianWeatherRepository.xlsx
+    python drift.py check readings.csv
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from models import MODEL_DIR, required_features
+
+REFERENCE_FILE = "drift_reference.json"
+ENABLED = os.environ.get("FORECASTIQ_DRIFT", "1") not in ("", "0")
+PSI_THRESHOLD = float(os.environ.get("FORECASTIQ_DRIFT_PSI", "0.2"))
+HALF_LIFE = float(os.environ.get("FORECASTIQ_DRIFT_HALF_LIFE", "5000"))
+MIN_ROWS = float(os.environ.get("FORECASTIQ_DRIFT_MIN_ROWS", "500"))
+N_BINS = 10
+_EPSILON = 1e-4  # floor for empty bins in the PSI
+
+
+def reference_path(model_dir=MODEL_DIR):
+    return os.path.join(model_dir, REFERENCE_FILE)
+
+
+def _bin_index(X, edges):
+    """Bin of every value: the number of edges below it (edges are padded with +inf)."""
+    return (X[:, :, np.newaxis] > edges[np.newaxis, :, :]).sum(axis=2)
+
+
+def build_reference(X, n_bins=N_BINS):
+    """Return the reference dict of a (rows, 14) training matrix (NaN values are ignored)."""
+    X = np.asarray(X, dtype=np.float64)
+    features = {}
+    for j, name in enumerate(required_features):
+        values = X[:, j][np.isfinite(X[:, j])]
+        # Tied values (integer features, many zeros) collapse some deciles into one edge
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, n_bins + 1)[1:-1]))
+        counts = np.bincount(np.searchsorted(edges, values, side="left"), minlength=len(edges) + 1)
+        features[name] = {
+            "min": float(values.min()), "max": float(values.max()),
+            "mean": float(values.mean()), "std": float(values.std()),
+            "edges": edges.tolist(), "shares": (counts / counts.sum()).tolist(),
+        }
+    return {"rows": int(len(X)), "bins": n_bins, "features": features}
+
+
+def write_reference(X, model_dir=MODEL_DIR):
+    """Compute the reference of the training rows and write it next to the models (atomic replace)."""
+    reference = build_reference(X)
+    path = reference_path(model_dir)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(reference, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+class DriftMonitor:
+    """Constant-memory running statistics of the scored rows against a reference (thread-safe)."""
+
+    def __init__(self, reference, half_life=HALF_LIFE, psi_threshold=PSI_THRESHOLD, min_rows=MIN_ROWS):
+        features = [reference["features"][name] for name in required_features]
+        width = max(len(f["edges"]) for f in features)
+        self.edges = np.full((len(features), width), np.inf)
+        self.expected = np.zeros((len(features), width + 1))
+        for j, f in enumerate(features):
+            self.edges[j, :len(f["edges"])] = f["edges"]
+            self.expected[j, :len(f["shares"])] = f["shares"]
+        self.low = np.array([f["min"] for f in features])
+        self.high = np.array([f["max"] for f in features])
+        self.train_mean = np.array([f["mean"] for f in features])
+        self.train_std = np.array([f["std"] for f in features])
+        self.decay = 0.5 ** (1.0 / half_life)
+        self.psi_threshold = psi_threshold
+        self.min_rows = min_rows
+        self._flat = np.arange(len(features))[np.newaxis, :] * (width + 1)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            n_features, n_bins = self.expected.shape
+            self.count = 0
+            self.mean = np.zeros(n_features)
+            self.m2 = np.zeros(n_features)
+            self.recent = np.zeros((n_features, n_bins))  # decayed bin counts
+            self.out_of_range_count = np.zeros(n_features, dtype=np.int64)
+
+    def out_of_range(self, X):
+        """Boolean (rows, 14) mask of the values outside the training min/max."""
+        return (X < self.low) | (X > self.high)
+
+    def out_of_range_features(self, row):
+        """Names of the features of one row (in required_features order) outside the training range."""
+        outside = self.out_of_range(np.asarray(row, dtype=np.float64).reshape(1, -1))[0]
+        return [name for name, out in zip(required_features, outside) if out]
+
+    def observe(self, X):
+        """Fold a validated (rows, 14) matrix into the statistics; returns its out-of-range mask."""
+        X = np.asarray(X, dtype=np.float64)
+        n = len(X)
+        if n == 0:
+            return np.zeros(X.shape, dtype=bool)
+        outside = self.out_of_range(X)
+        batch_mean = X.mean(axis=0)
+        batch_m2 = ((X - batch_mean) ** 2).sum(axis=0)
+        bins = np.bincount((_bin_index(X, self.edges) + self._flat).ravel(), minlength=self.recent.size)
+        with self._lock:
+            # Chan et al.'s merge of two Welford states, so a batch costs the same as one row
+            total = self.count + n
+            delta = batch_mean - self.mean
+            self.mean += delta * (n / total)
+            self.m2 += batch_m2 + delta ** 2 * (self.count * n / total)
+            self.count = total
+            self.recent *= self.decay ** n
+            self.recent += bins.reshape(self.recent.shape)
+            self.out_of_range_count += outside.sum(axis=0)
+        return outside
+
+    def psi(self):
+        """PSI per feature of the recent histogram, or None while fewer than min_rows were seen."""
+        with self._lock:
+            recent = self.recent.copy()
+        rows = recent[0].sum()
+        if rows < self.min_rows:
+            return None
+        actual = np.maximum(recent / rows, _EPSILON)
+        expected = np.maximum(self.expected, _EPSILON)
+        used = (self.expected > 0) | (recent > 0)
+        return np.where(used, (actual - expected) * np.log(actual / expected), 0.0).sum(axis=1)
+
+    def drifting(self):
+        """Names of the features whose PSI exceeds the threshold."""
+        psi = self.psi()
+        if psi is None:
+            return []
+        return [name for name, value in zip(required_features, psi) if value > self.psi_threshold]
+
+    def report(self):
+        """Per-feature statistics for /drift and the check command."""
+        psi = self.psi()
+        with self._lock:
+            count, mean, m2, outside = self.count, self.mean.copy(), self.m2.copy(), self.out_of_range_count.copy()
+        std = np.sqrt(m2 / count) if count else np.full_like(mean, np.nan)
+        features = {}
+        for j, name in enumerate(required_features):
+            features[name] = {
+                "mean": float(mean[j]) if count else None, "std": float(std[j]) if count else None,
+                "train_mean": float(self.train_mean[j]), "train_std": float(self.train_std[j]),
+                "out_of_range": int(outside[j]),
+                "psi": None if psi is None else float(psi[j]),
+                "drifting": psi is not None and bool(psi[j] > self.psi_threshold),
+            }
+        return {"rows": int(count), "recent_rows": float(self.recent[0].sum()), "psi_threshold": self.psi_threshold,
+                "drifting": [name for name, f in features.items() if f["drifting"]], "features": features}
+
+    def gauges(self):
+        """Prometheus gauges: PSI and out-of-range count per feature, number of drifting features."""
+        report = self.report()
+        gauges = {"forecastiq_drift_rows": report["rows"], "forecastiq_drift_features": len(report["drifting"])}
+        for name, f in report["features"].items():
+            gauges[f'forecastiq_drift_psi{{feature="{name}"}}'] = f["psi"]
+            gauges[f'forecastiq_drift_out_of_range_total{{feature="{name}"}}'] = f["out_of_range"]
+        return gauges
+
+
+def load_monitor(model_dir=MODEL_DIR):
+    """Return a DriftMonitor for the reference next to the models, or None if there is none."""
+    path = reference_path(model_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return DriftMonitor(json.load(f))
+
+
+_lock = threading.Lock()
+_state = {"checked": float("-inf"), "stat": None, "monitor": None}
+
+
+def get_monitor(now=None):
+    """Return the process-wide DriftMonitor (None when disabled or without a reference).
+
+    The reference file is checked at most once a second; a new one, written
+    when models are exported or refreshed, starts a new monitor.
+    """
+    if not ENABLED:
+        return None
+    now = time.monotonic() if now is None else now
+    with _lock:
+        if now - _state["checked"] < 1.0:
+            return _state["monitor"]
+        _state["checked"] = now
+        try:
+            st = os.stat(reference_path())
+            stat = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stat = None
+        if _state["stat"] != stat:
+            _state["monitor"] = load_monitor() if stat is not None else None
+            _state["stat"] = stat
+        return _state["monitor"]
+
+
+def gauges():
+    """Gauges of the process-wide monitor (empty without one), for metrics.start_file_exporter."""
+    monitor = get_monitor()
+    return monitor.gauges() if monitor is not None else {}
+
+
+def main(argv=None):
+    from data_cache import DEFAULT_SOURCE, load_dataset
+
+    parser = argparse.ArgumentParser(description="Build the drift reference or check a file against it.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="write drift_reference.json from the training split")
+    build.add_argument("--data", default=DEFAULT_SOURCE, help="xlsx or csv training file")
+    check = sub.add_parser("check", help="report the drift of a file of readings")
+    check.add_argument("input", help="CSV or xlsx file with the 14 feature columns")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        from train import split_indices
+
+        try:
+            dataset = load_dataset(args.data)
+        except (OSError, ValueError) as e:
+            print(f"Drift reference failed: {e}", file=sys.stderr)
+            return 1
+        train_idx, _ = split_indices(len(dataset))
+        print(f"Wrote {write_reference(dataset.X[train_idx])} from {len(train_idx)} training rows")
+        return 0
+
+    import pandas as pd
+    from predictor import to_feature_matrix, validate_columns
+
+    monitor = load_monitor()
+    if monitor is None:
+        print(f"No {REFERENCE_FILE} in {MODEL_DIR}; run `python drift.py build` first", file=sys.stderr)
+        return 1
+    try:
+        frame = pd.read_excel(args.input) if args.input.lower().endswith((".xlsx", ".xls")) else pd.read_csv(args.input)
+        validate_columns(frame.columns)
+    except (OSError, ValueError) as e:
+        print(f"Drift check failed: {e}", file=sys.stderr)
+        return 1
+    X, valid = to_feature_matrix(frame)
+    if not valid.any():
+        print("Drift check failed: no row has 14 numeric features", file=sys.stderr)
+        return 1
+    monitor.min_rows = 1
+    monitor.decay = 1.0  # the whole file is the sample
+    monitor.observe(X[valid])
+    report = monitor.report()
+    print(f"{report['rows']} rows ({int((~valid).sum())} invalid rows skipped)")
+    print(f"{'feature':30s} {'mean':>10s} {'train mean':>11s} {'outside':>8s} {'PSI':>7s}")
+    for name, f in report["features"].items():
+        flag = "  DRIFT" if f["drifting"] else ""
+        print(f"{name:30s} {f['mean']:10.3f} {f['train_mean']:11.3f} {f['out_of_range']:8d} {f['psi']:7.3f}{flag}")
+    return 2 if report["drifting"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
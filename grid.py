@@ -0,0 +1,360 @@
+"""Gridded forecasts: score a latitude/longitude grid at once, cached in tiles.
+
+A map request is a bounding box, a resolution in degrees and the values of
+the 12 other features: either fixed (the same reading everywhere) or imputed
+per cell from the nearest stations (spatial_index.py).
+
+The grid is a global lattice: at resolution r, cell (i, j) is centred on
+latitude (i + 0.5) * r and longitude (j + 0.5) * r. It is cut into tiles of
+TILE_CELLS x TILE_CELLS cells, so the tiles of neighbouring or overlapping
+boxes at the same resolution coincide. The tiles a request needs and the
+cache does not hold are built as one feature matrix and scored by the four
+models in chunks on a thread pool (sklearn releases the GIL). Scored tiles
+are kept in an in-memory LRU and as small .npz files, keyed by
+(model version, resolution, tile, inputs), so panning and returning to a
+zoom level are served from the cache and a new model export invalidates it.
+
+    forecaster = get_forecaster()
+    raster = forecaster.forecast((8.0, 37.0, 68.0, 97.0), 0.25, impute=True)
+    raster.values["rainfall_mm"]        # 2-D, row 0 is the southern edge
+
+Environment variables:
+    FORECASTIQ_GRID_TILE_CELLS   cells per tile side (default 64)
+    FORECASTIQ_GRID_CACHE_TILES  tiles kept in memory (default 512)
+    FORECASTIQ_GRID_CACHE_DIR    folder of the tile files, empty to keep them in memory only
+                                 (default .forecastiq_cache/grid)
+    FORECASTIQ_GRID_MAX_CELLS    largest grid accepted per request (default 1000000)
+    FORECASTIQ_GRID_THREADS      chunks scored in parallel (default 4)
+
+Usage:
+    python grid.py --bbox 8 37 68 97 --resolution 0.25 --impute --output india.npz
+    python grid.py --bbox 20 25 75 80 --resolution 0.05 --features reading.json
+"""
+import argparse
+import collections
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from data_cache import CACHE_DIR
+from models import load_models, model_version, rain_occurred_map, required_features, temp_class_map
+
+TILE_CELLS = int(os.environ.get("FORECASTIQ_GRID_TILE_CELLS", "64"))
+CACHE_TILES = int(os.environ.get("FORECASTIQ_GRID_CACHE_TILES", "512"))
+TILE_DIR = os.environ.get("FORECASTIQ_GRID_CACHE_DIR", os.path.join(CACHE_DIR, "grid"))
+MAX_CELLS = int(os.environ.get("FORECASTIQ_GRID_MAX_CELLS", "1000000"))
+THREADS = int(os.environ.get("FORECASTIQ_GRID_THREADS", "4"))
+CHUNK_ROWS = 16384
+
+LOCATION = ["latitude", "longitude"]
+OTHER_FEATURES = [f for f in required_features if f not in LOCATION]
+# Class predictions are stored as int8 codes into these label lists (-1 = not scored)
+LABELS = {
+    "rain_class": list(rain_occurred_map.values()),
+    "temp_class": list(temp_class_map.values()),
+}
+LAYERS = ["rainfall_mm", "temperature_c", "rain_class", "temp_class"]
+
+Raster = collections.namedtuple("Raster", ["latitudes", "longitudes", "values", "stats"])
+
+
+def cell_range(low, high, resolution):
+    """First and last lattice index of the cells whose centres lie in [low, high]."""
+    first = math.ceil(low / resolution - 0.5 - 1e-9)
+    last = math.floor(high / resolution - 0.5 + 1e-9)
+    return first, last
+
+
+def inputs_key(features=None, impute_key=None):
+    """Cache key of the 12 non-location inputs: the rounded fixed values or the imputation source."""
+    if impute_key is not None:
+        return impute_key
+    return "fixed:" + json.dumps({f: round(float(features[f]), 4) for f in OTHER_FEATURES}, sort_keys=True)
+
+
+class TileCache:
+    """LRU of scored tiles in memory, optionally backed by .npz files in `directory` (thread-safe)."""
+
+    def __init__(self, max_tiles=CACHE_TILES, directory=TILE_DIR):
+        self.max_tiles = max_tiles
+        self.directory = directory
+        self._tiles = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key[0], f"{name}.npz")
+
+    def get(self, key):
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return tile
+        if self.directory:
+            try:
+                with np.load(self._path(key)) as f:
+                    tile = {name: f[name] for name in LAYERS}
+            except (OSError, KeyError, ValueError):
+                tile = None
+            if tile is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._remember(key, tile)
+                return tile
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, tile):
+        self._remember(key, tile)
+        if self.directory:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.tmp{os.getpid()}-{threading.get_ident()}.npz"
+            np.savez(tmp, **tile)
+            os.replace(tmp, path)
+
+    def _remember(self, key, tile):
+        with self._lock:
+            self._tiles[key] = tile
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+
+    def retain(self, version):
+        """Drop the tiles of every other model version, in memory and on disk."""
+        import shutil
+
+        with self._lock:
+            for key in [key for key in self._tiles if key[0] != version]:
+                del self._tiles[key]
+        if self.directory and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name != version:
+                    shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {"tiles": len(self._tiles), "hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses}
+
+
+class GridForecaster:
+    """Score lat/lon grids with the four models, tile by tile, through a TileCache."""
+
+    def __init__(self, cache=None, threads=THREADS, chunk_rows=CHUNK_ROWS, tile_cells=TILE_CELLS):
+        self.cache = cache if cache is not None else TileCache()
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="grid")
+        self.chunk_rows = chunk_rows
+        self.tile_cells = tile_cells
+        self._predictor = None
+        self._version = None
+
+    def predictor(self):
+        """A predictor of the current models that leaves the prediction cache and drift monitor alone."""
+        from predictor import ForecastPredictor
+
+        models = load_models()
+        current = self._predictor
+        if current is None or any(current.models[name] is not model for name, model in models.items()):
+            # Grid cells are synthetic readings: they would only evict real rows and skew the drift statistics
+            current = self._predictor = ForecastPredictor(models=models, use_cache=False, use_drift_monitor=False)
+        return current
+
+    def tile_locations(self, tile, resolution):
+        """(cells, 2) latitude/longitude of the cell centres of one tile, row-major from the south-west."""
+        ty, tx = tile
+        n = self.tile_cells
+        latitudes = (ty * n + np.arange(n) + 0.5) * resolution
+        longitudes = (tx * n + np.arange(n) + 0.5) * resolution
+        lat, lon = np.meshgrid(latitudes, longitudes, indexing="ij")
+        return np.column_stack([lat.ravel(), lon.ravel()])
+
+    def build_matrix(self, locations, features=None, index=None, k=None):
+        """Feature matrix of the given locations, with fixed or station-imputed other features."""
+        if index is not None:
+            return index.impute_many(locations, k) if k else index.impute_many(locations)
+        X = np.empty((len(locations), len(required_features)))
+        for j, name in enumerate(required_features):
+            X[:, j] = float(features[name]) if name in OTHER_FEATURES else 0.0
+        X[:, required_features.index("latitude")] = locations[:, 0]
+        X[:, required_features.index("longitude")] = locations[:, 1]
+        return X
+
+    def score(self, X):
+        """Predict a large matrix in chunks on the thread pool; rows with NaN features are left unscored."""
+        n = len(X)
+        out = {
+            "rainfall_mm": np.full(n, np.nan, dtype=np.float32),
+            "temperature_c": np.full(n, np.nan, dtype=np.float32),
+            "rain_class": np.full(n, -1, dtype=np.int8),
+            "temp_class": np.full(n, -1, dtype=np.int8),
+        }
+        valid = np.flatnonzero(np.isfinite(X).all(axis=1))
+        if valid.size == 0:
+            return out
+        X = np.ascontiguousarray(X[valid], dtype=np.float32)
+        predictor = self.predictor()
+        chunks = [(start, X[start:start + self.chunk_rows]) for start in range(0, len(X), self.chunk_rows)]
+        results = self.executor.map(lambda chunk: (chunk[0], predictor.predict_matrix(chunk[1])), chunks)
+        for start, predictions in results:
+            rows = valid[start:start + self.chunk_rows]
+            out["rainfall_mm"][rows] = predictions["rainfall_mm"]
+            out["temperature_c"][rows] = predictions["temperature_c"]
+            for layer, labels in LABELS.items():
+                codes = {label: i for i, label in enumerate(labels)}
+                out[layer][rows] = [codes.get(label, -1) for label in predictions[layer].tolist()]
+        return out
+
+    def forecast(self, bbox, resolution, features=None, impute=False, k=None):
+        """Return the Raster of bbox = (south, north, west, east) at `resolution` degrees.
+
+        Pass the 12 other features as a dict, or impute=True to take them from
+        the nearest stations of every cell.
+        """
+        south, north, west, east = map(float, bbox)
+        if not (-90 <= south < north <= 90 and -180 <= west < east <= 180):
+            raise ValueError("Expected south < north within [-90, 90] and west < east within [-180, 180]")
+        if resolution <= 0:
+            raise ValueError("The resolution must be positive")
+        i0, i1 = cell_range(south, north, resolution)
+        j0, j1 = cell_range(west, east, resolution)
+        rows, cols = i1 - i0 + 1, j1 - j0 + 1
+        if rows <= 0 or cols <= 0:
+            raise ValueError("The box is smaller than one cell at this resolution")
+        if rows * cols > MAX_CELLS:
+            raise ValueError(f"{rows * cols} cells exceed the limit of {MAX_CELLS}; use a coarser resolution")
+        index = None
+        if impute:
+            from spatial_index import get_index
+            index = get_index()
+            key_inputs = inputs_key(impute_key=f"stations:{k or 'default'}:{index.source_sha256}")
+        else:
+            missing = [f for f in OTHER_FEATURES if f not in (features or {})]
+            if missing:
+                raise ValueError(f"Missing values for: {', '.join(missing)}")
+            key_inputs = inputs_key(features)
+
+        start = time.perf_counter()
+        n = self.tile_cells
+        version = model_version()
+        if version != self._version:
+            self.cache.retain(version)  # tiles of replaced models are never asked for again
+            self._version = version
+        tiles = [(ty, tx) for ty in range(i0 // n, i1 // n + 1) for tx in range(j0 // n, j1 // n + 1)]
+        keys = {tile: (version, repr(float(resolution)), tile, key_inputs) for tile in tiles}
+        found = {tile: self.cache.get(keys[tile]) for tile in tiles}
+        missing_tiles = [tile for tile, value in found.items() if value is None]
+        if missing_tiles:
+            locations = np.vstack([self.tile_locations(tile, resolution) for tile in missing_tiles])
+            scored = self.score(self.build_matrix(locations, features, index, k))
+            for number, tile in enumerate(missing_tiles):
+                part = slice(number * n * n, (number + 1) * n * n)
+                found[tile] = {layer: values[part].reshape(n, n) for layer, values in scored.items()}
+                self.cache.put(keys[tile], found[tile])
+
+        values = {
+            "rainfall_mm": np.full((rows, cols), np.nan, dtype=np.float32),
+            "temperature_c": np.full((rows, cols), np.nan, dtype=np.float32),
+            "rain_class": np.full((rows, cols), -1, dtype=np.int8),
+            "temp_class": np.full((rows, cols), -1, dtype=np.int8),
+        }
+        for (ty, tx), tile in found.items():
+            # Overlap of the tile with the requested cells, in lattice indices
+            a0, a1 = max(i0, ty * n), min(i1, ty * n + n - 1)
+            b0, b1 = max(j0, tx * n), min(j1, tx * n + n - 1)
+            for layer in LAYERS:
+                values[layer][a0 - i0:a1 - i0 + 1, b0 - j0:b1 - j0 + 1] = \
+                    tile[layer][a0 - ty * n:a1 - ty * n + 1, b0 - tx * n:b1 - tx * n + 1]
+        stats = {"cells": rows * cols, "tiles": len(tiles), "tiles_scored": len(missing_tiles),
+                 "cells_scored": len(missing_tiles) * n * n, "seconds": time.perf_counter() - start,
+                 "model_version": version}
+        return Raster((np.arange(i0, i1 + 1) + 0.5) * resolution, (np.arange(j0, j1 + 1) + 0.5) * resolution,
+                      values, stats)
+
+
+# Colour stops (blue -> green -> yellow) for the continuous layers, and one colour per class
+_STOPS = np.array([[68, 1, 84], [59, 82, 139], [33, 145, 140], [94, 201, 98], [253, 231, 37]], dtype=np.float64)
+_CLASS_COLOURS = np.array([[49, 130, 189], [116, 196, 118], [253, 141, 60], [222, 45, 38]], dtype=np.uint8)
+_MISSING = np.array([220, 220, 220], dtype=np.uint8)
+
+
+def to_rgb(raster, layer, scale=1):
+    """Return (RGB uint8 image with north at the top, (low, high) or label list) for one layer."""
+    values = raster.values[layer]
+    if layer in LABELS:
+        image = np.where((values >= 0)[..., np.newaxis], _CLASS_COLOURS[np.clip(values, 0, None) % len(_CLASS_COLOURS)], _MISSING)
+        legend = LABELS[layer]
+    else:
+        finite = np.isfinite(values)
+        low, high = (float(values[finite].min()), float(values[finite].max())) if finite.any() else (0.0, 1.0)
+        position = np.clip((np.where(finite, values, low) - low) / ((high - low) or 1.0), 0, 1) * (len(_STOPS) - 1)
+        lower = np.minimum(position.astype(int), len(_STOPS) - 2)
+        weight = (position - lower)[..., np.newaxis]
+        image = ((1 - weight) * _STOPS[lower] + weight * _STOPS[lower + 1]).astype(np.uint8)
+        image[~finite] = _MISSING
+        legend = (low, high)
+    image = np.flipud(image)
+    if scale > 1:
+        image = image.repeat(scale, axis=0).repeat(scale, axis=1)
+    return image, legend
+
+
+_lock = threading.Lock()
+_default = None
+
+
+def get_forecaster():
+    """Return the process-wide GridForecaster (its tile cache is shared by every session)."""
+    global _default
+    with _lock:
+        if _default is None:
+            _default = GridForecaster()
+        return _default
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a latitude/longitude grid and save the rasters.")
+    parser.add_argument("--bbox", nargs=4, type=float, required=True, metavar=("SOUTH", "NORTH", "WEST", "EAST"))
+    parser.add_argument("--resolution", type=float, default=0.25, help="cell size in degrees")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--impute", action="store_true", help="take the other 12 features from the nearest stations")
+    source.add_argument("--features", help="JSON file with fixed values of the other 12 features")
+    parser.add_argument("--output", default=None, help="write the rasters to this .npz file")
+    args = parser.parse_args(argv)
+
+    try:
+        features = None
+        if args.features:
+            with open(args.features) as f:
+                features = json.load(f)
+        raster = get_forecaster().forecast(args.bbox, args.resolution, features, impute=args.impute)
+    except (OSError, ValueError) as e:
+        print(f"Grid forecast failed: {e}", file=sys.stderr)
+        return 1
+    stats = raster.stats
+    print(f"{len(raster.latitudes)} x {len(raster.longitudes)} cells; {stats['tiles']} tiles, "
+          f"{stats['tiles_scored']} scored ({stats['cells_scored']} cells) in {stats['seconds']:.2f}s")
+    for layer in ("rainfall_mm", "temperature_c"):
+        values = raster.values[layer]
+        if np.isfinite(values).any():
+            print(f"  {layer:14s} min {np.nanmin(values):8.2f}  mean {np.nanmean(values):8.2f}  max {np.nanmax(values):8.2f}")
+    if args.output:
+        np.savez_compressed(args.output, latitudes=raster.latitudes, longitudes=raster.longitudes, **raster.values)
+        print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
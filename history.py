@@ -0,0 +1,361 @@
+"""Persistent history of the served predictions (SQLite in WAL mode).
+
+Every prediction made by the app, batch.py, bulk_reports.py and service.py
+is recorded with its 14 inputs, the four outputs, the model version, the
+source and how long the predict call took. Recording never touches the disk
+on the request path: `record` only puts the arrays on a queue bounded by
+FORECASTIQ_HISTORY_QUEUE_ROWS rows (and counts them as dropped if it is
+full). A background writer thread turns them into rows, FORECASTIQ_HISTORY_BATCH
+at a time so a large batch chunk does not hold the GIL for long, and commits
+them in one transaction once that many rows have gathered or the oldest has
+waited FORECASTIQ_HISTORY_FLUSH_SECONDS. What is still queued is written when
+the process exits. The service, batch.py, bulk_reports.py and the app open
+the database when they start (`get_history`), not on their first prediction.
+
+WAL mode lets readers query the file while the writers (one per process)
+append to it. Indexes on the time, the location (latitude, longitude, time)
+and the model version keep queries such as "rain predictions within 25 km of
+this station in the last 7 days" fast over millions of rows; `query` narrows
+a location to a latitude/longitude box through the index and then keeps the
+rows within the haversine radius.
+
+Environment variables:
+    FORECASTIQ_HISTORY_DB             database file, empty to disable the history
+                                      (default prediction_history.db in FORECASTIQ_CACHE_DIR)
+    FORECASTIQ_HISTORY_BATCH          rows gathered before a commit (default 1000)
+    FORECASTIQ_HISTORY_FLUSH_SECONDS  longest a row waits for its commit (default 1.0)
+    FORECASTIQ_HISTORY_QUEUE_ROWS     rows queued before new ones are dropped (default 250000)
+
+Usage:
+    python history.py stats
+    python history.py query --near 28.61 77.21 --radius-km 25 --since 7d --rain-class Rain
+    python history.py query --model-version 3f2a9c1e0b7d4a55 --output served.csv
+"""
+import argparse
+import atexit
+import math
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+
+from data_cache import CACHE_DIR
+from models import model_version, required_features
+from predictor import PREDICTION_COLUMNS
+
+HISTORY_DB = os.environ.get("FORECASTIQ_HISTORY_DB", os.path.join(CACHE_DIR, "prediction_history.db"))
+BATCH_ROWS = int(os.environ.get("FORECASTIQ_HISTORY_BATCH", "1000"))
+FLUSH_SECONDS = float(os.environ.get("FORECASTIQ_HISTORY_FLUSH_SECONDS", "1.0"))
+QUEUE_ROWS = int(os.environ.get("FORECASTIQ_HISTORY_QUEUE_ROWS", "250000"))
+
+# SQL column names of the features ("air_quality_PM2.5" -> "air_quality_PM25")
+FEATURE_COLUMNS = [f.replace(".", "") for f in required_features]
+COLUMNS = (["ts", "source", "model_version"] + FEATURE_COLUMNS + PREDICTION_COLUMNS
+           + ["latency_ms", "batch_rows"])
+EARTH_RADIUS_KM = 6371.0
+
+SCHEMA = [
+    f"""CREATE TABLE IF NOT EXISTS predictions (
+        id INTEGER PRIMARY KEY,
+        ts REAL NOT NULL,
+        source TEXT NOT NULL,
+        model_version TEXT,
+        {", ".join(f"{column} REAL" for column in FEATURE_COLUMNS)},
+        rainfall_mm REAL,
+        temperature_c REAL,
+        rain_class TEXT,
+        temp_class TEXT,
+        latency_ms REAL,
+        batch_rows INTEGER
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_predictions_ts ON predictions (ts)",
+    "CREATE INDEX IF NOT EXISTS idx_predictions_location ON predictions (latitude, longitude, ts)",
+    "CREATE INDEX IF NOT EXISTS idx_predictions_model ON predictions (model_version, ts)",
+]
+
+_STOP = object()
+
+
+def connect(path=HISTORY_DB):
+    """Open the database in WAL mode and create the table and indexes if needed."""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30.0)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")  # durable at each checkpoint, no fsync per commit
+    with connection:
+        for statement in SCHEMA:
+            connection.execute(statement)
+    return connection
+
+
+class HistoryWriter:
+    """Queue predict calls and commit them from a background thread in batches."""
+
+    def __init__(self, path=HISTORY_DB, batch_rows=BATCH_ROWS, flush_seconds=FLUSH_SECONDS, queue_rows=QUEUE_ROWS):
+        self.path = path
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.queue_rows = queue_rows
+        self._queue = queue.Queue()  # bounded by the rows it holds (_queued), not by the number of calls
+        self._queued = 0
+        self._lock = threading.Lock()
+        self._version = (float("-inf"), None)  # (checked at, model_version)
+        self._counters = dict.fromkeys(["recorded", "written", "dropped", "batches", "errors"], 0)
+        connect(path).close()  # fail here, not on the writer thread, if the file cannot be opened
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def _model_version(self):
+        # model_version stats the model files; once a second is enough
+        now = time.monotonic()
+        with self._lock:
+            checked, version = self._version
+            if now - checked >= 1.0:
+                version = model_version()
+                self._version = (now, version)
+            return version
+
+    def record(self, source, X, predictions, seconds=None):
+        """Queue the rows of one predict call; returns False if they were dropped (queue full)."""
+        n = len(X)
+        if n == 0:
+            return True
+        item = (time.time(), source, self._model_version(), X, predictions, seconds, n)
+        with self._lock:
+            if self._queued + n > self.queue_rows:
+                self._counters["dropped"] += n
+                return False
+            self._queued += n
+            self._counters["recorded"] += n
+        self._queue.put_nowait(item)
+        return True
+
+    def _rows(self, item):
+        """Yield the rows of one queued predict call, batch_rows at a time."""
+        ts, source, version, X, predictions, seconds, n = item
+        X = np.asarray(X).reshape(n, -1)
+        latency_ms = seconds * 1000.0 if seconds is not None else None
+        for start in range(0, n, self.batch_rows):
+            stop = start + self.batch_rows
+            features = np.asarray(X[start:stop], dtype=np.float64).tolist()
+            outputs = zip(*(np.asarray(predictions[column][start:stop]).tolist() for column in PREDICTION_COLUMNS))
+            yield [(ts, source, version, *row, *output, latency_ms, n) for row, output in zip(features, outputs)]
+
+    def _run(self):
+        connection = connect(self.path)
+        insert = f"INSERT INTO predictions ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+        pending = []
+        deadline = None
+        stopping = False
+        while not stopping:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                stopping = True
+            elif item is not None:
+                for rows in self._rows(item):
+                    pending += rows
+                    deadline = deadline or time.monotonic() + self.flush_seconds
+                    if len(pending) >= self.batch_rows:
+                        self._write(connection, insert, pending)
+                        pending = []
+                        deadline = None
+                with self._lock:
+                    self._queued -= item[-1]
+            if pending and (stopping or time.monotonic() >= deadline):
+                self._write(connection, insert, pending)
+                pending = []
+                deadline = None
+        connection.close()
+
+    def _write(self, connection, insert, rows):
+        try:
+            with connection:
+                connection.executemany(insert, rows)
+            with self._lock:
+                self._counters["written"] += len(rows)
+                self._counters["batches"] += 1
+        except sqlite3.Error as e:
+            print(f"Prediction history write failed: {e}", file=sys.stderr)
+            with self._lock:
+                self._counters["errors"] += 1
+
+    def close(self, timeout=30.0):
+        """Write what is still queued and stop the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, queued=self._queued, path=self.path)
+
+
+_lock = threading.Lock()
+_default = None
+
+
+def get_history():
+    """Return the process-wide HistoryWriter, or None when FORECASTIQ_HISTORY_DB is empty or unusable."""
+    global _default
+    if not HISTORY_DB:
+        return None
+    with _lock:
+        if _default is None:
+            try:
+                _default = HistoryWriter()
+            except sqlite3.Error as e:
+                print(f"Prediction history disabled: {e}", file=sys.stderr)
+                _default = False
+            else:
+                atexit.register(_default.close)
+        return _default or None
+
+
+def record(source, X, predictions, seconds=None):
+    """Record the rows of one predict call (features X, prediction columns) in the process' history."""
+    history = get_history()
+    if history is not None:
+        history.record(source, X, predictions, seconds)
+
+
+def parse_since(text, now=None):
+    """Turn "7d", "12h", "30m" or an ISO date/time into a Unix timestamp."""
+    now = time.time() if now is None else now
+    units = {"d": 86400, "h": 3600, "m": 60, "s": 1}
+    if text and text[-1] in units and text[:-1].replace(".", "", 1).isdigit():
+        return now - float(text[:-1]) * units[text[-1]]
+    import datetime
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(v) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def query(path=HISTORY_DB, since=None, until=None, near=None, radius_km=25.0, model_version=None,
+          source=None, rain_class=None, temp_class=None, limit=None):
+    """Return the matching predictions as a DataFrame, newest first.
+
+    `since`/`until` are Unix timestamps and `near` a (latitude, longitude)
+    pair; with `near` the result has a distance_km column.
+    """
+    import pandas as pd
+
+    clauses, params = [], []
+    if near is not None:
+        # Box around the circle, answered from the (latitude, longitude, ts) index
+        lat, lon = near
+        dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+        dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+        clauses += ["latitude BETWEEN ? AND ?", "longitude BETWEEN ? AND ?"]
+        params += [lat - dlat, lat + dlat, lon - dlon, lon + dlon]
+    for column, operator, value in (("ts", ">=", since), ("ts", "<", until), ("model_version", "=", model_version),
+                                    ("source", "=", source), ("rain_class", "=", rain_class),
+                                    ("temp_class", "=", temp_class)):
+        if value is not None:
+            clauses.append(f"{column} {operator} ?")
+            params.append(value)
+    sql = "SELECT * FROM predictions"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY ts DESC"
+    if limit and near is None:
+        sql += f" LIMIT {int(limit)}"
+    connection = connect(path)
+    try:
+        frame = pd.read_sql_query(sql, connection, params=params)
+    finally:
+        connection.close()
+    if near is not None:
+        frame["distance_km"] = haversine_km(near[0], near[1], frame["latitude"].to_numpy(), frame["longitude"].to_numpy())
+        frame = frame[frame["distance_km"] <= radius_km]
+        if limit:
+            frame = frame.head(limit)
+    return frame.reset_index(drop=True)
+
+
+def summary(path=HISTORY_DB):
+    """Row counts per source and per model version, and the time range of the history."""
+    connection = connect(path)
+    try:
+        rows, first, last = connection.execute("SELECT COUNT(*), MIN(ts), MAX(ts) FROM predictions").fetchone()
+        sources = dict(connection.execute("SELECT source, COUNT(*) FROM predictions GROUP BY source"))
+        versions = dict(connection.execute(
+            "SELECT model_version, COUNT(*) FROM predictions GROUP BY model_version ORDER BY MAX(ts) DESC"))
+    finally:
+        connection.close()
+    return {"rows": rows, "first": first, "last": last, "sources": sources, "model_versions": versions,
+            "bytes": os.path.getsize(path)}
+
+
+def _time(ts):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts)) if ts is not None else "-"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and query the prediction history.")
+    parser.add_argument("--db", default=HISTORY_DB, help="database file (default FORECASTIQ_HISTORY_DB)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="rows per source and model version")
+    find = sub.add_parser("query", help="list predictions (newest first)")
+    find.add_argument("--since", help='e.g. "7d", "12h" or "2024-05-01"')
+    find.add_argument("--until", help="same formats as --since")
+    find.add_argument("--near", nargs=2, type=float, metavar=("LAT", "LON"))
+    find.add_argument("--radius-km", type=float, default=25.0)
+    find.add_argument("--model-version")
+    find.add_argument("--source", choices=["app", "batch", "bulk_reports", "service"])
+    find.add_argument("--rain-class", choices=["Rain", "No Rain"])
+    find.add_argument("--temp-class", choices=["Cold", "Moderate", "Hot"])
+    find.add_argument("--limit", type=int, default=20, help="rows shown (0 = all)")
+    find.add_argument("--output", help="write the rows to this CSV file instead of printing them")
+    args = parser.parse_args(argv)
+
+    if not args.db or not os.path.exists(args.db):
+        print(f"No prediction history at {args.db or '(disabled)'}", file=sys.stderr)
+        return 1
+    try:
+        if args.command == "stats":
+            info = summary(args.db)
+            print(f"{info['rows']} predictions from {_time(info['first'])} to {_time(info['last'])} "
+                  f"({info['bytes'] / 1e6:.1f} MB)")
+            for name, count in info["sources"].items():
+                print(f"  source {name}: {count}")
+            for version, count in info["model_versions"].items():
+                print(f"  model version {version}: {count}")
+            return 0
+        import pandas  # loaded here, so the timing below covers only the query
+
+        start = time.perf_counter()
+        frame = query(args.db, parse_since(args.since) if args.since else None,
+                      parse_since(args.until) if args.until else None, args.near, args.radius_km,
+                      args.model_version, args.source, args.rain_class, args.temp_class, args.limit or None)
+        seconds = time.perf_counter() - start
+    except (sqlite3.Error, ValueError) as e:
+        print(f"History query failed: {e}", file=sys.stderr)
+        return 1
+    if args.output:
+        frame.to_csv(args.output, index=False)
+        print(f"Wrote {len(frame)} rows to {args.output} in {seconds * 1000:.0f} ms")
+        return 0
+    frame["ts"] = [_time(ts) for ts in frame["ts"]]
+    frame = frame.round({"latitude": 4, "longitude": 4, "distance_km": 2})
+    shown = ["ts", "source", "latitude", "longitude"] + PREDICTION_COLUMNS
+    shown += ["distance_km"] if "distance_km" in frame else []
+    print(frame[shown].to_string(index=False) if len(frame) else "No matching predictions")
+    print(f"{len(frame)} rows in {seconds * 1000:.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
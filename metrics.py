@@ -0,0 +1,279 @@
+"""Per-stage latency metrics and an opt-in profiling hook for the prediction path.
+
+Every stage of a request (model load, each model's predict, HTML report, PDF
+render, the app's submit flow, each service endpoint) is timed with
+
+    with metrics.timed("predict"):
+        ...
+
+Each stage keeps a cumulative latency histogram (Prometheus buckets, count and
+sum) and a rolling window of its most recent observations for the p50/p90/p99
+gauges. `render_prometheus()` returns everything in the Prometheus text
+format; service.py serves it at GET /metrics and the Streamlit app, which has
+no endpoint of its own, writes it to FORECASTIQ_METRICS_FILE (e.g. for the
+node_exporter textfile collector).
+
+Profiling is off by default. With FORECASTIQ_PROFILE (or the control file,
+which is re-read at most once a second so it can be changed in a running
+process) every Nth request wrapped in `profiled(stage)` is profiled:
+
+    cprofile:100      a cProfile of every 100th request -> <stage>-<time>.prof
+    tracemalloc:500   allocation tracing on, a snapshot every 500th request -> .snapshot
+    off               (or an empty / missing control file)
+
+Environment variables:
+    FORECASTIQ_METRICS_FILE      write the Prometheus text to this file (default: not written)
+    FORECASTIQ_METRICS_INTERVAL  seconds between writes of the metrics file (default 15)
+    FORECASTIQ_METRICS_WINDOW    recent observations kept per stage for the quantiles (default 1024)
+    FORECASTIQ_PROFILE           profiling mode when there is no control file (default off)
+    FORECASTIQ_PROFILE_CONTROL   control file holding a mode like "cprofile:100" (default forecastiq_profile.txt)
+    FORECASTIQ_PROFILE_DIR       where profiles and snapshots are written (default profiles)
+"""
+import collections
+import contextlib
+import os
+import threading
+import time
+
+METRICS_FILE = os.environ.get("FORECASTIQ_METRICS_FILE", "")
+METRICS_INTERVAL = float(os.environ.get("FORECASTIQ_METRICS_INTERVAL", "15"))
+METRICS_WINDOW = int(os.environ.get("FORECASTIQ_METRICS_WINDOW", "1024"))
+PROFILE_MODE = os.environ.get("FORECASTIQ_PROFILE", "")
+PROFILE_CONTROL = os.environ.get("FORECASTIQ_PROFILE_CONTROL", "forecastiq_profile.txt")
+PROFILE_DIR = os.environ.get("FORECASTIQ_PROFILE_DIR", "profiles")
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+QUANTILES = [0.5, 0.9, 0.99]
+
+
+class StageHistogram:
+    """Cumulative bucket counts plus a rolling window of recent latencies for one stage."""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # the last one is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.recent = collections.deque(maxlen=window)
+
+    def observe(self, seconds):
+        for i, upper in enumerate(LATENCY_BUCKETS):
+            if seconds <= upper:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+        self.count += 1
+        self.total += seconds
+        self.recent.append(seconds)
+
+    def quantiles(self):
+        """Return {q: seconds} over the recent window (empty if nothing was observed)."""
+        values = sorted(self.recent)
+        if not values:
+            return {}
+        return {q: values[min(len(values) - 1, int(q * len(values)))] for q in QUANTILES}
+
+
+_lock = threading.Lock()
+_stages = {}  # stage -> StageHistogram
+
+
+def observe(stage, seconds):
+    """Record one duration (in seconds) for `stage`."""
+    with _lock:
+        histogram = _stages.get(stage)
+        if histogram is None:
+            histogram = _stages[stage] = StageHistogram()
+        histogram.observe(seconds)
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """Time the body of the with-block as one observation of `stage` (also when it raises)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def stage_stats():
+    """Return stage -> {count, mean_ms, p50_ms, p90_ms, p99_ms} for JSON endpoints."""
+    with _lock:
+        stats = {}
+        for stage, histogram in sorted(_stages.items()):
+            entry = {"count": histogram.count,
+                     "mean_ms": 1000 * histogram.total / histogram.count if histogram.count else None}
+            for q, seconds in histogram.quantiles().items():
+                entry[f"p{int(q * 100)}_ms"] = 1000 * seconds
+            stats[stage] = entry
+        return stats
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+def render_prometheus(gauges=None):
+    """Return every stage histogram (and optional {name: value} gauges) in Prometheus text format.
+
+    Gauge names may include labels; samples of one family share a TYPE line.
+    """
+    lines = [
+        "# HELP forecastiq_stage_seconds Time spent in each stage of the prediction path.",
+        "# TYPE forecastiq_stage_seconds histogram",
+    ]
+    recent = [
+        "# HELP forecastiq_stage_recent_seconds Latency quantiles over the most recent observations of each stage.",
+        "# TYPE forecastiq_stage_recent_seconds gauge",
+    ]
+    with _lock:
+        for stage, histogram in sorted(_stages.items()):
+            cumulative = 0
+            for upper, count in zip(LATENCY_BUCKETS + ["+Inf"], histogram.buckets):
+                cumulative += count
+                lines.append(f"forecastiq_stage_seconds_bucket{_labels(stage=stage, le=upper)} {cumulative}")
+            lines.append(f"forecastiq_stage_seconds_sum{_labels(stage=stage)} {histogram.total:.6f}")
+            lines.append(f"forecastiq_stage_seconds_count{_labels(stage=stage)} {histogram.count}")
+            for q, seconds in histogram.quantiles().items():
+                recent.append(f"forecastiq_stage_recent_seconds{_labels(stage=stage, quantile=q)} {seconds:.6f}")
+    lines += recent
+    families = set()
+    # A gauge name may carry labels, e.g. 'forecastiq_drift_psi{feature="humidity"}'
+    for name, value in sorted((gauges or {}).items(), key=lambda item: (item[0].split("{")[0], item[0])):
+        if value is None:
+            continue
+        family = name.split("{")[0]
+        if family not in families:
+            families.add(family)
+            lines.append(f"# TYPE {family} gauge")
+        lines.append(f"{name} {float(value):g}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_file(path, gauges=None):
+    """Write the Prometheus text to `path` (atomic replace, so scrapers never see half a file)."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render_prometheus(gauges))
+    os.replace(tmp, path)
+
+
+_exporter = None
+
+
+def start_file_exporter(path=METRICS_FILE, interval=METRICS_INTERVAL, gauges_fn=None):
+    """Write the metrics file every `interval` seconds on a daemon thread (once per process).
+
+    Does nothing when no path is configured.
+    """
+    global _exporter
+    if not path:
+        return
+    with _lock:
+        if _exporter is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    write_metrics_file(path, gauges_fn() if gauges_fn else None)
+                except OSError as e:
+                    print(f"Writing metrics to {path} failed: {e}")
+
+        _exporter = threading.Thread(target=run, name="metrics-exporter", daemon=True)
+        _exporter.start()
+
+
+_profile_lock = threading.Lock()
+_profile_busy = threading.Lock()  # only one cProfile can run at a time
+_profile_state = {"checked": 0.0, "mode": None, "every": 0}
+_profile_counts = collections.Counter()
+
+
+def parse_profile_mode(text):
+    """Parse "cprofile:100" / "tracemalloc:500" / "off" into (mode, every); (None, 0) when off."""
+    text = (text or "").strip().lower()
+    mode, _, every = text.partition(":")
+    if mode not in ("cprofile", "tracemalloc"):
+        return None, 0
+    try:
+        return mode, max(1, int(every or 1))
+    except ValueError:
+        print(f"Invalid profiling setting: {text!r}")
+        return None, 0
+
+
+def profile_settings(now=None):
+    """Return the current (mode, every), re-reading the control file at most once a second."""
+    now = time.monotonic() if now is None else now
+    with _profile_lock:
+        if now - _profile_state["checked"] < 1.0:
+            return _profile_state["mode"], _profile_state["every"]
+        _profile_state["checked"] = now
+        try:
+            with open(PROFILE_CONTROL, encoding="utf-8") as f:
+                text = f.read()
+        except OSError:
+            text = PROFILE_MODE
+        mode, every = parse_profile_mode(text)
+        if mode != _profile_state["mode"]:
+            import tracemalloc
+            if mode == "tracemalloc" and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            elif _profile_state["mode"] == "tracemalloc" and tracemalloc.is_tracing():
+                tracemalloc.stop()
+        _profile_state["mode"], _profile_state["every"] = mode, every
+        return mode, every
+
+
+def _profile_path(stage, number, suffix):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = "".join(c if c.isalnum() or c in "._-" else "_" for c in stage).strip("_")
+    return os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{number}{suffix}")
+
+
+@contextlib.contextmanager
+def profiled(stage):
+    """Profile every Nth execution of the with-block while profiling is switched on.
+
+    cProfile only sees the calling thread, so wrap synchronous code (the
+    predictor, the app's submit flow) rather than coroutines.
+    """
+    mode, every = profile_settings()
+    if mode is None:
+        yield
+        return
+    with _profile_lock:
+        _profile_counts[stage] += 1
+        number = _profile_counts[stage]
+    sample = number % every == 0
+    if not sample:
+        yield
+        return
+    if mode == "tracemalloc":
+        yield
+        import tracemalloc
+        if tracemalloc.is_tracing():
+            path = _profile_path(stage, number, ".snapshot")
+            tracemalloc.take_snapshot().dump(path)
+            print(f"tracemalloc snapshot of {stage} written to {path}")
+        return
+    if not _profile_busy.acquire(blocking=False):
+        yield  # another request is being profiled
+        return
+    import cProfile
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+        path = _profile_path(stage, number, ".prof")
+        profile.dump_stats(path)
+        print(f"Profile of {stage} written to {path}")
+    finally:
+        _profile_busy.release()
@@ -0,0 +1,141 @@
+"""Micro-batching scheduler for single-row predictions.
+
+Every `predict` call on a forest pays a fixed dispatch cost for walking all of
+its trees, whether it scores one row or a thousand. Under concurrent load it is
+much cheaper to collect the single-row requests that arrive within a short
+window, score them with one batched call per model, and hand each caller its
+own row back.
+
+    batcher = MicroBatcher(predictor.predict_matrix, max_batch_size=64, max_wait_ms=5)
+    future = batcher.submit(row)      # row: 1-D array in required_features order
+    result = future.result()          # {"rainfall_mm": ..., "temperature_c": ..., ...}
+"""
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+# Upper bounds of the batch-size histogram buckets
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-row requests into batched predict calls.
+
+    predict_fn receives a 2-D float array and must return a dict of
+    equal-length columns; row i of every column is the answer to request i.
+    A batch is dispatched as soon as it holds max_batch_size rows, or
+    max_wait_ms after its first row arrived, whichever comes first.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_ms=5.0, latency_window=10_000):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._latencies = collections.deque(maxlen=latency_window)
+        self._batch_sizes = collections.Counter()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="microbatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, row):
+        """Queue one feature row and return a Future for its prediction dict."""
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+        future = Future()
+        self._queue.put((np.asarray(row, dtype=np.float32), future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        """Block for the first request, then gather more until the window closes."""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # let the run loop see the shutdown signal
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            # Requests cancelled while queued (e.g. the client went away) are not scored
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._dispatch(batch)
+            except Exception as e:
+                # Never let one batch stop the thread; every later submit() would hang
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _dispatch(self, batch):
+        rows, futures, started = zip(*batch)
+        try:
+            columns = self.predict_fn(np.vstack(rows))
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        for i, future in enumerate(futures):
+            future.set_result({name: values[i] for name, values in columns.items()})
+        now = time.perf_counter()
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._batch_sizes[_bucket(len(batch))] += 1
+            self._latencies.extend(now - t for t in started)
+
+    def stats(self):
+        """Return request/batch counters, latency percentiles (ms) and the batch-size histogram."""
+        with self._stats_lock:
+            latencies = np.fromiter(self._latencies, dtype=np.float64) * 1000.0
+            histogram = {f"<={b}": self._batch_sizes.get(b, 0) for b in BATCH_SIZE_BUCKETS}
+            histogram["+Inf"] = self._batch_sizes.get(None, 0)
+            batches, requests = self._batches, self._requests
+        return {
+            "requests": requests,
+            "batches": batches,
+            "mean_batch_size": requests / batches if batches else 0.0,
+            "latency_ms": {
+                "p50": float(np.percentile(latencies, 50)) if latencies.size else None,
+                "p99": float(np.percentile(latencies, 99)) if latencies.size else None,
+            },
+            "batch_size_histogram": histogram,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+        }
+
+    def close(self):
+        """Stop accepting requests; queued requests are still answered."""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+
+
+def _bucket(size):
+    for upper in BATCH_SIZE_BUCKETS:
+        if size <= upper:
+            return upper
+    return None
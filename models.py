@@ -0,0 +1,149 @@
+"""Process-wide registry for the pre-trained ExtraTrees models.
+
+Streamlit re-executes app.py on every widget interaction, but imported modules
+stay in sys.modules, so models loaded here are shared by every rerun and every
+session of the same process. A model is only deserialized again when its .pkl
+file changes on disk.
+"""
+import hashlib
+import os
+import threading
+
+from metrics import timed
+
+MODEL_DIR = os.environ.get("FORECASTIQ_MODEL_DIR", os.path.dirname(os.path.abspath(__file__)))
+
+MODEL_FILES = {
+    "et_reg_rain": "et_reg_rain.pkl",
+    "et_reg_temp": "et_reg_temp.pkl",
+    "et_cls_rain": "et_cls_rain.pkl",
+    "et_cls_temp": "et_cls_temp.pkl",
+}
+
+# Optional single forest predicting [log_precip_mm, temperature_celsius] (see final1.ipynb)
+MULTI_OUTPUT_NAME = "et_reg_multi"
+MULTI_OUTPUT_FILE = "et_reg_multi.pkl"
+
+# Feature order the models were trained on (see final1.ipynb)
+required_features = [
+    "latitude", "longitude", "humidity", "wind_kph", "cloud", "pressure_mb", "uv_index", "feels_like_celsius",
+    "air_quality_Carbon_Monoxide", "air_quality_Ozone", "air_quality_Nitrogen_dioxide",
+    "air_quality_Sulphur_dioxide", "air_quality_PM2.5", "air_quality_PM10"
+]
+
+rain_occurred_map = {0: "No Rain", 1: "Rain"}
+temp_class_map = {0: "Cold", 1: "Moderate", 2: "Hot"}
+
+# Set FORECASTIQ_MMAP=1 to memory-map the numpy arrays inside the pickles
+# (only works for uncompressed joblib dumps, which is what the notebook writes).
+# Worker processes then read those arrays through the shared page cache.
+DEFAULT_MMAP_MODE = "r" if os.environ.get("FORECASTIQ_MMAP", "") not in ("", "0") else None
+
+# Set FORECASTIQ_ENGINE=1 to serve predictions from the compiled array engine
+# (see tree_engine.py) instead of the sklearn pickles.
+ENGINE_FILE = "forest_engine.npz"
+DEFAULT_USE_ENGINE = os.environ.get("FORECASTIQ_ENGINE", "") not in ("", "0")
+
+_lock = threading.Lock()
+_registry = {}  # name -> {"stat": (mtime_ns, size), "sha256": str or None, "model": estimator}
+
+
+def model_path(name):
+    """Return the absolute path of a model file given its registry name."""
+    return os.path.join(MODEL_DIR, MODEL_FILES.get(name, name))
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Hash a file in chunks so large forests do not need to fit in memory twice."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stat(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def model_version():
+    """Short fingerprint of the model files on disk (mtime and size of each).
+
+    It changes whenever a model, the multi-output model or forest_engine.npz
+    is exported again, so caches of predictions can be invalidated cheaply.
+    """
+    stats = []
+    for file_name in list(MODEL_FILES.values()) + [MULTI_OUTPUT_FILE, ENGINE_FILE]:
+        try:
+            stats.append(_stat(os.path.join(MODEL_DIR, file_name)))
+        except OSError:
+            stats.append(None)
+    return hashlib.sha256(repr(stats).encode("ascii")).hexdigest()[:16]
+
+
+def load_model(name, mmap_mode=DEFAULT_MMAP_MODE, check_hash=False):
+    """Return the cached model `name`, reloading it only if its file changed.
+
+    The cheap (mtime, size) check runs on every call. With check_hash=True a
+    changed stat is confirmed against the file's SHA-256 first, so a file that
+    was merely touched or copied over with identical bytes is not reloaded.
+    """
+    path = model_path(name)
+    stat = _stat(path)
+    with _lock:
+        entry = _registry.get(name)
+        if entry is not None and entry["stat"] == stat:
+            return entry["model"]
+        digest = file_sha256(path) if check_hash else None
+        if entry is not None and digest is not None and entry["sha256"] == digest:
+            entry["stat"] = stat
+            return entry["model"]
+        with timed("model_load"):
+            import joblib  # imported on first load; not needed when serving from the compiled engine
+            model = joblib.load(path, mmap_mode=mmap_mode)
+        _registry[name] = {"stat": stat, "sha256": digest, "model": model}
+        return model
+
+
+def load_engine(path=None):
+    """Return the compiled forests from forest_engine.npz, reloading it if the file changed."""
+    from tree_engine import load_forests
+
+    path = path or os.path.join(MODEL_DIR, ENGINE_FILE)
+    stat = _stat(path)
+    with _lock:
+        entry = _registry.get(ENGINE_FILE)
+        if entry is None or entry["stat"] != stat:
+            with timed("model_load"):
+                entry = {"stat": stat, "sha256": None, "model": load_forests(path)}
+            _registry[ENGINE_FILE] = entry
+        return entry["model"]
+
+
+def load_models(mmap_mode=DEFAULT_MMAP_MODE, check_hash=False, use_engine=DEFAULT_USE_ENGINE):
+    """Return a dict with all four models, keyed like MODEL_FILES.
+
+    With use_engine=True the models come from the compiled array engine,
+    which exposes the same predict/classes_ interface.
+    """
+    if use_engine:
+        engine = load_engine()
+        return {name: engine[name] for name in MODEL_FILES}
+    return {name: load_model(name, mmap_mode=mmap_mode, check_hash=check_hash) for name in MODEL_FILES}
+
+
+def load_multi_output(use_engine=DEFAULT_USE_ENGINE):
+    """Return the optional multi-output regressor, or None if it was not exported."""
+    if use_engine:
+        return load_engine().get(MULTI_OUTPUT_NAME)
+    if not os.path.exists(model_path(MULTI_OUTPUT_FILE)):
+        print(f"Multi-output model {MULTI_OUTPUT_FILE} not found; using the separate regressors")
+        return None
+    return load_model(MULTI_OUTPUT_FILE)
+
+
+def clear():
+    """Drop every cached model (mainly useful for tests and benchmarks)."""
+    with _lock:
+        _registry.clear()
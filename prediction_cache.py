@@ -0,0 +1,124 @@
+"""Memoized predictions for repeated station readings.
+
+Dashboards refresh and users re-submit the same form, so many requests carry
+readings that were already scored. `PredictionCache` maps the 14 feature
+values, rounded to `decimals` places, to the four predictions of that row:
+
+- bounded size with least-recently-used eviction,
+- entries expire after `ttl` seconds,
+- hit / miss / eviction counters (`stats()`),
+- cleared automatically when a model file changes on disk
+  (checked through models.model_version at most once per `check_interval`).
+
+ForecastPredictor consults the cache row by row in `predict_matrix`, so the
+app, batch.py and service.py all use it. Only the rows that miss are sent to
+the models.
+
+Environment variables:
+    FORECASTIQ_PREDICTION_CACHE_SIZE      max cached rows, 0 disables the cache (default 10000)
+    FORECASTIQ_PREDICTION_CACHE_TTL       seconds an entry stays valid (default 3600)
+    FORECASTIQ_PREDICTION_CACHE_DECIMALS  rounding applied to the features (default 4)
+"""
+import collections
+import os
+import threading
+import time
+
+import numpy as np
+
+from models import model_version
+
+DEFAULT_MAX_SIZE = int(os.environ.get("FORECASTIQ_PREDICTION_CACHE_SIZE", "10000"))
+DEFAULT_TTL = float(os.environ.get("FORECASTIQ_PREDICTION_CACHE_TTL", "3600"))
+DEFAULT_DECIMALS = int(os.environ.get("FORECASTIQ_PREDICTION_CACHE_DECIMALS", "4"))
+
+
+class PredictionCache:
+    """Thread-safe LRU + TTL cache of per-row predictions keyed by the rounded features."""
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL, decimals=DEFAULT_DECIMALS,
+                 version_fn=model_version, check_interval=1.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.decimals = decimals
+        self.version_fn = version_fn
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key -> (expires_at, row), least recently used first
+        self._version = version_fn()
+        self._checked = time.monotonic()
+        self._counters = dict.fromkeys(["hits", "misses", "evictions", "expired", "invalidations"], 0)
+
+    def keys(self, X):
+        """Return one hashable key per row of the feature matrix X."""
+        # + 0.0 folds -0.0 into 0.0 so both round to the same key
+        rounded = np.round(np.asarray(X, dtype=np.float64), self.decimals) + 0.0
+        return [row.tobytes() for row in rounded]
+
+    def _check_version(self, now):
+        # Called with the lock held
+        if now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        version = self.version_fn()
+        if version != self._version:
+            self._version = version
+            self._entries.clear()
+            self._counters["invalidations"] += 1
+
+    def get_many(self, keys, record_misses=True):
+        """Return the cached row (or None) for each key.
+
+        record_misses=False is for a quick look-up whose misses are looked up
+        (and counted) again later, e.g. by the service before micro-batching.
+        """
+        now = time.monotonic()
+        results = []
+        with self._lock:
+            self._check_version(now)
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] < now:
+                    del self._entries[key]
+                    self._counters["expired"] += 1
+                    entry = None
+                if entry is None:
+                    if record_misses:
+                        self._counters["misses"] += 1
+                    results.append(None)
+                else:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    results.append(entry[1])
+        return results
+
+    def put_many(self, keys, rows):
+        """Store one row of predictions per key, evicting the least recently used entries."""
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for key, row in zip(keys, rows):
+                self._entries[key] = (expires_at, row)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return the counters, the current size and the hit rate."""
+        with self._lock:
+            stats = dict(self._counters, size=len(self._entries), max_size=self.max_size, ttl=self.ttl,
+                         decimals=self.decimals, model_version=self._version)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else None
+        return stats
+
+
+def default_cache():
+    """Return a new cache configured from the environment, or None if it is disabled."""
+    if DEFAULT_MAX_SIZE <= 0:
+        return None
+    return PredictionCache()
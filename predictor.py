@@ -0,0 +1,201 @@
+"""One entry point for all four predictions.
+
+`ForecastPredictor` validates and converts the inputs once, evaluates the rain
+and temperature regressors and classifiers in parallel on the same feature
+matrix, and returns one structured result. It is used by the Streamlit app,
+the batch CLI and the HTTP service.
+
+If the notebook exported the optional multi-output regressor
+(`et_reg_multi.pkl`, one forest predicting both log rainfall and temperature)
+and `use_multi_output=True`, that single forest replaces the two regressors.
+
+Rows that were scored recently (same features up to the cache's rounding) are
+answered from a PredictionCache instead of the models; see prediction_cache.py.
+Every scored matrix is also folded into the process' DriftMonitor, if a drift
+reference was exported with the models; see drift.py.
+"""
+import collections
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from drift import get_monitor
+from metrics import profiled, timed
+from models import load_models, load_multi_output, required_features, rain_occurred_map, temp_class_map
+from prediction_cache import default_cache
+
+PREDICTION_COLUMNS = ["rainfall_mm", "temperature_c", "rain_class", "temp_class"]
+
+DEFAULT_USE_MULTI_OUTPUT = os.environ.get("FORECASTIQ_MULTI_OUTPUT", "") not in ("", "0")
+
+Forecast = collections.namedtuple("Forecast", PREDICTION_COLUMNS)
+
+
+def forecast_to_report(forecast):
+    """Return the predictions dict expected by create_html_report/create_pdf_report."""
+    return {
+        "rainfall": float(forecast.rainfall_mm),
+        "temperature": float(forecast.temperature_c),
+        "rain_class": forecast.rain_class,
+        "temp_class": forecast.temp_class,
+    }
+
+
+def validate_columns(columns):
+    """Raise ValueError if any of the required feature columns is missing."""
+    missing = [c for c in required_features if c not in columns]
+    if missing:
+        raise ValueError(f"Input is missing required columns: {', '.join(missing)}")
+
+
+def to_feature_matrix(frame):
+    """Return (X, valid) where X is the float32 feature matrix in model order.
+
+    Non-numeric or missing values are turned into NaN and the corresponding
+    rows are flagged as invalid instead of aborting the whole batch.
+    """
+    import pandas as pd
+    X = frame[required_features].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float32)
+    valid = np.isfinite(X).all(axis=1)
+    return X, valid
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _timed_predict(name, model, X):
+    with timed(f"model.{name}"):
+        return model.predict(X)
+
+
+def label_column(classes, mapping):
+    """Map predicted class ids to their labels, column-wise."""
+    return np.array([mapping.get(c, "Unknown") for c in np.asarray(classes).tolist()], dtype=object)
+
+
+class ForecastPredictor:
+    """Validate inputs once and run the rain/temperature models side by side."""
+
+    def __init__(self, models=None, threads=4, use_multi_output=DEFAULT_USE_MULTI_OUTPUT, use_cache=True,
+                 use_drift_monitor=True):
+        self.models = models if models is not None else load_models()
+        self.multi_output = load_multi_output() if use_multi_output else None
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="forecast")
+        self.cache = default_cache() if use_cache else None
+        self.use_drift_monitor = use_drift_monitor
+
+    @property
+    def monitor(self):
+        """The process-wide DriftMonitor, or None (disabled, or no drift reference exported)."""
+        return get_monitor() if self.use_drift_monitor else None
+
+    def to_matrix(self, inputs):
+        """Convert a dict, list of dicts, DataFrame or 2-D array into a validated float32 matrix."""
+        if isinstance(inputs, dict):
+            # One row (the app's form): converted directly, pandas is not needed
+            validate_columns(inputs)
+            X = np.array([[_to_float(inputs[f]) for f in required_features]], dtype=np.float32)
+            valid = np.isfinite(X).all(axis=1)
+        elif isinstance(inputs, list) or hasattr(inputs, "columns"):
+            import pandas as pd
+            inputs = pd.DataFrame(inputs) if isinstance(inputs, list) else inputs
+            validate_columns(inputs.columns)
+            X, valid = to_feature_matrix(inputs)
+        else:
+            X = np.ascontiguousarray(inputs, dtype=np.float32)
+            if X.ndim == 1:
+                X = X[np.newaxis, :]
+            if X.shape[1] != len(required_features):
+                raise ValueError(f"Expected {len(required_features)} features, got {X.shape[1]}")
+            valid = np.isfinite(X).all(axis=1)
+        if not valid.all():
+            raise ValueError(f"{int((~valid).sum())} rows have missing or non-numeric values")
+        return X
+
+    def predict_matrix(self, X):
+        """Predict an already validated matrix and return a dict of columns.
+
+        Cached rows are answered from the cache; only the others reach the models.
+        """
+        if len(X) == 0:
+            return {
+                "rainfall_mm": np.empty(0, dtype=np.float64),
+                "temperature_c": np.empty(0, dtype=np.float64),
+                "rain_class": np.empty(0, dtype=object),
+                "temp_class": np.empty(0, dtype=object),
+            }
+        with profiled("predict"), timed("predict"):
+            monitor = self.monitor
+            if monitor is not None:
+                monitor.observe(X)
+            if self.cache is None:
+                return self._run_models(X)
+            keys = self.cache.keys(X)
+            rows = self.cache.get_many(keys)
+            missing = [i for i, row in enumerate(rows) if row is None]
+            if missing:
+                computed = self._run_models(X[missing] if len(missing) < len(rows) else X)
+                computed_rows = list(zip(*(computed[name] for name in PREDICTION_COLUMNS)))
+                self.cache.put_many([keys[i] for i in missing], computed_rows)
+                if len(missing) == len(rows):
+                    return computed
+                for i, row in zip(missing, computed_rows):
+                    rows[i] = row
+            rainfall, temperature, rain_class, temp_class = zip(*rows)
+            return {
+                "rainfall_mm": np.array(rainfall, dtype=np.float64),
+                "temperature_c": np.array(temperature, dtype=np.float64),
+                "rain_class": np.array(rain_class, dtype=object),
+                "temp_class": np.array(temp_class, dtype=object),
+            }
+
+    def _run_models(self, X):
+        """Run all models on the matrix and return a dict of columns."""
+        cls_rain = self.executor.submit(_timed_predict, "et_cls_rain", self.models["et_cls_rain"], X)
+        cls_temp = self.executor.submit(_timed_predict, "et_cls_temp", self.models["et_cls_temp"], X)
+        if self.multi_output is not None:
+            both = _timed_predict("et_reg_multi", self.multi_output, X)
+            log_rain, temperature = both[:, 0], both[:, 1]
+        else:
+            reg_rain = self.executor.submit(_timed_predict, "et_reg_rain", self.models["et_reg_rain"], X)
+            temperature = _timed_predict("et_reg_temp", self.models["et_reg_temp"], X)
+            log_rain = reg_rain.result()
+        return {
+            "rainfall_mm": np.expm1(log_rain),
+            "temperature_c": np.asarray(temperature),
+            "rain_class": label_column(cls_rain.result(), rain_occurred_map),
+            "temp_class": label_column(cls_temp.result(), temp_class_map),
+        }
+
+    def predict(self, inputs):
+        """Predict every row of `inputs` and return a dict of columns."""
+        return self.predict_matrix(self.to_matrix(inputs))
+
+    def predict_one(self, inputs):
+        """Predict a single row (usually a dict of the 14 features) and return a Forecast."""
+        columns = self.predict(inputs)
+        return Forecast(*(columns[name][0] for name in PREDICTION_COLUMNS))
+
+
+_lock = threading.Lock()
+_default = None
+
+
+def get_predictor():
+    """Return a process-wide ForecastPredictor, rebuilt when a model file (or et_reg_multi.pkl) changes."""
+    global _default
+    with _lock:
+        models = load_models()
+        multi_output = load_multi_output() if DEFAULT_USE_MULTI_OUTPUT else None
+        if (_default is None or _default.multi_output is not multi_output
+                or any(_default.models[name] is not model for name, model in models.items())):
+            # The old executor is not shut down: a request may still be using it. Its idle
+            # threads exit once the old predictor is garbage-collected.
+            _default = ForecastPredictor(models=models)
+        return _default
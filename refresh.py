@@ -0,0 +1,315 @@
+"""Incremental refresh of the ExtraTrees models when new rows arrive.
+
+Retraining every forest from scratch gets slower as the data grows. Instead,
+`python refresh.py new_rows.csv`:
+
+1. appends the new rows to the dataset cache (data_cache.extend_cache);
+2. grows each et_*.pkl forest with `warm_start`: `--trees` new trees are fit
+   on the new rows plus a sample of the earlier training rows (`--replay`
+   times as many), so the new trees do not only know the latest data. With
+   `--max-trees` the oldest trees are retired once the forest is larger;
+3. scores the current and the grown forest on the holdout rows (the
+   notebook's 20% test split of the original data and 20% of every appended
+   file, never used for fitting) and keeps the grown forest only if its MSE
+   or accuracy is within `--mse-tolerance` / `--accuracy-tolerance`;
+4. writes the accepted models to MODEL_DIR with an atomic replace, so a
+   running app or service loads them on its next request. Once every model
+   reflects the same data, the drift reference (drift.py) is rewritten from
+   the training rows of the grown dataset.
+   Only the four et_*.pkl forests are grown; the optional multi-output
+   regressor (et_reg_multi.pkl) is left as it is, with a warning.
+
+MODEL_DIR/refresh_state.json records, per model, the dataset it reflects and
+the files applied to it, plus every refresh. Only the models that were swapped
+in advance; a rejected or skipped model (--models) keeps its dataset and gets
+the same file on a later run, while models that already have it are skipped. The temperature classes
+keep the bin edges of the original data, so old and new trees agree on them.
+
+Usage:
+    python refresh.py new_rows.csv --trees 20 --max-trees 200
+    python refresh.py new_rows.csv --dry-run
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from data_cache import DEFAULT_SOURCE, extend_cache, load_dataset, open_cached, source_digest
+from models import ENGINE_FILE, MODEL_DIR, MODEL_FILES, MULTI_OUTPUT_FILE, MULTI_OUTPUT_NAME, model_path
+
+STATE_FILE = "refresh_state.json"
+DEFAULT_TREES = 20
+
+
+def state_path(model_dir=MODEL_DIR):
+    return os.path.join(model_dir, STATE_FILE)
+
+
+def load_state(base_source=DEFAULT_SOURCE, model_dir=MODEL_DIR):
+    """Return the refresh state; before the first refresh the models reflect `base_source`.
+
+    state["models"][name] holds the dataset each model reflects and the files applied to it.
+    """
+    path = state_path(model_dir)
+    if os.path.exists(path):
+        with open(path) as f:
+            state = json.load(f)
+        if "models" not in state:  # written before the state was kept per model
+            state["models"] = {name: {"dataset": state["dataset"], "applied": list(state["applied"])}
+                               for name in MODEL_FILES}
+            del state["dataset"], state["applied"]
+        return state
+    digest = load_dataset(base_source).meta["sha256"]
+    return {"base": digest, "models": {name: {"dataset": digest, "applied": []} for name in MODEL_FILES},
+            "history": []}
+
+
+def common_dataset(state):
+    """Return the dataset every model reflects, or None while they differ (a model was rejected or skipped)."""
+    datasets = {entry["dataset"] for entry in state["models"].values()}
+    return datasets.pop() if len(datasets) == 1 else None
+
+
+def save_state(state, model_dir=MODEL_DIR):
+    path = state_path(model_dir)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def holdout_mask(segments):
+    """Mark the holdout rows: the notebook's test split of every segment (original data, then each appended file)."""
+    from train import split_indices
+
+    mask = np.zeros(sum(segments), dtype=bool)
+    start = 0
+    for rows in segments:
+        if rows >= 5:  # smaller files go entirely into training
+            _, test = split_indices(rows)
+            mask[start + test] = True
+        start += rows
+    return mask
+
+
+def refresh_targets(dataset, base):
+    """The four targets of `dataset`, with the temperature classes binned like the original data."""
+    from sklearn.preprocessing import KBinsDiscretizer
+    from train import build_targets
+
+    targets = build_targets(dataset)
+    binner = KBinsDiscretizer(n_bins=3, encode="ordinal", strategy="quantile")
+    binner.fit(np.asarray(base.temperature_celsius, dtype=np.float64).reshape(-1, 1))
+    temperature = np.asarray(dataset.temperature_celsius, dtype=np.float64).reshape(-1, 1)
+    targets["cls_temp"] = binner.transform(temperature).astype(np.int64).ravel()
+    return targets
+
+
+def grow_forest(forest, X, y, trees, max_trees=None, n_jobs=None):
+    """Add `trees` trees fit on (X, y) to a fitted forest (in place); retire the oldest beyond max_trees."""
+    if not hasattr(forest, "estimators_") or "warm_start" not in forest.get_params():
+        raise ValueError(f"{type(forest).__name__} cannot be grown incrementally")
+    classes = getattr(forest, "classes_", None)
+    if classes is not None and not np.array_equal(np.unique(y), classes):
+        raise ValueError("the rows to fit do not contain every class; increase --replay")
+    params = {"warm_start": True, "n_estimators": len(forest.estimators_) + trees}
+    if n_jobs:
+        params["n_jobs"] = n_jobs
+    forest.set_params(**params)
+    forest.fit(X, y)
+    forest.set_params(warm_start=False)
+    if max_trees and len(forest.estimators_) > max_trees:
+        forest.estimators_ = forest.estimators_[-max_trees:]
+        forest.n_estimators = max_trees
+    return forest
+
+
+def within_tolerance(before, after, mse_tolerance, accuracy_tolerance):
+    if "mse" in before:
+        return after["mse"] <= before["mse"] * (1 + mse_tolerance)
+    return after["accuracy"] >= before["accuracy"] - accuracy_tolerance
+
+
+def save_model(forest, name, model_dir=MODEL_DIR):
+    """Replace the model file atomically; the registry reloads it on the next request."""
+    import joblib
+
+    destination = os.path.join(model_dir, MODEL_FILES[name])
+    tmp = f"{destination}.tmp{os.getpid()}"
+    joblib.dump(forest, tmp)  # uncompressed, so FORECASTIQ_MMAP keeps working
+    os.replace(tmp, destination)
+    return destination
+
+
+def refresh(new_path, names=tuple(MODEL_FILES), trees=DEFAULT_TREES, max_trees=None, replay=1.0,
+            mse_tolerance=0.02, accuracy_tolerance=0.005, n_jobs=None, dry_run=False,
+            base_source=DEFAULT_SOURCE, model_dir=MODEL_DIR):
+    """Append `new_path` to each model's dataset, grow the forests and swap in those that pass; return the results.
+
+    Only the models that were swapped in advance to the grown dataset. A rejected or skipped
+    model keeps its own dataset, so the same file can be applied to it by a later run.
+    """
+    state = load_state(base_source, model_dir)
+    new_digest = source_digest(new_path)
+    results = {}
+    groups = {}
+    for name in names:
+        entry = state["models"][name]
+        if new_digest in entry["applied"]:
+            results[name] = {"accepted": False, "skipped": True, "error": f"{new_path} was already applied"}
+        else:
+            groups.setdefault(entry["dataset"], []).append(name)
+    if not groups:
+        raise ValueError(f"{new_path} was already applied")
+    base = open_cached(state["base"])
+    seed = len(state["history"])
+    grown = {}
+    for digest, group in groups.items():
+        previous = open_cached(digest)
+        dataset = extend_cache(previous, new_path)
+        grown[dataset.meta["sha256"]] = dataset
+        targets = refresh_targets(dataset, base)
+        for name in group:
+            results[name] = _refresh_model(name, dataset, len(previous), targets[name[len("et_"):]], seed, trees,
+                                           max_trees, replay, mse_tolerance, accuracy_tolerance, n_jobs, dry_run,
+                                           model_dir)
+            results[name]["dataset"] = dataset.meta["sha256"]
+
+    swapped = [name for name, result in results.items() if result.get("file")]
+    if swapped:
+        for name in swapped:
+            entry = state["models"][name]
+            entry["dataset"] = results[name]["dataset"]
+            entry["applied"].append(new_digest)
+        dataset = grown[results[swapped[0]]["dataset"]]
+        state["history"].append({
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "source": os.path.basename(new_path),
+            "rows": dataset.meta["segments"][-1],
+            "dataset_rows": len(dataset),
+            "results": results,
+        })
+        save_state(state, model_dir)
+        # The drift reference describes the training rows of every model, so it only moves
+        # once all of them reflect the same data
+        reference = common_dataset(state)
+        if reference in grown:
+            from drift import write_reference
+            write_reference(grown[reference].X[~holdout_mask(grown[reference].meta["segments"])], model_dir)
+    return results
+
+
+def _refresh_model(name, dataset, old_rows, y, seed, trees, max_trees, replay, mse_tolerance,
+                   accuracy_tolerance, n_jobs, dry_run, model_dir):
+    """Grow one model on the rows `dataset` appended after its first `old_rows` (target `y`); save it if it passes."""
+    import joblib
+    from train import evaluate
+
+    target = name[len("et_"):]
+    X = dataset.X
+    holdout = holdout_mask(dataset.meta["segments"])
+    test = np.flatnonzero(holdout)
+    new_test = test[test >= old_rows]
+
+    rng = np.random.default_rng(seed)
+    new_train = np.flatnonzero(~holdout[old_rows:]) + old_rows
+    earlier = np.flatnonzero(~holdout[:old_rows])
+    replayed = rng.choice(earlier, size=min(len(earlier), int(replay * len(new_train))), replace=False)
+    fit_rows = np.sort(np.concatenate([new_train, replayed]))
+    valid = np.isfinite(X[fit_rows]).all(axis=1) & np.isfinite(y[fit_rows])
+    rows = fit_rows[valid]
+
+    forest = joblib.load(os.path.join(model_dir, MODEL_FILES[name]))
+    before = evaluate(target, y[test], forest.predict(X[test]))
+    before_new = evaluate(target, y[new_test], forest.predict(X[new_test])) if len(new_test) else {}
+    n_before = len(forest.estimators_)
+    start = time.perf_counter()
+    try:
+        grow_forest(forest, X[rows], y[rows], trees, max_trees, n_jobs)
+    except ValueError as e:
+        return {"accepted": False, "error": str(e)}
+    result = {
+        "trees_before": n_before,
+        "trees_after": len(forest.estimators_),
+        "fit_rows": len(rows),
+        "fit_seconds": time.perf_counter() - start,
+        "holdout_before": before,
+        "holdout_after": evaluate(target, y[test], forest.predict(X[test])),
+        "new_rows_before": before_new,
+        "new_rows_after": evaluate(target, y[new_test], forest.predict(X[new_test])) if len(new_test) else {},
+    }
+    result["accepted"] = within_tolerance(before, result["holdout_after"], mse_tolerance, accuracy_tolerance)
+    if result["accepted"] and not dry_run:
+        result["file"] = save_model(forest, name, model_dir)
+    return result
+
+
+def export_engine(model_dir=MODEL_DIR):
+    """Rewrite forest_engine.npz from the current pickles (for FORECASTIQ_ENGINE=1)."""
+    import joblib
+    from tree_engine import export_forests
+
+    forests = {name: joblib.load(os.path.join(model_dir, file_name)) for name, file_name in MODEL_FILES.items()}
+    multi_output = os.path.join(model_dir, MULTI_OUTPUT_FILE)
+    if os.path.exists(multi_output):
+        forests[MULTI_OUTPUT_NAME] = joblib.load(multi_output)
+    path = os.path.join(model_dir, ENGINE_FILE)
+    export_forests(forests, path)
+    return path
+
+
+def _score(metrics):
+    if not metrics:
+        return "-"
+    return f"MSE {metrics['mse']:.4f}" if "mse" in metrics else f"accuracy {metrics['accuracy']:.4f}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grow the forests on new rows and swap in the ones that pass.")
+    parser.add_argument("new_data", help="xlsx or csv file with the new rows (same columns as the training data)")
+    parser.add_argument("--base", default=DEFAULT_SOURCE, help="data the models were trained on (first refresh only)")
+    parser.add_argument("--models", nargs="+", default=list(MODEL_FILES), choices=list(MODEL_FILES))
+    parser.add_argument("--trees", type=int, default=DEFAULT_TREES, help="trees added per model")
+    parser.add_argument("--max-trees", type=int, default=0, help="retire the oldest trees beyond this (0 = keep all)")
+    parser.add_argument("--replay", type=float, default=1.0, help="earlier rows mixed in, per new row")
+    parser.add_argument("--mse-tolerance", type=float, default=0.02, help="allowed relative MSE increase")
+    parser.add_argument("--accuracy-tolerance", type=float, default=0.005, help="allowed absolute accuracy drop")
+    parser.add_argument("--cpus", type=int, default=os.cpu_count() or 1, help="n_jobs used to fit the new trees")
+    parser.add_argument("--export-engine", action="store_true", help="also rewrite forest_engine.npz")
+    parser.add_argument("--dry-run", action="store_true", help="validate only; leave the model files alone")
+    args = parser.parse_args(argv)
+
+    try:
+        results = refresh(args.new_data, args.models, args.trees, args.max_trees or None, args.replay,
+                          args.mse_tolerance, args.accuracy_tolerance, args.cpus, args.dry_run, args.base)
+    except (OSError, ValueError) as e:
+        print(f"Refresh failed: {e}", file=sys.stderr)
+        return 1
+    for name, result in results.items():
+        if "error" in result:
+            print(f"{name}: not refreshed ({result['error']})")
+            continue
+        verdict = "swapped in" if result.get("file") else ("passed (dry run)" if result["accepted"] else "rejected, kept the current model")
+        print(f"{name}: {result['trees_before']} -> {result['trees_after']} trees on {result['fit_rows']} rows "
+              f"in {result['fit_seconds']:.1f}s; holdout {_score(result['holdout_before'])} -> "
+              f"{_score(result['holdout_after'])}; new rows {_score(result['new_rows_before'])} -> "
+              f"{_score(result['new_rows_after'])}; {verdict}")
+    swapped = any(r.get("file") for r in results.values())
+    if swapped and common_dataset(load_state(args.base)) is None:
+        print("The models now reflect different data; the drift reference is kept until the rejected or "
+              "skipped ones are refreshed with the same files")
+    if swapped and args.export_engine:
+        print(f"Rewrote {export_engine()}")
+    elif swapped and os.path.exists(os.path.join(MODEL_DIR, ENGINE_FILE)):
+        print(f"{ENGINE_FILE} still holds the previous forests; run with --export-engine "
+              f"(or tree_engine.py export / compress.py) if the engine is served")
+    if swapped and os.path.exists(model_path(MULTI_OUTPUT_FILE)):
+        print(f"{MULTI_OUTPUT_FILE} is not refreshed and still predicts from the previous data; with "
+              f"FORECASTIQ_MULTI_OUTPUT=1 it keeps serving rainfall and temperature until it is retrained")
+    return 0 if all(r["accepted"] or r.get("skipped") for r in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+"""ReportLab layout of the weather prediction report (used when WeasyPrint is absent).
+
+Only the tables (4 predictions, the optional top contributors, 14 inputs)
+change from one report to the next, so everything else is built once per
+process: the paragraph styles, the title and the static "Environmental
+Awareness" pages, and character.png already decoded and compressed into a
+PDF image object. Each report then lays out just its tables and reuses the
+cached parts.
+
+reports.py imports this module on the first ReportLab render, so the
+ReportLab stack is not loaded at app start-up.
+"""
+import copy
+import functools
+import io
+import os
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase.pdfdoc import PDFImageXObject
+from reportlab.platypus import Flowable, PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from reports import contributor_rows, parameter_descriptions
+
+CHARACTER_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "character.png")
+
+
+class CachedImage(Flowable):
+    """An image whose PDF object (decoded, zlib-compressed pixels) is built once and shared.
+
+    ReportLab's Image flowable re-reads and re-compresses the PNG for every
+    document, which is most of the cost of a report. The encoded object does
+    not depend on the document, so it is registered as-is in each new one.
+    """
+
+    def __init__(self, path, width, height):
+        Flowable.__init__(self)
+        self.xobject = PDFImageXObject(os.path.basename(path), ImageReader(path), mask="auto")
+        self.width = width
+        self.height = height
+        self.hAlign = "CENTER"
+
+    def wrap(self, availWidth, availHeight):
+        return self.width, self.height
+
+    def draw(self):
+        # Same bookkeeping as Canvas.drawImage, minus the per-document encoding
+        canv = self.canv
+        name = self.xobject.name
+        reg_name = canv._doc.getXObjectName(name)
+        if not canv._doc.idToObject.get(reg_name):
+            xobject = copy.copy(self.xobject)  # the document tags what it registers; the pixels are shared
+            canv._doc.Reference(xobject, reg_name)
+            canv._doc.addForm(name, xobject)
+        canv.saveState()
+        canv.scale(self.width, self.height)
+        canv._code.append(f"/{reg_name} Do")
+        canv.restoreState()
+        canv._formsinuse.append(name)
+        canv._currentPageHasImages = 1
+
+
+@functools.lru_cache(maxsize=1)
+def report_template():
+    """Build the request-independent parts of the ReportLab report (once per process)."""
+    styles = getSampleStyleSheet()
+
+    # Better styles that match the HTML design
+    title_style = ParagraphStyle(
+        'TitleStyle',
+        parent=styles['Title'],
+        fontSize=24,
+        spaceAfter=10,
+        textColor=colors.HexColor('#333'),
+        alignment=1,
+        fontName='Helvetica-Bold'
+    )
+
+    subtitle_style = ParagraphStyle(
+        'SubtitleStyle',
+        parent=styles['Normal'],
+        fontSize=12,
+        spaceAfter=20,
+        textColor=colors.HexColor('#666'),
+        alignment=1
+    )
+
+    section_style = ParagraphStyle(
+        'SectionStyle',
+        parent=styles['Heading2'],
+        fontSize=16,
+        spaceAfter=10,
+        textColor=colors.HexColor('#1976D2'),
+        leftIndent=0,
+        fontName='Helvetica-Bold'
+    )
+
+    env_style = ParagraphStyle(
+        'EnvStyle',
+        parent=styles['Normal'],
+        fontSize=10,
+        spaceAfter=8,
+        textColor=colors.HexColor('#444'),
+        leftIndent=10,
+        rightIndent=10,
+        alignment=4  # Justify alignment
+    )
+
+    footer_style = ParagraphStyle(
+        'FooterStyle',
+        parent=styles['Normal'],
+        fontSize=10,
+        textColor=colors.HexColor('#666'),
+        alignment=1
+    )
+
+    closing_style = ParagraphStyle(
+        'ClosingStyle',
+        parent=styles['Normal'],
+        fontSize=11,
+        spaceAfter=8,
+        textColor=colors.HexColor('#2c5530'),
+        leftIndent=15,
+        rightIndent=15,
+        alignment=1,  # Center alignment
+        fontName='Helvetica-Oblique'
+    )
+
+    # Header section, followed by the Prediction Results table
+    header = [
+        Paragraph("Weather Prediction Report", title_style),
+        Paragraph("Designed and Developed by Varshini J", subtitle_style),
+        Spacer(1, 20),
+        Paragraph("Prediction Results", section_style),
+        Spacer(1, 10),
+    ]
+
+    # Top Contributors heading and note, followed by the attributions table (when present)
+    contributors_heading = [
+        Spacer(1, 30),
+        Paragraph("Top Contributors", section_style),
+        Spacer(1, 6),
+        Paragraph("How much each input moved the prediction away from the models' average over the training data "
+                  "(tree path attributions; pts = percentage points of the predicted class's probability).", env_style),
+        Spacer(1, 6),
+    ]
+    cell_style = ParagraphStyle('CellStyle', parent=styles['Normal'], fontSize=9, leading=11)
+
+    # Input Parameters heading, followed by the inputs table
+    inputs_heading = [
+        Spacer(1, 30),
+        Paragraph("Input Parameters", section_style),
+        Spacer(1, 10),
+    ]
+
+    # Environmental Awareness section (PDF only)
+    footer = [
+        Spacer(1, 30),
+        Paragraph("Environmental Awareness & Air Quality Impact", section_style),
+        Spacer(1, 10),
+        Paragraph("<b>Protecting Our Mother Earth:</b> Our planet's atmosphere is under constant threat from various pollutants that not only harm human health but also disrupt ecological balance. The air quality parameters measured in this weather prediction report directly correlate with environmental degradation and public health crises. Understanding these pollutants and their sources empowers us to make informed decisions that can help preserve our planet for future generations.", env_style),
+        Spacer(1, 12),
+        Paragraph("<b>Detailed Air Pollutants & Their Environmental Impact:</b>", env_style),
+        Spacer(1, 8),
+        Paragraph("• <b>Carbon Monoxide (CO):</b> A colorless, odorless gas primarily produced by vehicle emissions and industrial processes. It reduces the blood's ability to carry oxygen, leading to headaches, dizziness, and fatigue. In the environment, CO contributes to ground-level ozone formation and climate change.", env_style),
+        Spacer(1, 6),
+        Paragraph("• <b>Nitrogen Dioxide (NO<sub>2</sub>):</b> A reddish-brown gas from vehicle exhausts and power plants. It irritates airways, triggers asthma attacks, and reduces lung function. Environmentally, NO<sub>2</sub> contributes to acid rain formation, soil acidification, and eutrophication of water bodies, damaging forests and aquatic ecosystems.", env_style),
+        Spacer(1, 6),
+        Paragraph("• <b>Sulphur Dioxide (SO<sub>2</sub>):</b> Released mainly from fossil fuel combustion in power plants and industrial facilities. It causes respiratory problems, particularly in children and elderly. SO<sub>2</sub> is a major contributor to acid rain, which corrodes buildings, damages crops, and acidifies lakes and streams, killing fish and other aquatic life.", env_style),
+        Spacer(1, 6),
+        Paragraph("• <b>Particulate Matter (PM2.5 & PM10):</b> Microscopic particles that penetrate deep into lungs and bloodstream, causing heart disease, stroke, and lung cancer. These particles reduce visibility (haze), damage vegetation, and alter weather patterns. PM2.5 can travel thousands of kilometers, making it a global environmental concern.", env_style),
+        Spacer(1, 6),
+        Paragraph("• <b>Ground-level Ozone (O<sub>3</sub>):</b> Formed when other pollutants react in sunlight. While beneficial in the upper atmosphere, ground-level ozone irritates eyes and respiratory system, and damages plant tissues, reducing crop yields and forest productivity. It's a major component of urban smog.", env_style),
+        Spacer(1, 15),
+        Paragraph("<b>Comprehensive Environmental Protection Strategies:</b>", env_style),
+        Spacer(1, 8),
+        Paragraph("<b>Individual Actions:</b>", env_style),
+        Paragraph("• Choose public transportation, cycling, or walking over private vehicles", env_style),
+        Paragraph("• Invest in energy-efficient appliances and renewable energy sources", env_style),
+        Paragraph("• Practice waste reduction, reuse, and recycling", env_style),
+        Paragraph("• Support organic farming and sustainable products", env_style),
+        Paragraph("• Monitor and report air quality in your community", env_style),
+        Paragraph("• Plant native trees and maintain green spaces", env_style),
+        Spacer(1, 8),
+        Paragraph("<b>Community Initiatives:</b>", env_style),
+        Paragraph("• Advocate for stricter emission standards and clean energy policies", env_style),
+        Paragraph("• Support urban planning that promotes green infrastructure", env_style),
+        Paragraph("• Participate in community tree-planting and cleanup programs", env_style),
+        Paragraph("• Encourage businesses to adopt sustainable practices", env_style),
+        Paragraph("• Promote awareness about environmental health connections", env_style),
+        Spacer(1, 8),
+        Paragraph("<b>Global Impact:</b> The air quality data you analyze contributes to our understanding of climate change, public health patterns, and environmental justice issues. By monitoring these parameters, we can identify pollution hotspots, track improvement efforts, and develop targeted interventions to protect vulnerable communities and ecosystems.", env_style),
+        Spacer(1, 20),
+        Spacer(1, 20),
+        Paragraph("Weather Prediction Tool | Designed and Developed by Varshini J", footer_style),
+        Spacer(1, 30),
+    ]
+
+    # Add character image at the end - spread across full page width
+    try:
+        page_width = A4[0] - 2*inch  # Account for margins
+        footer.append(CachedImage(CHARACTER_IMAGE, width=page_width, height=3*inch))
+        footer.append(Spacer(1, 15))
+    except Exception as e:
+        print(f"Character image error: {e}")  # If image fails to load, continue without it
+
+    # Add a thoughtful closing message after the character image
+    footer += [
+        Paragraph(" <b>Thank you for using our Weather Prediction Tool!</b> ", closing_style),
+        Spacer(1, 8),
+        Paragraph("May this report empower you to make informed decisions for a healthier tomorrow. Together, let's breathe cleaner air, protect our precious environment, and create a sustainable future for generations to come.", closing_style),
+        Spacer(1, 8),
+        Paragraph("<b>Stay safe, stay healthy, and stay environmentally conscious!</b>", closing_style),
+    ]
+
+    prediction_style = TableStyle([
+        # Background colors to mimic the gradient
+        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#667eea')),
+        ('TEXTCOLOR', (0, 0), (-1, -1), colors.white),
+        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 12),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('GRID', (0, 0), (-1, -1), 2, colors.HexColor('#764ba2')),
+        ('ROWBACKGROUNDS', (0, 0), (-1, -1), [colors.HexColor('#667eea'), colors.HexColor('#764ba2')]),
+        ('LEFTPADDING', (0, 0), (-1, -1), 15),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 15),
+        ('TOPPADDING', (0, 0), (-1, -1), 15),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 15),
+    ])
+
+    input_style = TableStyle([
+        # Header row styling
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4CAF50')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 11),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('TOPPADDING', (0, 0), (-1, 0), 12),
+
+        # Data rows styling
+        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 9),
+        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#ddd')),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('LEFTPADDING', (0, 0), (-1, -1), 8),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 8),
+        ('TOPPADDING', (0, 1), (-1, -1), 6),
+        ('BOTTOMPADDING', (0, 1), (-1, -1), 6),
+
+        # Alternating row colors
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f9f9f9')]),
+    ])
+
+    return {
+        "header": header,
+        "contributors_heading": contributors_heading,
+        "cell_style": cell_style,
+        "inputs_heading": inputs_heading,
+        "footer": footer,
+        "prediction_style": prediction_style,
+        "input_style": input_style,
+    }
+
+
+def _fresh(flowables):
+    # Layout stores per-document state (wrapped lines, position) on each
+    # flowable, so every report gets shallow copies; the parsed text is shared.
+    return [copy.copy(f) for f in flowables]
+
+
+def report_story(input_data, predictions):
+    """Return the ReportLab flowables of one report, reusing the cached template parts."""
+    template = report_template()
+
+    # Create a better-looking prediction grid (replace emojis with text)
+    pred_data = [
+        ["Rainfall Amount", f"{predictions['rainfall']:.2f} mm"],
+        ["Temperature", f"{predictions['temperature']:.2f}°C"],
+        ["Rain Occurrence", predictions['rain_class']],
+        ["Temperature Category", predictions['temp_class']]
+    ]
+    pred_table = Table(pred_data, colWidths=[3*inch, 3*inch])
+    pred_table.setStyle(template["prediction_style"])
+
+    contributors = []
+    rows = contributor_rows(predictions)
+    if rows:
+        contributor_data = [['Prediction', 'Average', 'Top Inputs']]
+        for title, average, top in rows:
+            contributor_data.append([title, average, Paragraph(top, template["cell_style"])])
+        contributor_table = Table(contributor_data, colWidths=[1.6*inch, 1.2*inch, 3.2*inch])
+        contributor_table.setStyle(template["input_style"])
+        contributors = _fresh(template["contributors_heading"]) + [contributor_table]
+
+    input_data_list = [['Parameter', 'Value', 'Description']]
+    for param, value in input_data.items():
+        description = parameter_descriptions.get(param, "")
+        formatted_param = param.replace('_', ' ').title()
+        input_data_list.append([formatted_param, f"{value:.4f}", description])
+    input_table = Table(input_data_list, colWidths=[2.2*inch, 1.3*inch, 2.5*inch])
+    input_table.setStyle(template["input_style"])
+
+    return (_fresh(template["header"]) + [pred_table] + contributors + _fresh(template["inputs_heading"])
+            + [input_table] + _fresh(template["footer"]))
+
+
+def write_reportlab_pdf(reports, destination):
+    """Lay out (input_data, predictions) pairs into one PDF, each report starting on a new page.
+
+    `destination` is a path or binary buffer. The character image is stored
+    once for the whole document. Returns the number of pages.
+    """
+    story = []
+    for input_data, predictions in reports:
+        if story:
+            story.append(PageBreak())
+        story += report_story(input_data, predictions)
+    doc = SimpleDocTemplate(destination, pagesize=A4, topMargin=0.5*inch, bottomMargin=0.5*inch)
+    doc.build(story)
+    return doc.page
+
+
+def render_reportlab_pdf(input_data, predictions):
+    """Lay out the report with ReportLab; returns (buffer, pages)."""
+    buffer = io.BytesIO()
+    pages = write_reportlab_pdf([(input_data, predictions)], buffer)
+    buffer.seek(0)
+    return buffer, pages
@@ -0,0 +1,402 @@
+"""HTML and PDF weather prediction reports.
+
+The HTML report is what the app shows; the PDF is the same report for
+download. WeasyPrint converts the HTML when it is installed, otherwise the
+report is laid out with ReportLab (reportlab_report.py, which caches every
+request-independent part of the layout). Both PDF engines are imported on
+first use only, and which of them is installed is probed once per process.
+
+The app renders PDFs only when asked, on a small background thread pool
+(`submit_pdf`). Finished PDFs are kept in an LRU cache keyed by a hash of
+(inputs, predictions), so repeated downloads and identical reports are not
+rendered again, and the render time of each engine is recorded.
+
+Environment variables:
+    FORECASTIQ_PDF_ENGINE      engine order, e.g. "reportlab" (default "weasyprint,reportlab")
+    FORECASTIQ_PDF_CACHE_SIZE  number of rendered PDFs kept in memory (default 64)
+    FORECASTIQ_PDF_WORKERS     background render threads (default 2)
+
+Usage:
+    from reports import create_html_report, create_pdf_report, submit_pdf
+    pdf_buffer = create_pdf_report(inputs, predictions)    # synchronous, not cached
+    rendered = submit_pdf(inputs, predictions).result()    # cached; rendered.data, .engine, .seconds
+"""
+import collections
+import functools
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metrics import observe
+
+PDF_ENGINE_ORDER = [e.strip() for e in os.environ.get("FORECASTIQ_PDF_ENGINE", "weasyprint,reportlab").split(",") if e.strip()]
+PDF_CACHE_SIZE = int(os.environ.get("FORECASTIQ_PDF_CACHE_SIZE", "64"))
+PDF_WORKERS = int(os.environ.get("FORECASTIQ_PDF_WORKERS", "2"))
+
+RenderedPdf = collections.namedtuple("RenderedPdf", ["data", "engine", "seconds", "pages"])
+
+_pdf_lock = threading.Lock()
+_pdf_cache = collections.OrderedDict()  # report_key -> RenderedPdf, least recently used first
+_pdf_pending = {}  # report_key -> Future of a render in progress
+_render_stats = {}  # engine -> {"renders", "failures", "seconds"}
+_pdf_executor = None
+
+parameter_descriptions = {
+    "latitude": "Degrees North",
+    "longitude": "Degrees East",
+    "humidity": "Percentage (%)",
+    "wind_kph": "Kilometers per Hour",
+    "cloud": "Percentage (%)",
+    "pressure_mb": "Millibars",
+    "uv_index": "UV Index Scale",
+    "feels_like_celsius": "Degrees Celsius",
+    "air_quality_Carbon_Monoxide": "μg/m³",
+    "air_quality_Ozone": "μg/m³",
+    "air_quality_Nitrogen_dioxide": "μg/m³",
+    "air_quality_Sulphur_dioxide": "μg/m³",
+    "air_quality_PM2.5": "μg/m³",
+    "air_quality_PM10": "μg/m³"
+}
+
+# Title, unit and scale of each prediction in the "Top Contributors" table (see attribution.py)
+contributor_formats = {
+    "rainfall": ("Rainfall Amount", " mm", 1),
+    "temperature": ("Temperature", "°C", 1),
+    "rain_class": ("Rain Occurrence", " pts", 100),
+    "temp_class": ("Temperature Category", " pts", 100),
+}
+
+
+def contributor_rows(predictions):
+    """Return (prediction, average, top inputs) texts for the optional predictions["contributors"]."""
+    rows = []
+    for target, entry in predictions.get("contributors", {}).items():
+        title, unit, scale = contributor_formats[target]
+        if scale == 1:
+            average = f"{entry['base']:.2f}{unit}"
+        else:
+            # Classes: percentage points of the probability of the predicted class
+            average = f"{entry['base'] * 100:.0f}% {predictions[target]}"
+        digits = 2 if scale == 1 else 1
+        top = ", ".join(f"{feature.replace('_', ' ').title()} {value * scale:+.{digits}f}{unit}"
+                        for feature, value in entry["top"])
+        rows.append((title, average, top))
+    return rows
+
+
+def create_html_report(input_data, predictions):
+    """Create an HTML report with prediction results"""
+    start = time.perf_counter()
+    html_content = f"""
+    <html>
+    <head>
+        <meta charset='UTF-8'>
+        <title>Weather Prediction Report</title>
+        <style>
+            body {{ font-family: 'Segoe UI', Arial, sans-serif; background: #f9f9f9; color: #222; }}
+            .header {{ text-align: center; margin-bottom: 16px; }}
+            .section {{ margin: 24px auto; max-width: 900px; padding: 20px; border: 1px solid #ddd; border-radius: 8px; background: #fff; }}
+            .section h2 {{ color: #1976D2; border-bottom: 2px solid #1976D2; padding-bottom: 5px; margin-top: 0; }}
+            .prediction-grid {{ display: grid; grid-template-columns: repeat(2, 1fr); gap: 20px; margin: 20px 0; }}
+            .prediction-item {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; border-radius: 10px; text-align: center; box-shadow: 0 4px 6px rgba(0,0,0,0.08); }}
+            .prediction-item h3 {{ margin: 0 0 10px 0; font-size: 1.1em; }}
+            .prediction-item .value {{ font-size: 1.8em; font-weight: bold; margin: 10px 0; }}
+            table {{ width: 100%; border-collapse: collapse; margin: 20px 0; }}
+            th, td {{ border: 1px solid #ddd; padding: 10px; text-align: left; }}
+            th {{ background-color: #4CAF50; color: white; font-weight: bold; }}
+            tr:nth-child(even) {{ background-color: #f9f9f9; }}
+        </style>
+    </head>
+    <body>
+        <div class="header">
+            <h1>🌤 Weather Prediction Report</h1>
+            <p style='margin:0;'>Designed and Developed by Varshini J</p>
+        </div>
+        <div class="section">
+            <h2>📊 Prediction Results</h2>
+            <div class="prediction-grid">
+                <div class="prediction-item">
+                    <h3>🌧 Rainfall Amount</h3>
+                    <div class="value">{predictions['rainfall']:.2f} mm</div>
+                </div>
+                <div class="prediction-item">
+                    <h3>🌡 Temperature</h3>
+                    <div class="value">{predictions['temperature']:.2f}°C</div>
+                </div>
+                <div class="prediction-item">
+                    <h3>☔ Rain Occurrence</h3>
+                    <div class="value">{predictions['rain_class']}</div>
+                </div>
+                <div class="prediction-item">
+                    <h3>🔥 Temperature Category</h3>
+                    <div class="value">{predictions['temp_class']}</div>
+                </div>
+            </div>
+        </div>
+{contributors_section(predictions)}
+        <div class="section">
+            <h2>📝 Input Parameters</h2>
+            <table>
+                <thead>
+                    <tr>
+                        <th>Parameter</th>
+                        <th>Value</th>
+                        <th>Description</th>
+                    </tr>
+                </thead>
+                <tbody>
+    """
+    for param, value in input_data.items():
+        description = parameter_descriptions.get(param, "")
+        html_content += f"""
+                    <tr>
+                        <td>{param.replace('_', ' ').title()}</td>
+                        <td>{value:.4f}</td>
+                        <td>{description}</td>
+                    </tr>"""
+    html_content += f"""
+                </tbody>
+            </table>
+        </div>
+    </body>
+    </html>
+    """
+    observe("html_report", time.perf_counter() - start)
+    return html_content
+
+
+def contributors_section(predictions):
+    """The "Top Contributors" section of the HTML report, or "" when the predictions carry no attributions."""
+    rows = contributor_rows(predictions)
+    if not rows:
+        return ""
+    html = """
+        <div class="section">
+            <h2>🔍 Top Contributors</h2>
+            <p>How much each input moved the prediction away from the models' average over the training data
+            (tree path attributions; pts = percentage points of the predicted class's probability).</p>
+            <table>
+                <thead>
+                    <tr>
+                        <th>Prediction</th>
+                        <th>Average</th>
+                        <th>Top Inputs</th>
+                    </tr>
+                </thead>
+                <tbody>"""
+    for title, average, top in rows:
+        html += f"""
+                    <tr>
+                        <td>{title}</td>
+                        <td>{average}</td>
+                        <td>{top}</td>
+                    </tr>"""
+    html += """
+                </tbody>
+            </table>
+        </div>"""
+    return html
+
+
+@functools.lru_cache(maxsize=1)
+def weasyprint_module():
+    """Import WeasyPrint once per process; returns the module, or None if it cannot be used."""
+    try:
+        import weasyprint  # type: ignore
+        return weasyprint
+    except Exception as e:  # ImportError, or OSError when its system libraries are missing
+        print(f"WeasyPrint unavailable: {e}")
+        return None
+
+
+def available_pdf_engines():
+    """PDF_ENGINE_ORDER without the engines that are not installed."""
+    return [engine for engine in PDF_ENGINE_ORDER if engine != "weasyprint" or weasyprint_module() is not None]
+
+
+@functools.lru_cache(maxsize=1)
+def detect_pdf_engine():
+    """Return a short string describing which PDF engine is available on the system (probed once)."""
+    # Prefer WeasyPrint
+    if weasyprint_module() is not None:
+        return 'weasyprint'
+
+    # Try pdfkit+wkhtmltopdf
+    if importlib.util.find_spec('pdfkit') is not None:
+        wk = shutil.which('wkhtmltopdf')
+        if wk:
+            return f'pdfkit + wkhtmltopdf ({wk})'
+        # check common install locations on Windows
+        candidates = [
+            r"C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe",
+            r"C:\Program Files (x86)\wkhtmltopdf\bin\wkhtmltopdf.exe",
+        ]
+        for c in candidates:
+            if os.path.exists(c):
+                return f'pdfkit + wkhtmltopdf ({c})'
+        return 'pdfkit (no wkhtmltopdf found)'
+
+    # Direct wkhtmltopdf
+    wk = shutil.which('wkhtmltopdf')
+    if wk:
+        return f'wkhtmltopdf ({wk})'
+
+    return 'none'
+
+
+def render_weasyprint_pdf(input_data, predictions):
+    """Convert the HTML report with WeasyPrint (exact match of the HTML design); returns (buffer, pages)."""
+    weasyprint = weasyprint_module()
+    if weasyprint is None:
+        raise ImportError("WeasyPrint is not installed")
+    HTML, CSS = weasyprint.HTML, weasyprint.CSS
+    html = create_html_report(input_data, predictions)
+    
+    # Add some CSS tweaks for better PDF rendering
+    css_fixes = CSS(string='''
+        @page { 
+            size: A4; 
+            margin: 0.5in; 
+        }
+        body { 
+            -webkit-print-color-adjust: exact !important;
+            color-adjust: exact !important;
+        }
+        .prediction-item {
+            break-inside: avoid;
+            page-break-inside: avoid;
+        }
+    ''')
+    
+    buffer = io.BytesIO()
+    document = HTML(string=html).render(stylesheets=[css_fixes])
+    document.write_pdf(buffer)
+    buffer.seek(0)
+    return buffer, len(document.pages)
+
+
+def create_pdf_report(input_data, predictions, engines=None):
+    """Create a PDF report that matches the HTML design exactly"""
+    return io.BytesIO(render_pdf(input_data, predictions, engines).data)
+
+
+def render_pdf(input_data, predictions, engines=None):
+    """Render with the first engine in `engines` (default: the installed ones of PDF_ENGINE_ORDER) that works.
+
+    Returns a RenderedPdf and records the render time per engine.
+    """
+    error = None
+    for engine in engines or available_pdf_engines():
+        render = PDF_ENGINES.get(engine)
+        if render is None:
+            print(f"Unknown PDF engine: {engine}")
+            continue
+        start = time.perf_counter()
+        try:
+            buffer, pages = render(input_data, predictions)
+        except Exception as e:
+            print(f"{engine} failed: {e}")
+            _record_render(engine, None)
+            error = e
+            continue
+        seconds = time.perf_counter() - start
+        _record_render(engine, seconds)
+        observe(f"pdf.{engine}", seconds)
+        return RenderedPdf(buffer.getvalue(), engine, seconds, pages)
+    raise RuntimeError(f"No PDF engine could render the report (last error: {error})")
+
+
+def _record_render(engine, seconds):
+    with _pdf_lock:
+        stats = _render_stats.setdefault(engine, {"renders": 0, "failures": 0, "seconds": 0.0})
+        if seconds is None:
+            stats["failures"] += 1
+        else:
+            stats["renders"] += 1
+            stats["seconds"] += seconds
+
+
+def pdf_render_stats():
+    """Return engine -> {renders, failures, mean_ms} plus the cache counters."""
+    with _pdf_lock:
+        engines = {
+            engine: {"renders": s["renders"], "failures": s["failures"],
+                     "mean_ms": 1000 * s["seconds"] / s["renders"] if s["renders"] else None}
+            for engine, s in _render_stats.items()
+        }
+        return {"engines": engines, "cached": len(_pdf_cache), "pending": len(_pdf_pending)}
+
+
+def report_key(input_data, predictions):
+    """Hash of one (inputs, predictions) pair; identical reports share a cache entry."""
+    payload = json.dumps([input_data, predictions], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _executor():
+    global _pdf_executor
+    with _pdf_lock:
+        if _pdf_executor is None:
+            _pdf_executor = ThreadPoolExecutor(max_workers=PDF_WORKERS, thread_name_prefix="pdf")
+        return _pdf_executor
+
+
+def cached_pdf(input_data, predictions):
+    """Return the cached RenderedPdf of this report, or None."""
+    key = report_key(input_data, predictions)
+    with _pdf_lock:
+        rendered = _pdf_cache.get(key)
+        if rendered is not None:
+            _pdf_cache.move_to_end(key)
+        return rendered
+
+
+def submit_pdf(input_data, predictions):
+    """Render the PDF on the background pool and return a Future of its RenderedPdf.
+
+    Cached reports resolve immediately and identical requests in flight share
+    one render.
+    """
+    key = report_key(input_data, predictions)
+    executor = _executor()
+    with _pdf_lock:
+        if key in _pdf_cache:
+            _pdf_cache.move_to_end(key)
+            future = Future()
+            future.set_result(_pdf_cache[key])
+            return future
+        if key not in _pdf_pending:
+            # Registered under the lock, so the worker's cleanup always runs after this
+            _pdf_pending[key] = executor.submit(_render_and_cache, key, dict(input_data), dict(predictions))
+        return _pdf_pending[key]
+
+
+def _render_and_cache(key, input_data, predictions):
+    try:
+        rendered = render_pdf(input_data, predictions)
+        with _pdf_lock:
+            _pdf_cache[key] = rendered
+            while len(_pdf_cache) > PDF_CACHE_SIZE:
+                _pdf_cache.popitem(last=False)
+        return rendered
+    finally:
+        with _pdf_lock:
+            _pdf_pending.pop(key, None)
+
+
+def render_reportlab_pdf(input_data, predictions):
+    """Lay out the report with ReportLab; returns (buffer, pages)."""
+    from reportlab_report import render_reportlab_pdf as render  # loads ReportLab on first use
+    return render(input_data, predictions)
+
+
+PDF_ENGINES = {
+    "weasyprint": render_weasyprint_pdf,
+    "reportlab": render_reportlab_pdf,
+}
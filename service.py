@@ -0,0 +1,433 @@
+"""Headless HTTP inference service for the ExtraTrees models.
+
+A small asyncio HTTP/1.1 server with no dependencies beyond the app's own.
+It uses the same ForecastPredictor (feature order, validation and label maps)
+as app.py and batch.py, loads the four models once per worker process (and
+again when a model file changes, e.g. after refresh.py), and runs `predict`
+in thread pools so the GIL-releasing sklearn code of concurrent requests and
+of the four models overlaps. Concurrent single-row requests are
+coalesced by a MicroBatcher into one batched predict call per model.
+
+Endpoints:
+    GET  /health          -> {"status": "ok"}
+    GET  /stats           -> micro-batching latency and batch-size statistics,
+                             prediction cache counters, per-stage latencies,
+                             prediction history writer counters (see history.py)
+    GET  /metrics         -> per-stage latency histograms and counters in the
+                             Prometheus text format (see metrics.py)
+    GET  /drift           -> input drift against the training data (see drift.py)
+    POST /predict         -> one JSON object with the 14 features
+    POST /predict/batch   -> JSON list of objects, {"rows": [...]}, or
+                             {"columns": [...], "data": [[...], ...]};
+                             an Arrow IPC stream is accepted (and returned)
+                             with Content-Type application/vnd.apache.arrow.stream
+    POST /impute          -> {"latitude": ..., "longitude": ..., "k": 5} or
+                             {"locations": [[lat, lon], ...]}: the 14 features
+                             imputed from the nearest stations (spatial_index.py)
+
+With a drift reference, JSON predictions carry "out_of_range" (features of
+the row outside the training range) and "drifting" (features whose recent
+inputs drifted).
+
+Usage:
+    python service.py --host 0.0.0.0 --port 8000 --threads 4 --workers 2 \
+        --max-batch-size 64 --max-wait-ms 2
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from history import get_history, record as record_history
+from metrics import render_prometheus, stage_stats, timed
+from microbatch import MicroBatcher
+from models import required_features
+from predictor import PREDICTION_COLUMNS, get_predictor, to_feature_matrix, validate_columns
+from spatial_index import DEFAULT_K, LOCATION, get_index
+
+ARROW_MIME = "application/vnd.apache.arrow.stream"
+PROMETHEUS_MIME = "text/plain; version=0.0.4"
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class RequestError(Exception):
+    """An error that is reported to the client with the given HTTP status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _to_python(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def rows_from_json(payload):
+    """Turn any of the accepted JSON batch layouts into a DataFrame."""
+    if isinstance(payload, dict) and "columns" in payload and "data" in payload:
+        try:
+            return pd.DataFrame(payload["data"], columns=payload["columns"])
+        except (TypeError, ValueError) as e:
+            raise RequestError(400, f"Invalid columns/data payload: {e}")
+    if isinstance(payload, dict) and "rows" in payload:
+        payload = payload["rows"]
+    if not isinstance(payload, list) or not all(isinstance(r, dict) for r in payload):
+        raise RequestError(400, "Expected a list of feature objects")
+    return pd.DataFrame(payload)
+
+
+def row_from_payload(payload):
+    """Validate one JSON feature object and return it as a float32 row."""
+    if not isinstance(payload, dict):
+        raise RequestError(400, "Expected a JSON object with the 14 features")
+    missing = [f for f in required_features if f not in payload]
+    if missing:
+        raise RequestError(400, f"Input is missing required columns: {', '.join(missing)}")
+    try:
+        row = np.array([float(payload[f]) for f in required_features], dtype=np.float32)
+    except (TypeError, ValueError):
+        raise RequestError(400, "All features must be numeric")
+    if not np.isfinite(row).all():
+        raise RequestError(400, "All features must be finite numbers")
+    return row
+
+
+def score_frame(frame, predictor):
+    """Validate a DataFrame of inputs and return a list of prediction dicts.
+
+    With a drift monitor every dict also lists its out-of-range features.
+    """
+    try:
+        validate_columns(frame.columns)
+    except ValueError as e:
+        raise RequestError(400, str(e))
+    X, valid = to_feature_matrix(frame)
+    if not valid.all():
+        bad = np.flatnonzero(~valid).tolist()
+        raise RequestError(400, f"Rows with missing or non-numeric values: {bad[:20]}")
+    start = time.perf_counter()
+    predictions = predictor.predict_matrix(X)
+    record_history("service", X, predictions, time.perf_counter() - start)
+    results = [
+        {column: _to_python(predictions[column][i]) for column in PREDICTION_COLUMNS}
+        for i in range(len(frame))
+    ]
+    monitor = predictor.monitor
+    if monitor is not None:
+        for result, outside in zip(results, monitor.out_of_range(X)):
+            result["out_of_range"] = [f for f, out in zip(required_features, outside) if out]
+    return results
+
+
+def _finite_or_none(value):
+    return value if np.isfinite(value) else None
+
+
+def impute_payload(payload, index):
+    """Answer /impute for one location object or a {"locations": [[lat, lon], ...]} list."""
+    if not isinstance(payload, dict):
+        raise RequestError(400, "Expected a JSON object with latitude and longitude, or locations")
+    try:
+        k = int(payload.get("k", DEFAULT_K))
+    except (TypeError, ValueError):
+        raise RequestError(400, "k must be an integer")
+    if k < 1:
+        raise RequestError(400, "k must be at least 1")
+    if "locations" in payload:
+        try:
+            locations = np.asarray(payload["locations"], dtype=np.float64).reshape(-1, 2)
+        except (TypeError, ValueError):
+            raise RequestError(400, "locations must be a list of [latitude, longitude] pairs")
+        if not np.isfinite(locations).all():
+            raise RequestError(400, "All locations must be finite numbers")
+        rows = index.impute_many(locations, k).tolist()
+        return {"features": [{f: _finite_or_none(v) for f, v in zip(required_features, row)} for row in rows]}
+    missing = [f for f in LOCATION if f not in payload]
+    if missing:
+        raise RequestError(400, f"Input is missing required columns: {', '.join(missing)}")
+    try:
+        latitude, longitude = float(payload["latitude"]), float(payload["longitude"])
+    except (TypeError, ValueError):
+        raise RequestError(400, "latitude and longitude must be numeric")
+    if not (np.isfinite(latitude) and np.isfinite(longitude)):
+        raise RequestError(400, "latitude and longitude must be finite numbers")
+    features = index.impute(latitude, longitude, k)
+    return {"features": {f: _finite_or_none(v) for f, v in features.items()},
+            "neighbours": index.neighbours(latitude, longitude, k)}
+
+
+class InferenceService:
+    """Request handling shared by every connection of one worker process."""
+
+    def __init__(self, predictor=None, threads=4, max_batch_size=64, max_wait_ms=2.0):
+        self._predictor = predictor
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="predict")
+        self.batcher = None
+        if max_batch_size > 1:
+            self.batcher = MicroBatcher(self._predict_matrix, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    @property
+    def predictor(self):
+        """The fixed predictor, or the process-wide one, rebuilt when a model file changes (e.g. refresh.py)."""
+        return self._predictor if self._predictor is not None else get_predictor()
+
+    def _predict_matrix(self, X):
+        return self.predictor.predict_matrix(X)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def predict_one(self, body):
+        start = time.perf_counter()
+        row = row_from_payload(_parse_json(body))
+        predictor = self.predictor
+        cache = predictor.cache
+        hit = cache.get_many(cache.keys(row[np.newaxis, :]), record_misses=False)[0] if cache is not None else None
+        monitor = predictor.monitor
+        if hit is not None:
+            # Repeated reading: answer right away instead of waiting for a batch
+            result = dict(zip(PREDICTION_COLUMNS, hit))
+            if monitor is not None:
+                monitor.observe(row[np.newaxis, :])  # predict_matrix, which does it otherwise, is skipped
+        elif self.batcher is not None:
+            result = await asyncio.wrap_future(self.batcher.submit(row))
+        else:
+            columns = await self._run(predictor.predict_matrix, row[np.newaxis, :])
+            result = {name: values[0] for name, values in columns.items()}
+        result = {column: _to_python(result[column]) for column in PREDICTION_COLUMNS}
+        record_history("service", row[np.newaxis, :], {column: [result[column]] for column in PREDICTION_COLUMNS},
+                       time.perf_counter() - start)
+        if monitor is not None:
+            result["out_of_range"] = monitor.out_of_range_features(row)
+            result["drifting"] = monitor.drifting()
+        return 200, "application/json", json.dumps(result).encode("utf-8")
+
+    async def predict_batch(self, body, content_type):
+        if content_type.startswith(ARROW_MIME):
+            frame = _arrow_to_frame(body)
+            results = await self._run(score_frame, frame, self.predictor)
+            return 200, ARROW_MIME, _frame_to_arrow(pd.DataFrame(results, columns=PREDICTION_COLUMNS))
+        frame = rows_from_json(_parse_json(body))
+        predictor = self.predictor
+        results = await self._run(score_frame, frame, predictor)
+        response = {"predictions": results}
+        monitor = predictor.monitor
+        if monitor is not None:
+            response["drifting"] = monitor.drifting()
+        return 200, "application/json", json.dumps(response).encode("utf-8")
+
+    async def impute(self, body):
+        payload = _parse_json(body)
+        index = await self._run(get_index)  # loaded (or built) on the first request
+        result = impute_payload(payload, index)
+        return 200, "application/json", json.dumps(result).encode("utf-8")
+
+    async def dispatch(self, method, path, headers, body):
+        if path == "/health":
+            return 200, "application/json", b'{"status": "ok"}'
+        if path == "/stats":
+            stats = self.batcher.stats() if self.batcher is not None else {"batching": "disabled"}
+            cache = self.predictor.cache
+            stats["prediction_cache"] = cache.stats() if cache is not None else "disabled"
+            stats["stages"] = stage_stats()
+            history = get_history()
+            stats["history"] = history.stats() if history is not None else "disabled"
+            return 200, "application/json", json.dumps(stats).encode("utf-8")
+        if path == "/metrics":
+            return 200, PROMETHEUS_MIME, render_prometheus(self.gauges()).encode("utf-8")
+        if path == "/drift":
+            monitor = self.predictor.monitor
+            report = monitor.report() if monitor is not None else {"drift": "disabled or no drift reference"}
+            return 200, "application/json", json.dumps(report).encode("utf-8")
+        if path not in ("/predict", "/predict/batch", "/impute"):
+            raise RequestError(404, f"Unknown path {path}")
+        if method != "POST":
+            raise RequestError(405, "Use POST")
+        with timed(f"service{path}"):
+            if path == "/predict":
+                return await self.predict_one(body)
+            if path == "/impute":
+                return await self.impute(body)
+            return await self.predict_batch(body, headers.get("content-type", "application/json"))
+
+    def gauges(self):
+        """Prediction cache, micro-batching, history and drift gauges exported next to the stage histograms."""
+        gauges = {}
+        if self.predictor.cache is not None:
+            cache = self.predictor.cache.stats()
+            for name in ("hits", "misses", "evictions", "size", "hit_rate"):
+                gauges[f"forecastiq_prediction_cache_{name}"] = cache[name]
+        if self.batcher is not None:
+            batching = self.batcher.stats()
+            gauges["forecastiq_microbatch_requests"] = batching["requests"]
+            gauges["forecastiq_microbatch_batches"] = batching["batches"]
+        history = get_history()
+        if history is not None:
+            written = history.stats()
+            for name in ("written", "dropped", "queued"):
+                gauges[f"forecastiq_history_{name}"] = written[name]
+        monitor = self.predictor.monitor
+        if monitor is not None:
+            gauges.update(monitor.gauges())
+        return gauges
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                try:
+                    status, content_type, payload = await self.dispatch(method, path, headers, body)
+                except RequestError as e:
+                    status, content_type = e.status, "application/json"
+                    payload = json.dumps({"error": str(e)}).encode("utf-8")
+                except Exception as e:
+                    print(f"Prediction failed: {e}")
+                    status, content_type = 500, "application/json"
+                    payload = json.dumps({"error": "internal error"}).encode("utf-8")
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(_response(status, content_type, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except RequestError as e:
+            writer.write(_response(e.status, "application/json",
+                                   json.dumps({"error": str(e)}).encode("utf-8"), False))
+        finally:
+            writer.close()
+
+
+def _parse_json(body):
+    try:
+        return json.loads(body or b"null")
+    except json.JSONDecodeError as e:
+        raise RequestError(400, f"Invalid JSON: {e}")
+
+
+def _arrow_to_frame(body):
+    import pyarrow as pa  # optional dependency, only needed for Arrow payloads
+    try:
+        return pa.ipc.open_stream(body).read_all().to_pandas()
+    except pa.ArrowInvalid as e:
+        raise RequestError(400, f"Invalid Arrow stream: {e}")
+
+
+def _frame_to_arrow(frame):
+    import pyarrow as pa
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as stream:
+        stream.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+async def _read_line(reader):
+    try:
+        return await reader.readline()
+    except ValueError:  # StreamReader reports a line over its limit (LimitOverrunError) as ValueError
+        raise RequestError(400, "Request line or header too long")
+
+
+async def _read_request(reader):
+    """Read one HTTP/1.1 request; return None when the client closed the connection."""
+    request_line = await _read_line(reader)
+    if not request_line.strip():
+        return None
+    try:
+        method, target, _version = request_line.decode("latin-1").split()
+    except ValueError:
+        raise RequestError(400, "Malformed request line")
+    headers = {}
+    while True:
+        line = await _read_line(reader)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0) or 0)
+    except ValueError:
+        raise RequestError(400, "Invalid Content-Length")
+    if length < 0:
+        raise RequestError(400, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise RequestError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target.split("?", 1)[0], headers, body
+
+
+def _response(status, content_type, payload, keep_alive):
+    head = (
+        f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(payload)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode("latin-1") + payload
+
+
+async def serve(host, port, threads, reuse_port=False, max_batch_size=64, max_wait_ms=2.0):
+    get_history()  # each worker opens its prediction history writer before the first request
+    service = InferenceService(threads=threads, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    server = await asyncio.start_server(service.handle_connection, host, port, reuse_port=reuse_port or None)
+    print(f"[{os.getpid()}] Serving {len(required_features)}-feature predictions on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def _worker(host, port, threads, reuse_port, max_batch_size, max_wait_ms):
+    try:
+        asyncio.run(serve(host, port, threads, reuse_port, max_batch_size, max_wait_ms))
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP inference service for the weather models.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--threads", type=int, default=4, help="predict threads per worker")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes sharing the port (SO_REUSEPORT, Linux/macOS only)")
+    parser.add_argument("--max-batch-size", type=int, default=64,
+                        help="most single-row requests coalesced into one predict call (1 disables batching)")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0,
+                        help="longest time a request waits for others to join its batch")
+    args = parser.parse_args(argv)
+
+    batching = (args.max_batch_size, args.max_wait_ms)
+    if args.workers <= 1:
+        _worker(args.host, args.port, args.threads, False, *batching)
+        return
+    processes = [
+        multiprocessing.Process(target=_worker, args=(args.host, args.port, args.threads, True, *batching))
+        for _ in range(args.workers)
+    ]
+    for p in processes:
+        p.start()
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        for p in processes:
+            p.terminate()
+
+
+if __name__ == "__main__":
+    main()
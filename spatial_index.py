@@ -0,0 +1,252 @@
+"""Nearest-station lookups to prefill or impute features from a location.
+
+Users usually know only where they are. `StationIndex` groups the rows of
+the training data by station (unique latitude/longitude), averages the other
+12 features per station and puts the stations in a KD-tree. A location is
+answered with the inverse-distance weighted mean of its k nearest stations.
+
+The tree holds every station as a point on the unit sphere: the straight
+(chord) distance between two such points orders neighbours exactly like the
+haversine distance and converts to it with 2 * asin(chord / 2). A single
+lookup in scipy's cKDTree takes tens of microseconds, a few times faster
+than sklearn's BallTree(metric="haversine"), and bulk lookups use all cores.
+
+The index is built once per source file and persisted next to the data cache
+(`.forecastiq_cache/<sha256>/spatial_index.pkl`), so later processes load it
+in milliseconds; `get_index()` keeps one per process.
+
+    index = get_index()
+    values = index.impute(28.61, 77.21)            # all 14 features
+    X = index.impute_many(latlon_array)            # bulk, one row per location
+    frame, filled = index.fill_missing(frame)      # fill only the NaN / absent features
+
+Environment variables:
+    FORECASTIQ_STATION_DATA   source file of the stations (default IndianWeatherRepository.xlsx next to this module)
+    FORECASTIQ_IMPUTE_K       neighbours averaged per lookup (default 5)
+
+Usage:
+    python spatial_index.py build
+    python spatial_index.py query 28.61 77.21 --k 5
+    python spatial_index.py benchmark
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from data_cache import CACHE_DIR, DEFAULT_SOURCE, load_dataset
+from models import required_features
+
+STATION_DATA = os.environ.get(
+    "FORECASTIQ_STATION_DATA", os.path.join(os.path.dirname(os.path.abspath(__file__)), DEFAULT_SOURCE))
+DEFAULT_K = int(os.environ.get("FORECASTIQ_IMPUTE_K", "5"))
+INDEX_FILE = "spatial_index.pkl"
+FORMAT_VERSION = 1
+
+EARTH_RADIUS_KM = 6371.0088
+LOCATION = ["latitude", "longitude"]
+IMPUTED_FEATURES = [f for f in required_features if f not in LOCATION]
+_location_columns = [required_features.index(f) for f in LOCATION]
+_imputed_columns = [required_features.index(f) for f in IMPUTED_FEATURES]
+
+
+def to_unit_vectors(latitude, longitude):
+    """Return (n, 3) points on the unit sphere for latitudes/longitudes in degrees."""
+    lat = np.radians(np.asarray(latitude, dtype=np.float64))
+    lon = np.radians(np.asarray(longitude, dtype=np.float64))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+class StationIndex:
+    """KD-tree over the stations (on the unit sphere) and their mean features."""
+
+    def __init__(self, locations, features, readings, source_sha256=None, tree=None):
+        self.locations = np.asarray(locations, dtype=np.float64)  # (n_stations, 2) degrees
+        self.features = np.asarray(features, dtype=np.float64)    # (n_stations, 12) in IMPUTED_FEATURES order
+        self.readings = np.asarray(readings, dtype=np.int64)      # rows averaged per station
+        self.source_sha256 = source_sha256
+        if tree is None:
+            from scipy.spatial import cKDTree
+            tree = cKDTree(to_unit_vectors(self.locations[:, 0], self.locations[:, 1]))
+        self.tree = tree
+
+    def __len__(self):
+        return len(self.locations)
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        """Average every feature per unique (latitude, longitude) of a data_cache Dataset."""
+        X = np.asarray(dataset.X, dtype=np.float64)
+        locations, station = np.unique(X[:, _location_columns], axis=0, return_inverse=True)
+        station = station.ravel()
+        values = X[:, _imputed_columns]
+        known = np.isfinite(values)
+        sums = np.zeros((len(locations), len(_imputed_columns)))
+        counts = np.zeros_like(sums)
+        np.add.at(sums, station, np.where(known, values, 0.0))
+        np.add.at(counts, station, known)
+        with np.errstate(invalid="ignore"):
+            features = sums / counts  # NaN where a station never reported a feature
+        readings = np.bincount(station, minlength=len(locations))
+        valid = np.isfinite(locations).all(axis=1)
+        return cls(locations[valid], features[valid], readings[valid], dataset.meta.get("sha256"))
+
+    def query(self, latitude, longitude, k=DEFAULT_K):
+        """Return (distances in km, station ids) of the k nearest stations of every location."""
+        points = to_unit_vectors(np.atleast_1d(latitude), np.atleast_1d(longitude))
+        k = min(k, len(self))
+        chords, ids = self.tree.query(points, k=[k] if k == 1 else k, workers=-1 if len(points) > 1000 else 1)
+        return 2 * np.arcsin(np.minimum(chords / 2, 1.0)) * EARTH_RADIUS_KM, ids
+
+    def impute_many(self, locations, k=DEFAULT_K):
+        """Return a (n, 14) matrix in required_features order for an (n, 2) array of lat/lon."""
+        locations = np.asarray(locations, dtype=np.float64).reshape(-1, 2)
+        distances, ids = self.query(locations[:, 0], locations[:, 1], k)
+        weights = 1.0 / (distances + 1e-3)  # a station at the exact location dominates
+        neighbours = self.features[ids]     # (n, k, 12)
+        known = np.isfinite(neighbours)
+        weighted = np.where(known, neighbours, 0.0) * weights[:, :, np.newaxis]
+        with np.errstate(invalid="ignore"):
+            values = weighted.sum(axis=1) / (known * weights[:, :, np.newaxis]).sum(axis=1)
+        X = np.empty((len(locations), len(required_features)), dtype=np.float64)
+        X[:, _location_columns] = locations
+        X[:, _imputed_columns] = values
+        return X
+
+    def impute(self, latitude, longitude, k=DEFAULT_K):
+        """Return a dict of the 14 features for one location."""
+        row = self.impute_many([[latitude, longitude]], k)[0]
+        return dict(zip(required_features, row.tolist()))
+
+    def neighbours(self, latitude, longitude, k=DEFAULT_K):
+        """Return the k nearest stations as dicts (latitude, longitude, distance_km, readings)."""
+        distances, ids = self.query(latitude, longitude, k)
+        return [
+            {"latitude": float(self.locations[i, 0]), "longitude": float(self.locations[i, 1]),
+             "distance_km": float(d), "readings": int(self.readings[i])}
+            for d, i in zip(distances[0], ids[0])
+        ]
+
+    def fill_missing(self, frame, k=DEFAULT_K):
+        """Fill NaN or absent feature columns of a DataFrame from the nearest stations.
+
+        Rows without a usable latitude/longitude are left as they are. Returns
+        (new frame, number of rows that had at least one value filled).
+        """
+        import pandas as pd
+
+        missing = [f for f in LOCATION if f not in frame.columns]
+        if missing:
+            raise ValueError(f"Input is missing required columns: {', '.join(missing)}")
+        frame = frame.copy()
+        for feature in IMPUTED_FEATURES:
+            frame[feature] = pd.to_numeric(frame[feature], errors="coerce") if feature in frame.columns else np.nan
+        locations = frame[LOCATION].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+        gaps = frame[IMPUTED_FEATURES].isna().to_numpy()
+        rows = np.flatnonzero(gaps.any(axis=1) & np.isfinite(locations).all(axis=1))
+        if rows.size:
+            imputed = self.impute_many(locations[rows], k)[:, _imputed_columns]
+            current = frame[IMPUTED_FEATURES].to_numpy(dtype=np.float64)
+            current[rows] = np.where(gaps[rows], imputed, current[rows])
+            frame[IMPUTED_FEATURES] = current
+        return frame, int(rows.size)
+
+
+def index_path(dataset):
+    return os.path.join(CACHE_DIR, dataset.meta["sha256"], INDEX_FILE)
+
+
+def build_index(source=STATION_DATA):
+    """Build the index of `source` and persist it next to its data cache (atomic replace)."""
+    import joblib
+
+    dataset = load_dataset(source)
+    index = StationIndex.from_dataset(dataset)
+    path = index_path(dataset)
+    tmp = f"{path}.tmp{os.getpid()}"
+    # Plain arrays and the fitted tree, so the file does not depend on where StationIndex is imported from
+    state = {"format_version": FORMAT_VERSION, "locations": index.locations, "features": index.features,
+             "readings": index.readings, "source_sha256": index.source_sha256, "tree": index.tree}
+    joblib.dump(state, tmp)
+    os.replace(tmp, path)
+    return index
+
+
+def load_index(source=STATION_DATA):
+    """Load the persisted index of `source`, building it on first use or when the source changed."""
+    import joblib
+
+    path = index_path(load_dataset(source))
+    if os.path.exists(path):
+        state = joblib.load(path)
+        if state.get("format_version") == FORMAT_VERSION:
+            state.pop("format_version")
+            return StationIndex(**state)
+    return build_index(source)
+
+
+_lock = threading.Lock()
+_default = None
+
+
+def get_index():
+    """Return the process-wide StationIndex of FORECASTIQ_STATION_DATA."""
+    global _default
+    with _lock:
+        if _default is None:
+            _default = load_index()
+        return _default
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the nearest-station index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="build and persist the index")
+    build.add_argument("--data", default=STATION_DATA)
+    query = sub.add_parser("query", help="impute the features of one location")
+    query.add_argument("latitude", type=float)
+    query.add_argument("longitude", type=float)
+    query.add_argument("--k", type=int, default=DEFAULT_K)
+    query.add_argument("--data", default=STATION_DATA)
+    bench = sub.add_parser("benchmark", help="time single and bulk lookups")
+    bench.add_argument("--rows", type=int, default=100_000)
+    bench.add_argument("--data", default=STATION_DATA)
+    args = parser.parse_args(argv)
+
+    try:
+        start = time.perf_counter()
+        index = build_index(args.data) if args.command == "build" else load_index(args.data)
+        elapsed = time.perf_counter() - start
+    except (OSError, ValueError) as e:
+        print(f"Spatial index failed: {e}", file=sys.stderr)
+        return 1
+    if args.command == "build":
+        print(f"Indexed {len(index)} stations of {args.data} in {elapsed:.2f}s")
+    elif args.command == "query":
+        for station in index.neighbours(args.latitude, args.longitude, args.k):
+            print(f"  station {station['latitude']:.4f}, {station['longitude']:.4f}: "
+                  f"{station['distance_km']:.1f} km ({station['readings']} readings)")
+        for feature, value in index.impute(args.latitude, args.longitude, args.k).items():
+            print(f"{feature:30s} {value:10.4f}")
+    else:
+        rng = np.random.default_rng(0)
+        points = np.column_stack([rng.uniform(8, 35, args.rows), rng.uniform(68, 97, args.rows)])
+        repeat = 1000
+        index.impute(*points[0])
+        start = time.perf_counter()
+        for lat, lon in points[:repeat]:
+            index.impute(lat, lon)
+        single = (time.perf_counter() - start) / repeat
+        start = time.perf_counter()
+        index.impute_many(points)
+        bulk = time.perf_counter() - start
+        print(f"{len(index)} stations; load {elapsed * 1000:.1f} ms; single lookup {single * 1e6:.0f} us; "
+              f"{args.rows} locations in {bulk * 1000:.0f} ms ({args.rows / bulk:,.0f}/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
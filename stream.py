@@ -0,0 +1,315 @@
+"""Streaming inference over an unbounded JSONL or CSV feed.
+
+Reads readings from stdin or a file (optionally followed like `tail -F`),
+parses and validates them in a generator pipeline on a reader thread, and
+scores them in chunks with the four models. Predictions are written
+incrementally as each chunk finishes: JSONL input gives JSONL output (the
+input object plus the four prediction fields), CSV input gives CSV output
+(the input columns plus the prediction columns).
+
+- Bounded memory and backpressure: parsed rows go through a bounded queue,
+  so when scoring falls behind the reader blocks (and with it the producer
+  writing to the pipe) instead of buffering without limit.
+- Adaptive chunks: a chunk is scored when it is full or `--max-wait-ms`
+  after its first row arrived. The chunk size doubles while scoring stays
+  well under `--target-ms` and halves when it goes over.
+- Malformed rows (invalid JSON or CSV, missing, non-numeric or non-finite
+  features) are counted per reason and skipped, optionally copied to
+  `--rejects`.
+- Throughput is reported on stderr every `--report-seconds`.
+
+Usage:
+    sensor_feed | python stream.py > predictions.jsonl
+    python stream.py --follow readings.csv --output predictions.csv --rejects bad_rows.csv
+"""
+import argparse
+import collections
+import csv
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+
+from models import required_features
+from predictor import PREDICTION_COLUMNS, get_predictor
+
+DEFAULT_QUEUE_SIZE = 10_000
+DEFAULT_INITIAL_CHUNK = 256
+DEFAULT_MAX_CHUNK = 50_000
+
+_EOF = object()
+
+
+class MalformedRecord(ValueError):
+    """A line that cannot be scored; `reason` is the counter it is reported under."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def follow_lines(path, poll_interval=0.25, from_end=False, stop=None):
+    """Yield lines appended to `path`, like `tail -F` (reopened when rotated or truncated)."""
+    f = open(path, encoding="utf-8", newline="")
+    try:
+        if from_end:
+            f.seek(0, os.SEEK_END)
+        inode = os.fstat(f.fileno()).st_ino
+        partial = ""
+        while stop is None or not stop.is_set():
+            line = f.readline()
+            if line:
+                if not line.endswith("\n"):
+                    partial += line  # the writer has not finished this line yet
+                    continue
+                yield partial + line
+                partial = ""
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                st = None
+            if st is not None and (st.st_ino != inode or st.st_size < f.tell()):
+                f.close()
+                f = open(path, encoding="utf-8", newline="")
+                inode = os.fstat(f.fileno()).st_ino
+                partial = ""
+                continue
+            time.sleep(poll_interval)
+    finally:
+        f.close()
+
+
+def feature_row(record):
+    """Validate one record (dict) and return its float32 feature row."""
+    if any(f not in record for f in required_features):
+        raise MalformedRecord("missing_features")
+    try:
+        row = np.array([float(record[f]) for f in required_features], dtype=np.float32)
+    except (TypeError, ValueError):
+        raise MalformedRecord("non_numeric")
+    if not np.isfinite(row).all():
+        raise MalformedRecord("not_finite")
+    return row
+
+
+def parse_records(lines, fmt, skipped, rejects=None):
+    """Yield (record, feature row) for every valid line; count the others in `skipped`.
+
+    fmt is "jsonl", "csv" or "auto" (decided by the first non-empty line). A
+    CSV stream starts with its header; its first item is ("header", columns).
+    """
+    header = None
+    for line in lines:
+        text = line.strip()
+        if not text:
+            continue
+        if fmt == "auto":
+            fmt = "jsonl" if text.startswith("{") else "csv"
+        if fmt == "csv" and header is None:
+            header = next(csv.reader([text]))
+            missing = [f for f in required_features if f not in header]
+            if missing:
+                raise ValueError(f"Input is missing required columns: {', '.join(missing)}")
+            yield "header", header
+            continue
+        try:
+            if fmt == "jsonl":
+                try:
+                    record = json.loads(text)
+                except json.JSONDecodeError:
+                    raise MalformedRecord("invalid_json")
+                if not isinstance(record, dict):
+                    raise MalformedRecord("not_an_object")
+            else:
+                values = next(csv.reader([text]))
+                if len(values) != len(header):
+                    raise MalformedRecord("wrong_field_count")
+                record = dict(zip(header, values))
+            row = feature_row(record)
+        except MalformedRecord as e:
+            skipped[e.reason] += 1
+            if rejects is not None:
+                rejects.write(text + "\n")
+            continue
+        yield record, row
+
+
+class ChunkSizer:
+    """Grow the chunk while scoring stays under the latency target, shrink it when it goes over."""
+
+    def __init__(self, initial=DEFAULT_INITIAL_CHUNK, maximum=DEFAULT_MAX_CHUNK, target_seconds=0.25):
+        self.size = max(1, min(initial, maximum))
+        self.maximum = maximum
+        self.target = target_seconds
+
+    def update(self, rows, seconds):
+        if seconds > self.target and self.size > 1:
+            self.size = max(1, self.size // 2)
+        elif rows >= self.size and seconds < self.target / 2:
+            self.size = min(self.maximum, self.size * 2)
+
+
+class _Writer:
+    """Write scored chunks as JSONL or CSV and flush after each chunk."""
+
+    def __init__(self, out, fmt):
+        self.out = out
+        self.fmt = fmt
+        self.csv = csv.writer(out) if fmt == "csv" else None
+        self.header = None
+
+    def write_header(self, header):
+        self.header = header
+        self.csv.writerow(header + PREDICTION_COLUMNS)
+
+    def write(self, records, predictions):
+        columns = [predictions[c].tolist() for c in PREDICTION_COLUMNS]
+        if self.fmt == "csv":
+            self.csv.writerows([record[h] for h in self.header] + [column[i] for column in columns]
+                               for i, record in enumerate(records))
+        else:
+            for i, record in enumerate(records):
+                record.update(zip(PREDICTION_COLUMNS, (column[i] for column in columns)))
+                self.out.write(json.dumps(record) + "\n")
+        self.out.flush()
+
+
+def _read(items, q, errors):
+    """Reader thread: push parsed items into the bounded queue (blocks when it is full)."""
+    try:
+        for item in items:
+            q.put(item)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        q.put(_EOF)
+
+
+def _collect(q, size, max_wait, first):
+    """Gather up to `size` items after `first` until `max_wait` seconds have passed; returns (items, eof)."""
+    chunk = [first]
+    deadline = time.monotonic() + max_wait
+    while len(chunk) < size:
+        remaining = deadline - time.monotonic()
+        try:
+            item = q.get(timeout=remaining) if remaining > 0 else q.get_nowait()
+        except queue.Empty:
+            break
+        if item is _EOF:
+            return chunk, True
+        chunk.append(item)
+    return chunk, False
+
+
+def run(lines, out, fmt="auto", predictor=None, queue_size=DEFAULT_QUEUE_SIZE, sizer=None, max_wait=0.05,
+        report_seconds=10.0, rejects=None, report=None):
+    """Score every valid record of `lines` into `out` and return the final counters."""
+    predictor = predictor or get_predictor()
+    sizer = sizer or ChunkSizer()
+    report = report or (lambda message: print(message, file=sys.stderr, flush=True))
+    skipped = collections.Counter()
+    q = queue.Queue(maxsize=queue_size)
+    errors = []
+    reader = threading.Thread(target=_read, args=(parse_records(lines, fmt, skipped, rejects), q, errors),
+                              name="stream-reader", daemon=True)
+    reader.start()
+
+    writer = None
+    stats = {"scored": 0, "chunks": 0}
+    start = last_report = time.monotonic()
+    last_scored = 0
+    eof = False
+    try:
+        while not eof:
+            try:
+                first = q.get(timeout=report_seconds)
+            except queue.Empty:
+                first = None
+            if first is _EOF:
+                break
+            if first is not None and first[0] == "header":
+                writer = _Writer(out, "csv")
+                writer.write_header(first[1])
+                continue
+            if first is not None:
+                chunk, eof = _collect(q, sizer.size, max_wait, first)
+                records, rows = zip(*chunk)
+                chunk_start = time.perf_counter()
+                predictions = predictor.predict_matrix(np.vstack(rows))
+                sizer.update(len(chunk), time.perf_counter() - chunk_start)
+                writer = writer or _Writer(out, "jsonl")
+                writer.write(list(records), predictions)
+                stats["scored"] += len(chunk)
+                stats["chunks"] += 1
+            now = time.monotonic()
+            if now - last_report >= report_seconds:
+                rate = (stats["scored"] - last_scored) / (now - last_report)
+                report(f"[stream] {stats['scored']} scored, {sum(skipped.values())} skipped, {rate:.0f} rows/s, "
+                       f"chunk {sizer.size}, queue {q.qsize()}/{queue_size}")
+                last_report, last_scored = now, stats["scored"]
+    except KeyboardInterrupt:
+        stats["interrupted"] = True  # still report what was scored so far
+    if errors:
+        raise errors[0]
+    elapsed = time.monotonic() - start
+    stats.update(skipped=dict(skipped), seconds=elapsed,
+                 rows_per_second=stats["scored"] / elapsed if elapsed > 0 else float("inf"))
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score an unbounded JSONL/CSV stream of readings.")
+    parser.add_argument("source", nargs="?", default="-", help="input file, or - for stdin (default)")
+    parser.add_argument("--follow", action="store_true", help="keep reading lines appended to the file")
+    parser.add_argument("--from-end", action="store_true", help="with --follow, skip the existing lines")
+    parser.add_argument("--format", choices=["auto", "jsonl", "csv"], default="auto")
+    parser.add_argument("--output", default="-", help="output file, or - for stdout (default)")
+    parser.add_argument("--rejects", default=None, help="copy malformed lines to this file")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help="parsed rows buffered at most")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_INITIAL_CHUNK, help="initial rows per chunk")
+    parser.add_argument("--max-chunk-size", type=int, default=DEFAULT_MAX_CHUNK)
+    parser.add_argument("--target-ms", type=float, default=250.0, help="scoring time per chunk to aim for")
+    parser.add_argument("--max-wait-ms", type=float, default=50.0, help="longest a row waits for its chunk to fill")
+    parser.add_argument("--report-seconds", type=float, default=10.0, help="throughput report interval")
+    args = parser.parse_args(argv)
+
+    if args.follow and args.source == "-":
+        parser.error("--follow needs a file")
+    if args.source != "-" and not os.path.exists(args.source):
+        parser.error(f"{args.source} does not exist")
+
+    if args.follow:
+        lines = follow_lines(args.source, from_end=args.from_end)
+    elif args.source == "-":
+        lines = sys.stdin
+    else:
+        lines = open(args.source, encoding="utf-8", newline="")
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+    rejects = open(args.rejects, "w", encoding="utf-8") if args.rejects else None
+    sizer = ChunkSizer(args.chunk_size, args.max_chunk_size, args.target_ms / 1000.0)
+    try:
+        stats = run(lines, out, args.format, queue_size=args.queue_size, sizer=sizer,
+                    max_wait=args.max_wait_ms / 1000.0, report_seconds=args.report_seconds, rejects=rejects)
+    except BrokenPipeError:
+        return 0  # the consumer went away
+    except (ValueError, OSError) as e:
+        print(f"Streaming failed: {e}", file=sys.stderr)
+        return 1
+    finally:
+        # The follow generator may still be running on the reader thread; it is a daemon, so leave it
+        for f in (out, rejects, None if args.follow else lines):
+            if f not in (None, sys.stdout, sys.stdin):
+                f.close()
+    skipped = ", ".join(f"{reason} {count}" for reason, count in sorted(stats["skipped"].items())) or "none"
+    print(f"Scored {stats['scored']} rows in {stats['chunks']} chunks ({stats['rows_per_second']:.0f} rows/s); "
+          f"skipped: {skipped}", file=sys.stderr)
+    return 130 if stats.get("interrupted") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""Shared fixtures: small ExtraTrees forests fit on synthetic readings with the 14 app features.
+
+The environment is pointed at temporary folders before any ForecastIQ module is
+imported, so the tests never read the real models or write next to them.
+"""
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+_scratch = tempfile.mkdtemp(prefix="forecastiq_tests_")
+os.environ["FORECASTIQ_MODEL_DIR"] = os.path.join(_scratch, "models")
+os.environ["FORECASTIQ_CACHE_DIR"] = os.path.join(_scratch, "cache")
+os.environ["FORECASTIQ_HISTORY_DB"] = ""
+os.makedirs(os.environ["FORECASTIQ_MODEL_DIR"])
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Plausible (low, high) ranges of the 14 features, in models.required_features order
+FEATURE_RANGES = [(8, 37), (68, 97), (10, 100), (0, 40), (0, 100), (990, 1020), (0, 11), (15, 45),
+                  (100, 2000), (0, 200), (0, 100), (0, 50), (0, 150), (0, 250)]
+
+
+def make_readings(n_rows, seed=0):
+    """A DataFrame with the 14 features and the two training targets (precip_mm, temperature_celsius)."""
+    from models import required_features
+
+    rng = np.random.default_rng(seed)
+    low, high = np.array(FEATURE_RANGES, dtype=np.float64).T
+    X = rng.uniform(low, high, size=(n_rows, len(required_features))).round(2)
+    frame = pd.DataFrame(X, columns=required_features)
+    humidity, feels_like = frame["humidity"].to_numpy(), frame["feels_like_celsius"].to_numpy()
+    frame["precip_mm"] = np.maximum(0.0, (humidity - 60) / 8 + rng.normal(0, 1, n_rows)).round(2)
+    frame["temperature_celsius"] = (feels_like - 2 + rng.normal(0, 1, n_rows)).round(1)
+    return frame
+
+
+def fit_models(frame, n_estimators=8):
+    """Fit the four et_* models (and the multi-output regressor) the way the notebook derives their targets."""
+    from sklearn.ensemble import ExtraTreesClassifier, ExtraTreesRegressor
+    from models import required_features
+
+    X = frame[required_features].to_numpy(dtype=np.float32)
+    precip = frame["precip_mm"].to_numpy()
+    temperature = frame["temperature_celsius"].to_numpy()
+    targets = {
+        "et_reg_rain": np.log1p(precip),
+        "et_reg_temp": temperature,
+        "et_cls_rain": (precip > 0).astype(np.int64),
+        "et_cls_temp": np.digitize(temperature, np.quantile(temperature, [1 / 3, 2 / 3])).astype(np.int64),
+    }
+    models = {}
+    for name, y in targets.items():
+        estimator = ExtraTreesClassifier if name.startswith("et_cls") else ExtraTreesRegressor
+        models[name] = estimator(n_estimators=n_estimators, random_state=42).fit(X, y)
+    multi_output = ExtraTreesRegressor(n_estimators=n_estimators, random_state=42).fit(
+        X, np.column_stack([targets["et_reg_rain"], temperature]))
+    return models, multi_output
+
+
+@pytest.fixture(scope="session")
+def readings():
+    return make_readings(400)
+
+
+@pytest.fixture(scope="session")
+def X(readings):
+    from models import required_features
+
+    return readings[required_features].to_numpy(dtype=np.float32)
+
+
+@pytest.fixture(scope="session")
+def fitted(readings):
+    """(models, multi_output) fit on the session's readings."""
+    return fit_models(readings)
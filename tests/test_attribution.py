@@ -0,0 +1,60 @@
+"""Attributions must add up: base value + sum of the contributions = the prediction, in the reported units."""
+import numpy as np
+
+from attribution import TARGETS, ForecastExplainer, ForestAttribution
+from models import required_features
+
+
+def _totals(attributions):
+    return attributions.base + attributions.contributions.sum(axis=2)
+
+
+def test_forest_attribution_adds_up(fitted, X):
+    models, _ = fitted
+    regressor = ForestAttribution(models["et_reg_temp"])
+    totals = regressor.base + regressor.contributions(X).sum(axis=1)
+    np.testing.assert_allclose(totals[:, 0], models["et_reg_temp"].predict(X), rtol=1e-9, atol=1e-9)
+
+    classifier = ForestAttribution(models["et_cls_temp"])
+    totals = classifier.base + classifier.contributions(X).sum(axis=1)
+    np.testing.assert_allclose(totals, models["et_cls_temp"].predict_proba(X), rtol=1e-9, atol=1e-9)
+
+
+def test_explainer_adds_up_in_reported_units(fitted, X):
+    models, _ = fitted
+    totals = _totals(ForecastExplainer(models, use_cache=False).explain_matrix(X))
+    expected = {
+        "rainfall": np.expm1(models["et_reg_rain"].predict(X)),  # mm, not log1p(mm)
+        "temperature": models["et_reg_temp"].predict(X),
+        "rain_class": models["et_cls_rain"].predict_proba(X).max(axis=1),
+        "temp_class": models["et_cls_temp"].predict_proba(X).max(axis=1),
+    }
+    for t, target in enumerate(TARGETS):
+        np.testing.assert_allclose(totals[:, t], expected[target], rtol=1e-9, atol=1e-9, err_msg=target)
+
+
+def test_multi_output_explainer_adds_up(fitted, X):
+    models, multi_output = fitted
+    totals = _totals(ForecastExplainer(models, multi_output, use_cache=False).explain_matrix(X))
+    both = multi_output.predict(X)
+    np.testing.assert_allclose(totals[:, TARGETS.index("rainfall")], np.expm1(both[:, 0]), rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(totals[:, TARGETS.index("temperature")], both[:, 1], rtol=1e-9, atol=1e-9)
+
+
+def test_cached_attributions_are_reused(fitted, X):
+    models, _ = fitted
+    explainer = ForecastExplainer(models)
+    first = explainer.explain_matrix(X[:20])
+    again = explainer.explain_matrix(X[:20])
+    np.testing.assert_array_equal(first.contributions, again.contributions)
+    assert explainer.cache.stats()["hits"] == 20
+
+
+def test_top_contributors_entry(fitted, X):
+    models, _ = fitted
+    reading = dict(zip(required_features, X[0].tolist()))
+    entry = ForecastExplainer(models, use_cache=False).top_contributors(reading, top=3)
+    assert set(entry) == set(TARGETS)
+    for result in entry.values():
+        magnitudes = [abs(value) for _, value in result["top"]]
+        assert len(magnitudes) == 3 and magnitudes == sorted(magnitudes, reverse=True)
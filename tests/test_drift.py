@@ -0,0 +1,31 @@
+"""The monitor bins scored rows exactly like the reference and flags only the features that moved."""
+import numpy as np
+
+from drift import DriftMonitor, build_reference
+from models import required_features
+
+
+def test_training_rows_land_in_the_reference_bins(X):
+    reference = build_reference(X)
+    monitor = DriftMonitor(reference, half_life=np.inf, min_rows=1)
+    for batch in np.array_split(X, 7):
+        monitor.observe(batch)
+    shares = monitor.recent / monitor.recent.sum(axis=1, keepdims=True)
+    np.testing.assert_allclose(shares, monitor.expected, atol=1e-12)
+    assert monitor.drifting() == []
+    report = monitor.report()
+    np.testing.assert_allclose([report["features"][f]["mean"] for f in required_features],
+                               X.astype(np.float64).mean(axis=0))
+    np.testing.assert_allclose([report["features"][f]["std"] for f in required_features],
+                               X.astype(np.float64).std(axis=0))
+    assert all(report["features"][f]["out_of_range"] == 0 for f in required_features)
+
+
+def test_shifted_feature_is_flagged(X):
+    monitor = DriftMonitor(build_reference(X), half_life=np.inf, min_rows=1)
+    shifted = X.copy()
+    column = required_features.index("humidity")
+    shifted[:, column] = np.sort(shifted[:, column])[-1]  # every row at the training maximum
+    monitor.observe(shifted)
+    assert monitor.drifting() == ["humidity"]
+    assert monitor.out_of_range_features(shifted[0] + 1e6) == required_features
@@ -0,0 +1,65 @@
+"""PredictionCache hits, rounding, expiry, eviction and invalidation, and its use by ForecastPredictor."""
+import numpy as np
+
+from prediction_cache import PredictionCache
+from predictor import PREDICTION_COLUMNS, ForecastPredictor
+
+
+def _row(value):
+    return np.full((1, 14), value, dtype=np.float32)
+
+
+def test_hit_after_put_and_rounding():
+    cache = PredictionCache(max_size=10, ttl=60, decimals=2, version_fn=lambda: "v1")
+    keys = cache.keys(_row(1.0))
+    assert cache.get_many(keys) == [None]
+    cache.put_many(keys, [(1.0, 20.0, "Rain", "Hot")])
+    assert cache.get_many(cache.keys(_row(1.001))) == [(1.0, 20.0, "Rain", "Hot")]  # same after rounding
+    assert cache.keys(_row(-0.0)) == cache.keys(_row(0.0))
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 1)
+
+
+def test_model_change_invalidates():
+    version = ["v1"]
+    cache = PredictionCache(version_fn=lambda: version[0], check_interval=0.0)
+    keys = cache.keys(_row(2.0))
+    cache.put_many(keys, ["cached"])
+    assert cache.get_many(keys) == ["cached"]
+    version[0] = "v2"
+    assert cache.get_many(keys) == [None]
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_expiry_and_lru_eviction():
+    expired = PredictionCache(ttl=-1.0, version_fn=lambda: "v1")
+    keys = expired.keys(_row(3.0))
+    expired.put_many(keys, ["old"])
+    assert expired.get_many(keys) == [None] and expired.stats()["expired"] == 1
+
+    cache = PredictionCache(max_size=2, ttl=60, version_fn=lambda: "v1")
+    a, b, c = (cache.keys(_row(v))[0] for v in (1.0, 2.0, 3.0))
+    cache.put_many([a, b], ["a", "b"])
+    cache.get_many([a])  # a is now the most recently used
+    cache.put_many([c], ["c"])
+    assert cache.get_many([a, b, c]) == ["a", None, "c"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_predictor_serves_repeated_rows_from_the_cache(fitted, X):
+    models, _ = fitted
+    predictor = ForecastPredictor(models=models, use_multi_output=False, use_drift_monitor=False)
+    uncached = ForecastPredictor(models=models, use_multi_output=False, use_cache=False, use_drift_monitor=False)
+    first = predictor.predict_matrix(X[:50])
+    second = predictor.predict_matrix(X[:50])
+    expected = uncached.predict_matrix(X[:50])
+    for column in PREDICTION_COLUMNS:
+        np.testing.assert_array_equal(first[column], expected[column])
+        np.testing.assert_array_equal(second[column], expected[column])
+    assert predictor.cache.stats()["hits"] == 50
+
+
+def test_predictor_handles_an_empty_matrix(fitted, X):
+    predictor = ForecastPredictor(models=fitted[0], use_multi_output=False, use_drift_monitor=False)
+    columns = predictor.predict_matrix(X[:0])
+    assert all(len(columns[column]) == 0 for column in PREDICTION_COLUMNS)
@@ -0,0 +1,76 @@
+"""refresh.py: only the models that were swapped in advance, and the others can catch up later."""
+import json
+import os
+
+import joblib
+import pytest
+
+from conftest import fit_models, make_readings
+from models import MODEL_FILES
+from refresh import common_dataset, load_state, refresh, state_path
+
+ACCEPT = {"mse_tolerance": 10.0, "accuracy_tolerance": 1.0}
+REJECT = {"mse_tolerance": -1.0, "accuracy_tolerance": -1.0}
+
+
+@pytest.fixture
+def setup(tmp_path):
+    """(base csv, new rows csv, model folder with the four forests fit on the base rows)."""
+    base, new = str(tmp_path / "base.csv"), str(tmp_path / "new.csv")
+    readings = make_readings(300, seed=1)
+    readings.to_csv(base, index=False)
+    make_readings(80, seed=2).to_csv(new, index=False)
+    model_dir = tmp_path / "models"
+    model_dir.mkdir()
+    models, _ = fit_models(readings)
+    for name, model in models.items():
+        joblib.dump(model, model_dir / MODEL_FILES[name])
+    return base, new, str(model_dir)
+
+
+def _refresh(setup, names=tuple(MODEL_FILES), **tolerances):
+    base, new, model_dir = setup
+    return refresh(new, names, trees=2, n_jobs=1, base_source=base, model_dir=model_dir, **tolerances)
+
+
+def test_skipped_models_catch_up(setup):
+    base, _, model_dir = setup
+    results = _refresh(setup, ["et_reg_rain"], **ACCEPT)
+    # The forests are read from model_dir (FORECASTIQ_MODEL_DIR has none in the tests)
+    assert results["et_reg_rain"]["file"] == os.path.join(model_dir, MODEL_FILES["et_reg_rain"])
+    assert results["et_reg_rain"]["trees_after"] == results["et_reg_rain"]["trees_before"] + 2
+    state = load_state(base, model_dir)
+    assert state["models"]["et_reg_rain"]["applied"] and not state["models"]["et_reg_temp"]["applied"]
+    assert common_dataset(state) is None
+    assert not os.path.exists(os.path.join(model_dir, "drift_reference.json"))
+
+    results = _refresh(setup, **ACCEPT)
+    assert results["et_reg_rain"]["skipped"]
+    assert all(results[name].get("file") for name in ("et_reg_temp", "et_cls_rain", "et_cls_temp"))
+    state = load_state(base, model_dir)
+    assert common_dataset(state) == state["models"]["et_reg_rain"]["dataset"]
+    assert os.path.exists(os.path.join(model_dir, "drift_reference.json"))
+    with pytest.raises(ValueError, match="already applied"):
+        _refresh(setup, **ACCEPT)
+
+
+def test_rejected_model_keeps_its_state_and_file(setup):
+    base, _, model_dir = setup
+    path = os.path.join(model_dir, MODEL_FILES["et_reg_temp"])
+    before = os.stat(path).st_mtime_ns
+    results = _refresh(setup, ["et_reg_temp"], **REJECT)
+    assert not results["et_reg_temp"]["accepted"] and "file" not in results["et_reg_temp"]
+    assert os.stat(path).st_mtime_ns == before
+    assert not os.path.exists(state_path(model_dir))
+
+    results = _refresh(setup, ["et_reg_temp"], **ACCEPT)  # the same file can still be applied
+    assert results["et_reg_temp"]["file"]
+    assert load_state(base, model_dir)["models"]["et_reg_temp"]["applied"]
+
+
+def test_state_without_per_model_entries_is_migrated(setup):
+    base, _, model_dir = setup
+    with open(state_path(model_dir), "w") as f:
+        json.dump({"base": "b", "dataset": "d", "applied": ["x"], "history": []}, f)
+    state = load_state(base, model_dir)
+    assert state["models"] == {name: {"dataset": "d", "applied": ["x"]} for name in MODEL_FILES}
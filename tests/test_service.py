@@ -0,0 +1,77 @@
+"""service.py answers malformed requests with 400 instead of dropping the connection."""
+import asyncio
+import json
+
+import pytest
+
+from models import required_features
+from predictor import ForecastPredictor
+from service import InferenceService, RequestError, _read_request, rows_from_json
+
+
+def _exchange(predictor, raw_requests):
+    """Send each raw request on its own connection to a local server; return [(status, body)]."""
+    async def run():
+        service = InferenceService(predictor, threads=1, max_batch_size=1)
+        server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        replies = []
+        async with server:
+            for raw in raw_requests:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(raw)
+                await writer.drain()
+                response = await asyncio.wait_for(reader.read(), timeout=30)
+                writer.close()
+                head, _, body = response.partition(b"\r\n\r\n")
+                status = int(head.split(b" ")[1]) if head else None
+                replies.append((status, json.loads(body) if body else None))
+        service.executor.shutdown()
+        return replies
+    return asyncio.run(run())
+
+
+def _post(path, body, content_length=None):
+    length = len(body) if content_length is None else content_length
+    return (f"POST {path} HTTP/1.1\r\nContent-Length: {length}\r\nConnection: close\r\n\r\n".encode("latin-1")
+            + body)
+
+
+@pytest.fixture(scope="module")
+def predictor(fitted):
+    return ForecastPredictor(models=fitted[0], use_multi_output=False, use_cache=False, use_drift_monitor=False)
+
+
+def test_bad_requests_get_400(predictor, X):
+    reading = dict(zip(required_features, X[0].tolist()))
+    mismatched = {"columns": required_features, "data": [X[0, :5].tolist()]}
+    replies = _exchange(predictor, [
+        _post("/predict", b"", content_length="abc"),
+        _post("/predict", b"", content_length="-3"),
+        _post("/predict/batch", json.dumps(mismatched).encode("utf-8")),
+        _post("/predict", b"{not json"),
+        _post("/predict", json.dumps(reading).encode("utf-8")),
+    ])
+    assert [status for status, _ in replies] == [400, 400, 400, 400, 200]
+    assert "Content-Length" in replies[0][1]["error"]
+    assert set(replies[-1][1]) >= {"rainfall_mm", "temperature_c", "rain_class", "temp_class"}
+
+
+def test_overlong_header_line_is_a_request_error():
+    async def read(raw):
+        reader = asyncio.StreamReader(limit=1024)
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await _read_request(reader)
+
+    with pytest.raises(RequestError) as error:
+        asyncio.run(read(b"GET /health HTTP/1.1\r\nX-Long: " + b"a" * 4096 + b"\r\n\r\n"))
+    assert error.value.status == 400
+    assert asyncio.run(read(b"GET /health?x=1 HTTP/1.1\r\nHost: a\r\n\r\n"))[:2] == ("GET", "/health")
+
+
+def test_rows_from_json_rejects_mismatched_columns():
+    with pytest.raises(RequestError) as error:
+        rows_from_json({"columns": ["a", "b"], "data": [[1.0]]})
+    assert error.value.status == 400
+    assert rows_from_json({"columns": ["a"], "data": [[1.0], [2.0]]}).shape == (2, 1)
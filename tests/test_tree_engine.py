@@ -0,0 +1,33 @@
+"""CompiledForest must reproduce the sklearn forests exactly, in memory and from a memory-mapped export."""
+import numpy as np
+
+from tree_engine import compile_forest, export_forests, load_forests, verify
+
+
+def test_compiled_forests_are_bit_exact(fitted, X):
+    models, multi_output = fitted
+    forests = dict(models, et_reg_multi=multi_output)
+    compiled = {name: compile_forest(forest) for name, forest in forests.items()}
+    report = verify(forests, compiled, X)
+    assert all(result["ok"] for result in report.values()), report
+    for name in ("et_reg_rain", "et_reg_temp", "et_reg_multi"):
+        assert report[name]["bit_exact"], name
+    for name in ("et_cls_rain", "et_cls_temp"):
+        np.testing.assert_array_equal(compiled[name].predict_proba(X), forests[name].predict_proba(X))
+
+
+def test_memory_mapped_export_matches(fitted, X, tmp_path):
+    models, _ = fitted
+    path = str(tmp_path / "forest_engine.npz")
+    export_forests(models, path)
+    loaded = load_forests(path, mmap=True)
+    assert set(loaded) == set(models)
+    report = verify(models, loaded, X)
+    assert all(result["ok"] for result in report.values()), report
+
+
+def test_single_row_and_empty_input(fitted, X):
+    forest = fitted[0]["et_reg_temp"]
+    compiled = compile_forest(forest)
+    np.testing.assert_array_equal(compiled.predict(X[:1]), forest.predict(X[:1]))
+    assert compiled.predict(X[:0]).shape == (0,)
@@ -0,0 +1,271 @@
+"""Scripted, parallel and resumable version of the notebook's model bake-off.
+
+Builds the feature matrix once (from the data_cache), then trains every
+(algorithm x target) combination of final1.ipynb across a process pool with a
+bounded CPU budget. Each finished model is checkpointed together with its
+metrics, so an interrupted run picks up where it stopped; a checkpoint of
+other data (the source's SHA-256) or other split parameters is retrained. At
+the end the best ExtraTrees model per target is exported under the file names
+app.py loads (et_reg_rain.pkl, et_reg_temp.pkl, et_cls_rain.pkl,
+et_cls_temp.pkl), together with the drift reference of the training rows
+(drift.py). Only ExtraTrees is exported because tree_engine, compress,
+refresh, attribution and drift all read those files as sklearn forests; a
+better non-forest winner is reported but stays in the run folder.
+
+Usage:
+    python train.py --data IndianWeatherRepository.xlsx --run-dir runs/latest --cpus 8 --export
+    python train.py --algorithms extra_trees random_forest --targets reg_rain cls_rain
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import joblib
+import numpy as np
+
+from data_cache import DEFAULT_SOURCE, load_dataset
+from models import MODEL_DIR, MODEL_FILES
+
+RANDOM_STATE = 42
+TEST_SIZE = 0.2
+# Recorded with every checkpoint: a checkpoint only resumes a run with the same data and parameters
+JOB_PARAMS = {"test_size": TEST_SIZE, "random_state": RANDOM_STATE}
+
+# target name -> (kind, file name exported for app.py)
+TARGETS = {
+    "reg_rain": ("regression", MODEL_FILES["et_reg_rain"]),
+    "reg_temp": ("regression", MODEL_FILES["et_reg_temp"]),
+    "cls_rain": ("classification", MODEL_FILES["et_cls_rain"]),
+    "cls_temp": ("classification", MODEL_FILES["et_cls_temp"]),
+}
+
+ALGORITHMS = ["extra_trees", "random_forest", "xgboost", "lightgbm", "svm"]
+EXPORT_ALGORITHM = "extra_trees"  # the et_*.pkl files must stay ExtraTrees forests
+
+
+def build_targets(dataset):
+    """Return the four target vectors exactly as the notebook derives them."""
+    from sklearn.preprocessing import KBinsDiscretizer
+
+    temperature = np.asarray(dataset.temperature_celsius, dtype=np.float64)
+    binner = KBinsDiscretizer(n_bins=3, encode="ordinal", strategy="quantile")
+    return {
+        "reg_rain": np.asarray(dataset.log_precip_mm, dtype=np.float64),
+        "reg_temp": temperature,
+        "cls_rain": np.asarray(dataset.rain_occurred, dtype=np.int64),
+        "cls_temp": binner.fit_transform(temperature.reshape(-1, 1)).astype(np.int64).ravel(),
+    }
+
+
+def split_indices(n_rows):
+    """Train/test row indices shared by every job (same split as the notebook's random_state=42)."""
+    from sklearn.model_selection import train_test_split
+    return train_test_split(np.arange(n_rows), test_size=TEST_SIZE, random_state=RANDOM_STATE)
+
+
+def balanced_weights(y):
+    """Per-class 'balanced' weights, as computed in the notebook."""
+    from sklearn.utils.class_weight import compute_class_weight
+    classes = np.unique(y)
+    return dict(zip(classes.tolist(), compute_class_weight("balanced", classes=classes, y=y)))
+
+
+def make_estimator(algorithm, kind, class_weight, n_jobs):
+    """Return an unfitted estimator configured like the notebook; raises ImportError if unavailable."""
+    is_cls = kind == "classification"
+    if algorithm == "extra_trees":
+        from sklearn.ensemble import ExtraTreesClassifier, ExtraTreesRegressor
+        if is_cls:
+            return ExtraTreesClassifier(n_jobs=n_jobs, random_state=RANDOM_STATE, class_weight=class_weight)
+        return ExtraTreesRegressor(n_jobs=n_jobs, random_state=RANDOM_STATE)
+    if algorithm == "random_forest":
+        from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+        if is_cls:
+            return RandomForestClassifier(n_jobs=n_jobs, random_state=RANDOM_STATE, class_weight=class_weight)
+        return RandomForestRegressor(n_jobs=n_jobs, random_state=RANDOM_STATE)
+    if algorithm == "xgboost":
+        import xgboost as xgb
+        if is_cls:
+            return xgb.XGBClassifier(n_jobs=n_jobs, random_state=RANDOM_STATE)
+        return xgb.XGBRegressor(n_jobs=n_jobs, random_state=RANDOM_STATE)
+    if algorithm == "lightgbm":
+        import lightgbm as lgb
+        if is_cls:
+            return lgb.LGBMClassifier(n_jobs=n_jobs, random_state=RANDOM_STATE, class_weight=class_weight, verbose=-1)
+        return lgb.LGBMRegressor(n_jobs=n_jobs, random_state=RANDOM_STATE, verbose=-1)
+    if algorithm == "svm":
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import StandardScaler
+        from sklearn.svm import SVC, SVR
+        # The notebook standardizes the features before the SVMs
+        if is_cls:
+            return make_pipeline(StandardScaler(), SVC(kernel="rbf", class_weight=class_weight))
+        return make_pipeline(StandardScaler(), SVR(kernel="rbf"))
+    raise ValueError(f"Unknown algorithm {algorithm}")
+
+
+def evaluate(target, y_true, y_pred):
+    """Notebook metrics: MSE (rainfall in mm, not log) or accuracy."""
+    from sklearn.metrics import accuracy_score, mean_squared_error
+    if target == "reg_rain":
+        return {"mse": float(mean_squared_error(np.expm1(y_true), np.expm1(y_pred)))}
+    if TARGETS[target][0] == "regression":
+        return {"mse": float(mean_squared_error(y_true, y_pred))}
+    return {"accuracy": float(accuracy_score(y_true, y_pred))}
+
+
+def checkpoint_paths(run_dir, algorithm, target):
+    stem = os.path.join(run_dir, f"{algorithm}__{target}")
+    return f"{stem}.pkl", f"{stem}.json"
+
+
+def run_job(data_path, run_dir, algorithm, target, n_jobs):
+    """Fit and evaluate one (algorithm, target) pair and checkpoint it; runs in a worker process."""
+    dataset = load_dataset(data_path)  # memory-mapped, so every worker shares the same pages
+    y = build_targets(dataset)[target]
+    train_idx, test_idx = split_indices(len(dataset))
+    X = dataset.X
+    kind = TARGETS[target][0]
+    class_weight = balanced_weights(y) if kind == "classification" else None
+    estimator = make_estimator(algorithm, kind, class_weight, n_jobs)
+
+    fit_kwargs = {}
+    if algorithm == "xgboost" and class_weight is not None:
+        # XGBoost has no class_weight; use per-sample weights like the notebook
+        fit_kwargs["sample_weight"] = np.array([class_weight[c] for c in y[train_idx]])
+    start = time.perf_counter()
+    estimator.fit(X[train_idx], y[train_idx], **fit_kwargs)
+    fit_seconds = time.perf_counter() - start
+    metrics = evaluate(target, y[test_idx], estimator.predict(X[test_idx]))
+
+    model_path, metrics_path = checkpoint_paths(run_dir, algorithm, target)
+    joblib.dump(estimator, f"{model_path}.tmp")
+    os.replace(f"{model_path}.tmp", model_path)
+    record = {"algorithm": algorithm, "target": target, "sha256": dataset.meta["sha256"], "params": JOB_PARAMS,
+              "fit_seconds": fit_seconds, "train_rows": len(train_idx), "test_rows": len(test_idx), **metrics}
+    # The metrics file is written last: its presence marks the job as finished
+    with open(f"{metrics_path}.tmp", "w") as f:
+        json.dump(record, f, indent=2)
+    os.replace(f"{metrics_path}.tmp", metrics_path)
+    return record
+
+
+def is_available(algorithm):
+    try:
+        make_estimator(algorithm, "regression", None, 1)
+        return True
+    except ImportError:
+        return False
+
+
+def load_finished(run_dir, jobs, digest):
+    """Return the metric records of jobs that already completed in run_dir on the dataset `digest`."""
+    finished = {}
+    for algorithm, target in jobs:
+        model_path, metrics_path = checkpoint_paths(run_dir, algorithm, target)
+        if os.path.exists(metrics_path) and os.path.exists(model_path):
+            with open(metrics_path) as f:
+                record = json.load(f)
+            if record.get("sha256") == digest and record.get("params") == JOB_PARAMS:
+                finished[(algorithm, target)] = record
+    return finished
+
+
+def pick_best(records):
+    """Return target -> best record (lowest MSE or highest accuracy)."""
+    best = {}
+    for record in records:
+        target = record["target"]
+        score = -record["mse"] if "mse" in record else record["accuracy"]
+        if target not in best or score > best[target][0]:
+            best[target] = (score, record)
+    return {target: record for target, (_, record) in best.items()}
+
+
+def export_best(run_dir, best, model_dir=MODEL_DIR):
+    """Copy the winning ExtraTrees checkpoints to the file names app.py loads (atomic replace)."""
+    exported = {}
+    for target, record in best.items():
+        if record["algorithm"] != EXPORT_ALGORITHM:
+            raise ValueError(f"only {EXPORT_ALGORITHM} models can be exported to {TARGETS[target][1]}, "
+                             f"got {record['algorithm']} for {target}")
+        source, _ = checkpoint_paths(run_dir, record["algorithm"], target)
+        destination = os.path.join(model_dir, TARGETS[target][1])
+        shutil.copyfile(source, f"{destination}.tmp")
+        os.replace(f"{destination}.tmp", destination)  # a running app reloads it on the next request
+        exported[target] = {"file": destination, **record}
+    with open(os.path.join(run_dir, "best_models.json"), "w") as f:
+        json.dump(exported, f, indent=2)
+    return exported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train and compare all notebook models in parallel.")
+    parser.add_argument("--data", default=DEFAULT_SOURCE, help="xlsx or csv training file")
+    parser.add_argument("--run-dir", default=os.path.join("runs", "latest"), help="checkpoint folder (reuse it to resume)")
+    parser.add_argument("--algorithms", nargs="+", default=ALGORITHMS, choices=ALGORITHMS)
+    parser.add_argument("--targets", nargs="+", default=list(TARGETS), choices=list(TARGETS))
+    parser.add_argument("--cpus", type=int, default=os.cpu_count() or 1, help="total CPU budget")
+    parser.add_argument("--workers", type=int, default=None, help="parallel jobs (default: min(jobs, cpus))")
+    parser.add_argument("--export", action="store_true", help="export the best model per target for app.py")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.run_dir, exist_ok=True)
+    algorithms = [a for a in args.algorithms if is_available(a)]
+    for skipped in sorted(set(args.algorithms) - set(algorithms)):
+        print(f"Skipping {skipped}: package not installed")
+    jobs = [(a, t) for a in algorithms for t in args.targets]
+
+    dataset = load_dataset(args.data)  # build the cache once, before the workers start
+    finished = load_finished(args.run_dir, jobs, dataset.meta["sha256"])
+    pending = [job for job in jobs if job not in finished]
+    if finished:
+        print(f"Resuming: {len(finished)} of {len(jobs)} jobs already done in {args.run_dir}")
+    stale = [job for job in pending if os.path.exists(checkpoint_paths(args.run_dir, *job)[1])]
+    if stale:
+        print(f"Retraining {len(stale)} jobs whose checkpoints were trained on other data or parameters")
+
+    records = list(finished.values())
+    if pending:
+        workers = max(1, min(args.workers or len(pending), len(pending), args.cpus))
+        n_jobs = max(1, args.cpus // workers)
+        print(f"Training {len(pending)} models on {workers} workers x {n_jobs} threads")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_job, args.data, args.run_dir, a, t, n_jobs): (a, t) for a, t in pending}
+            for future in as_completed(futures):
+                algorithm, target = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    print(f"{algorithm} / {target} failed: {e}")
+                    continue
+                records.append(record)
+                score = f"MSE {record['mse']:.4f}" if "mse" in record else f"accuracy {record['accuracy']:.4f}"
+                print(f"{algorithm:14s} {target:9s} {score}  ({record['fit_seconds']:.1f}s)")
+
+    best = pick_best(records)
+    for target, record in sorted(best.items()):
+        score = f"MSE {record['mse']:.4f}" if "mse" in record else f"accuracy {record['accuracy']:.4f}"
+        print(f"Best {target}: {record['algorithm']} ({score})")
+    if args.export:
+        exportable = pick_best([r for r in records if r["algorithm"] == EXPORT_ALGORITHM])
+        for target, record in sorted(best.items()):
+            if target not in exportable:
+                print(f"Not exporting {target}: no {EXPORT_ALGORITHM} model was trained for it")
+            elif record["algorithm"] != EXPORT_ALGORITHM:
+                print(f"Not exporting {record['algorithm']} for {target} (the et_*.pkl files must be "
+                      f"{EXPORT_ALGORITHM}); exporting the best {EXPORT_ALGORITHM} model instead")
+        for target, info in export_best(args.run_dir, exportable).items():
+            print(f"Exported {target} -> {info['file']}")
+        from drift import write_reference
+        train_idx, _ = split_indices(len(dataset))
+        print(f"Wrote the drift reference {write_reference(dataset.X[train_idx])}")
+    return 0 if len(records) == len(jobs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,305 @@
+"""Array-backed inference engine for the ExtraTrees forests.
+
+`export_forests` flattens every tree of every forest (split feature, threshold,
+left/right child and leaf value or class distribution) into contiguous NumPy
+arrays and writes them to one uncompressed .npz file. `load_forests` maps that
+file back into memory (read-only, shared through the page cache) in a few
+milliseconds, and `CompiledForest` evaluates all trees of a forest for a whole
+batch at once with vectorized NumPy indexing instead of one Python-level tree
+object per estimator.
+
+CompiledForest mimics the sklearn API used by the app (`predict`,
+`predict_proba`, `classes_`), so ForecastPredictor can use it in place of
+the sklearn forests.
+
+Usage:
+    python tree_engine.py export --output forest_engine.npz
+    python tree_engine.py verify --engine forest_engine.npz --data IndianWeatherRepository.xlsx
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import zipfile
+
+import numpy as np
+
+DEFAULT_ENGINE_FILE = "forest_engine.npz"
+DEFAULT_CHUNK_ROWS = 4096
+
+
+class CompiledForest:
+    """A forest stored as flat node arrays; leaves point to themselves.
+
+    All trees are walked level by level for the whole batch at once. Each step
+    only touches the (row, tree) pairs that have not reached a leaf yet, so the
+    work shrinks as the shallow branches finish.
+    """
+
+    def __init__(self, arrays, meta):
+        # np.asarray keeps memory-mapped arrays mapped but drops the np.memmap subclass
+        self.feature = np.asarray(arrays["feature"])
+        self.threshold = np.asarray(arrays["threshold"])
+        self.left = np.asarray(arrays["left"])
+        self.right = np.asarray(arrays["right"])
+        self.value = np.asarray(arrays["value"])
+        self.roots = np.asarray(arrays["roots"])
+        self.kind = meta["kind"]
+        self.max_depth = int(meta["max_depth"])
+        self.n_features_in_ = int(meta["n_features"])
+        self.classes_ = np.asarray(arrays["classes"]) if self.kind == "classifier" else None
+        self.n_estimators = len(self.roots)
+        self.is_leaf = self.left == np.arange(len(self.left), dtype=self.left.dtype)
+
+    def apply(self, X):
+        """Return the leaf index reached by every row in every tree, shape (n_rows, n_trees)."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        flat_X = X.ravel()
+        # Tree-major order keeps consecutive lookups inside the same tree's node block
+        nodes = np.repeat(self.roots, n_rows)
+        row_offsets = np.tile(np.arange(n_rows, dtype=np.int64) * n_features, self.n_estimators)
+        # Only (row, tree) pairs that have not reached a leaf yet take another step
+        active = np.flatnonzero(~self.is_leaf[nodes])
+        for _ in range(self.max_depth):
+            if active.size == 0:
+                break
+            current = nodes[active]
+            go_left = flat_X[row_offsets[active] + self.feature[current]] <= self.threshold[current]
+            following = np.where(go_left, self.left[current], self.right[current])
+            nodes[active] = following
+            active = active[~self.is_leaf[following]]
+        return nodes.reshape(self.n_estimators, n_rows).T
+
+    def _leaf_values(self, X, chunk_rows=DEFAULT_CHUNK_ROWS):
+        """Average the leaf values over all trees, chunking rows to bound memory."""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[np.newaxis, :]
+        out = np.empty((X.shape[0],) + self.value.shape[1:], dtype=np.float64)
+        for start in range(0, X.shape[0], chunk_rows):
+            leaves = self.apply(X[start:start + chunk_rows])
+            # Add the trees one at a time, in order, like sklearn: np.sum over a single row's
+            # trees sums pairwise and can differ in the last bit, np.cumsum does not.
+            # Accumulate in float64 also when compress.py stored the values as float32.
+            total = np.cumsum(self.value[leaves], axis=1, dtype=np.float64)[:, -1]
+            out[start:start + chunk_rows] = total / self.n_estimators
+        return out
+
+    def predict_proba(self, X):
+        if self.kind != "classifier":
+            raise AttributeError("predict_proba is only available for classifiers")
+        return self._leaf_values(X)
+
+    def predict(self, X):
+        values = self._leaf_values(X)
+        if self.kind == "classifier":
+            return self.classes_.take(np.argmax(values, axis=1))
+        return values[:, 0] if values.shape[1] == 1 else values
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.feature, self.threshold, self.left, self.right, self.value, self.roots))
+
+
+def flatten_forest(forest):
+    """Return (arrays, meta) describing every tree of a fitted sklearn forest."""
+    is_classifier = hasattr(forest, "classes_")
+    if is_classifier and getattr(forest, "n_outputs_", 1) != 1:
+        raise ValueError("Multi-output classifiers are not supported")
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        n = tree.node_count
+        node_ids = np.arange(n, dtype=np.int32)
+        is_leaf = tree.children_left == -1
+        left = np.where(is_leaf, node_ids, tree.children_left).astype(np.int32) + offset
+        right = np.where(is_leaf, node_ids, tree.children_right).astype(np.int32) + offset
+        value = np.asarray(tree.value, dtype=np.float64)
+        if is_classifier:
+            # (n_nodes, 1, n_classes) -> class distribution per node, like DecisionTreeClassifier.predict_proba
+            value = value[:, 0, :]
+            totals = value.sum(axis=1, keepdims=True)
+            totals[totals == 0.0] = 1.0
+            value = value / totals
+        else:
+            # (n_nodes, n_outputs, 1) -> (n_nodes, n_outputs)
+            value = value[:, :, 0]
+        features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        thresholds.append(np.asarray(tree.threshold, dtype=np.float64))
+        lefts.append(left)
+        rights.append(right)
+        values.append(value)
+        roots.append(offset)
+        offset += n
+        max_depth = max(max_depth, int(tree.max_depth))
+    arrays = {
+        "feature": np.concatenate(features),
+        "threshold": np.concatenate(thresholds),
+        "left": np.concatenate(lefts),
+        "right": np.concatenate(rights),
+        "value": np.ascontiguousarray(np.concatenate(values)),
+        "roots": np.asarray(roots, dtype=np.int32),
+    }
+    if is_classifier:
+        arrays["classes"] = np.asarray(forest.classes_)
+    meta = {
+        "kind": "classifier" if is_classifier else "regressor",
+        "max_depth": max_depth,
+        "n_features": int(forest.n_features_in_),
+        "n_estimators": len(forest.estimators_),
+        "n_nodes": offset,
+    }
+    return arrays, meta
+
+
+def compile_forest(forest):
+    """Convert a fitted sklearn forest into a CompiledForest held in memory."""
+    arrays, meta = flatten_forest(forest)
+    return CompiledForest(arrays, meta)
+
+
+def export_forests(forests, path):
+    """Write several forests (a dict name -> fitted forest) into one .npz file."""
+    return write_engine({name: flatten_forest(forest) for name, forest in forests.items()}, path)
+
+
+def write_engine(flattened, path):
+    """Write name -> (arrays, meta) pairs, as returned by flatten_forest, into one .npz file."""
+    payload = {}
+    metas = {}
+    for name, (arrays, meta) in flattened.items():
+        metas[name] = meta
+        for key, array in arrays.items():
+            payload[f"{name}.{key}"] = array
+    payload["__meta__"] = np.frombuffer(json.dumps(metas).encode("utf-8"), dtype=np.uint8)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **payload)  # uncompressed, so every member can be memory-mapped
+    os.replace(tmp_path, path)
+    return metas
+
+
+def _mmap_npz(path):
+    """Memory-map every array of an uncompressed .npz file (np.load cannot do this itself)."""
+    arrays = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{path} is compressed; re-export it with export_forests")
+            # Skip the local file header to find the start of the .npy member
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = np.frombuffer(f.read(4), dtype="<u2")
+            f.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            key = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if dtype.hasobject:
+                raise ValueError(f"{key} holds Python objects and cannot be memory-mapped")
+            if int(np.prod(shape)) == 0:
+                arrays[key] = np.empty(shape, dtype=dtype)
+                continue
+            arrays[key] = np.memmap(path, dtype=dtype, mode="r", offset=f.tell(), shape=shape,
+                                    order="F" if fortran_order else "C")
+    return arrays
+
+
+def load_forests(path=DEFAULT_ENGINE_FILE, mmap=True):
+    """Load the forests written by export_forests as a dict name -> CompiledForest."""
+    if mmap:
+        arrays = _mmap_npz(path)
+    else:
+        with np.load(path) as data:
+            arrays = {key: data[key] for key in data.files}
+    metas = json.loads(bytes(arrays.pop("__meta__")).decode("utf-8"))
+    forests = {}
+    for name, meta in metas.items():
+        prefix = f"{name}."
+        own = {key[len(prefix):]: array for key, array in arrays.items() if key.startswith(prefix)}
+        forests[name] = CompiledForest(own, meta)
+    return forests
+
+
+def verify(forests, compiled, X, rtol=1e-9, atol=1e-9):
+    """Compare CompiledForest predictions with sklearn's on X and return a report per model."""
+    report = {}
+    for name, forest in forests.items():
+        expected = forest.predict(X)
+        actual = compiled[name].predict(X)
+        if compiled[name].kind == "classifier":
+            mismatches = int(np.sum(expected != actual))
+            report[name] = {"mismatches": mismatches, "rows": len(X), "ok": mismatches == 0}
+        else:
+            max_abs = float(np.max(np.abs(expected - actual))) if len(X) else 0.0
+            report[name] = {
+                "max_abs_diff": max_abs,
+                "bit_exact": bool(np.array_equal(expected, actual)),
+                "ok": bool(np.allclose(expected, actual, rtol=rtol, atol=atol)),
+            }
+    return report
+
+
+def _time_single_row(predict, row, repeat=50):
+    predict(row)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        predict(row)
+    return (time.perf_counter() - start) / repeat * 1000.0
+
+
+def main(argv=None):
+    from models import MODEL_FILES, MULTI_OUTPUT_FILE, MULTI_OUTPUT_NAME, load_model, model_path, required_features
+
+    parser = argparse.ArgumentParser(description="Compile the ExtraTrees forests into a flat array engine.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="flatten the et_*.pkl models into one .npz file")
+    export.add_argument("--output", default=DEFAULT_ENGINE_FILE)
+    check = sub.add_parser("verify", help="compare the engine with sklearn and report load time/latency")
+    check.add_argument("--engine", default=DEFAULT_ENGINE_FILE)
+    check.add_argument("--data", default="IndianWeatherRepository.xlsx")
+    args = parser.parse_args(argv)
+
+    forests = {name: load_model(name) for name in MODEL_FILES}
+    if os.path.exists(model_path(MULTI_OUTPUT_FILE)):
+        forests[MULTI_OUTPUT_NAME] = load_model(MULTI_OUTPUT_FILE)
+    if args.command == "export":
+        metas = export_forests(forests, args.output)
+        for name, meta in metas.items():
+            print(f"{name}: {meta['n_estimators']} trees, {meta['n_nodes']} nodes, depth {meta['max_depth']}")
+        print(f"Wrote {args.output} ({os.path.getsize(args.output) / 1e6:.1f} MB)")
+        return 0
+
+    import joblib
+    import pandas as pd
+
+    X = pd.read_excel(args.data)[required_features].to_numpy(dtype=np.float32)
+    start = time.perf_counter()
+    compiled = load_forests(args.engine)
+    engine_load = time.perf_counter() - start
+    missing = [name for name in forests if name not in compiled]
+    for name in missing:
+        print(f"{name}: not in {args.engine}; re-export the engine to include it")
+        forests.pop(name)
+    report = verify(forests, compiled, X)
+    for name, result in report.items():
+        start = time.perf_counter()
+        joblib.load(model_path(MULTI_OUTPUT_FILE if name == MULTI_OUTPUT_NAME else name))
+        pickle_load = time.perf_counter() - start
+        sk_ms = _time_single_row(forests[name].predict, X[:1])
+        engine_ms = _time_single_row(compiled[name].predict, X[:1])
+        print(f"{name}: {json.dumps(result)}")
+        print(f"    single row: sklearn {sk_ms:.2f} ms, engine {engine_ms:.2f} ms; "
+              f"pickle load {pickle_load:.2f}s, engine arrays {compiled[name].nbytes / 1e6:.1f} MB")
+    print(f"Engine load (all models, memory-mapped): {engine_load * 1000:.1f} ms")
+    # Only the optional multi-output model may be absent from the engine
+    return 0 if all(r["ok"] for r in report.values()) and set(missing) <= {MULTI_OUTPUT_NAME} else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""Parallel, resumable hyperparameter search with successive halving.
+
+For every (algorithm x target) of the notebook's bake-off, `--candidates`
+configurations are sampled from the algorithm's search space and raced with
+successive halving: every candidate is first fit on a small share of the
+training rows, only the best 1/eta go on to eta times as many rows, and so on
+until the last rung uses all of them. Each trial is scored with k-fold cross
+validation on the notebook's 80% training split (the 20% test split is never
+touched), so the results stay comparable with train.py.
+
+- The feature matrix comes from the data_cache (memory-mapped, shared by the
+  worker processes) and the folds are written once to `<run-dir>/folds.npz`,
+  so every trial and every resumed run uses the same rows.
+- Trials of one rung run across a process pool with the same CPU budget
+  split as train.py. Each finished trial is saved as JSON under
+  `<run-dir>/trials/`; re-running with the same `--run-dir` only runs the
+  missing ones.
+- The leaderboard lists the final-rung trials per target with the CV score,
+  fit time and inference latency (one row, and per row in a batch), and
+  `--max-latency-ms` picks the best model that is fast enough.
+
+Usage:
+    python tune.py --run-dir runs/tune --cpus 8 --candidates 27 --eta 3
+    python tune.py --algorithms extra_trees lightgbm --targets reg_temp --max-latency-ms 5
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from data_cache import DEFAULT_SOURCE, load_dataset
+from train import ALGORITHMS, RANDOM_STATE, TARGETS, balanced_weights, build_targets, evaluate, is_available, \
+    make_estimator, split_indices
+
+DEFAULT_CANDIDATES = 27
+DEFAULT_ETA = 3
+DEFAULT_FOLDS = 3
+MIN_ROWS = 200
+
+# Values tried per hyperparameter; candidates are sampled from their product
+SEARCH_SPACES = {
+    "extra_trees": {
+        "n_estimators": [50, 100, 200, 400],
+        "max_depth": [None, 12, 20, 30],
+        "min_samples_leaf": [1, 2, 4, 8],
+        "max_features": ["sqrt", 0.5, 1.0],
+    },
+    "random_forest": {
+        "n_estimators": [50, 100, 200, 400],
+        "max_depth": [None, 12, 20, 30],
+        "min_samples_leaf": [1, 2, 4, 8],
+        "max_features": ["sqrt", 0.5, 1.0],
+    },
+    "xgboost": {
+        "n_estimators": [100, 200, 400],
+        "max_depth": [3, 6, 9],
+        "learning_rate": [0.03, 0.1, 0.3],
+        "subsample": [0.7, 1.0],
+        "colsample_bytree": [0.7, 1.0],
+    },
+    "lightgbm": {
+        "n_estimators": [100, 200, 400],
+        "num_leaves": [15, 31, 63, 127],
+        "learning_rate": [0.03, 0.1, 0.3],
+        "min_child_samples": [5, 20, 50],
+    },
+    "svm": {
+        "C": [0.1, 1.0, 10.0, 100.0],
+        "gamma": ["scale", 0.01, 0.1, 1.0],
+        "epsilon": [0.01, 0.1, 0.5],  # regression only
+    },
+}
+
+
+def sample_candidates(algorithm, target, n, seed=RANDOM_STATE):
+    """Return up to n distinct configurations of the algorithm's search space (same ones on every run)."""
+    space = dict(SEARCH_SPACES[algorithm])
+    if algorithm == "svm" and TARGETS[target][0] == "classification":
+        space.pop("epsilon")
+    names = sorted(space)
+    grid = list(itertools.product(*(space[name] for name in names)))
+    rng = np.random.default_rng([seed, ALGORITHMS.index(algorithm), list(TARGETS).index(target)])
+    picked = rng.choice(len(grid), size=min(n, len(grid)), replace=False)
+    return [dict(zip(names, grid[i])) for i in sorted(picked)]
+
+
+def trial_id(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:10]
+
+
+def rung_rows(n_train, candidates, eta, min_rows=MIN_ROWS):
+    """Training rows per rung: each rung has eta times the rows of the previous one, the last has all."""
+    rungs = max(1, int(math.floor(math.log(max(candidates, 1), eta) + 1e-9)) + 1)
+    return [max(min(min_rows, n_train), int(n_train / eta ** (rungs - 1 - r))) for r in range(rungs)]
+
+
+def make_folds(run_dir, dataset, k):
+    """Write (or reuse) the k folds of the training split; each fold's training rows are shuffled
+    once, so the first n of them are a random subset for the early rungs."""
+    from sklearn.model_selection import KFold
+
+    path = os.path.join(run_dir, "folds.npz")
+    if os.path.exists(path):
+        with np.load(path) as folds:
+            if str(folds["sha256"]) != dataset.meta["sha256"] or int(folds["k"]) != k:
+                raise ValueError(f"{run_dir} was created for other data or another --folds; use a new --run-dir")
+        return path
+    train_idx, _ = split_indices(len(dataset))
+    rng = np.random.default_rng(RANDOM_STATE)
+    arrays = {"sha256": np.array(dataset.meta["sha256"]), "k": np.array(k)}
+    for i, (fit, valid) in enumerate(KFold(k, shuffle=True, random_state=RANDOM_STATE).split(train_idx)):
+        arrays[f"train_{i}"] = rng.permutation(train_idx[fit])
+        arrays[f"valid_{i}"] = np.sort(train_idx[valid])
+    np.savez(f"{path}.tmp.npz", **arrays)
+    os.replace(f"{path}.tmp.npz", path)
+    return path
+
+
+def trial_path(run_dir, algorithm, target, params, rows):
+    return os.path.join(run_dir, "trials", f"{algorithm}__{target}__{trial_id(params)}__{rows}.json")
+
+
+def _with_params(estimator, params):
+    if hasattr(estimator, "steps"):  # SVM pipelines: the parameters belong to the last step
+        step = estimator.steps[-1][0]
+        params = {f"{step}__{name}": value for name, value in params.items()}
+    return estimator.set_params(**params)
+
+
+def run_trial(data_path, run_dir, algorithm, target, params, rows, n_jobs):
+    """Cross-validate one configuration on `rows` training rows per fold and save the record; runs in a worker."""
+    from tree_engine import _time_single_row
+
+    dataset = load_dataset(data_path)
+    X = dataset.X
+    y = build_targets(dataset)[target]
+    kind = TARGETS[target][0]
+    scores = []
+    fit_seconds = 0.0
+    with np.load(os.path.join(run_dir, "folds.npz")) as folds:
+        k = int(folds["k"])
+        splits = [(folds[f"train_{i}"][:rows], folds[f"valid_{i}"]) for i in range(k)]
+    for fit_rows, valid_rows in splits:
+        class_weight = balanced_weights(y[fit_rows]) if kind == "classification" else None
+        estimator = _with_params(make_estimator(algorithm, kind, class_weight, n_jobs), params)
+        fit_kwargs = {}
+        if algorithm == "xgboost" and class_weight is not None:
+            fit_kwargs["sample_weight"] = np.array([class_weight[c] for c in y[fit_rows]])
+        start = time.perf_counter()
+        estimator.fit(X[fit_rows], y[fit_rows], **fit_kwargs)
+        fit_seconds += time.perf_counter() - start
+        scores.append(evaluate(target, y[valid_rows], estimator.predict(X[valid_rows])))
+
+    # Latency of the last fold's model: one row (the app and /predict) and a batch (batch.py)
+    X_valid = np.ascontiguousarray(X[splits[-1][1]])
+    start = time.perf_counter()
+    estimator.predict(X_valid)
+    batch_seconds = time.perf_counter() - start
+    metric = "mse" if "mse" in scores[0] else "accuracy"
+    value = float(np.mean([s[metric] for s in scores]))
+    record = {
+        "algorithm": algorithm, "target": target, "params": params, "rows": rows, "folds": k,
+        metric: value, "score": -value if metric == "mse" else value,
+        "fit_seconds": fit_seconds / k,
+        "predict_1_ms": _time_single_row(estimator.predict, X_valid[:1], repeat=20),
+        "predict_row_us": batch_seconds / len(X_valid) * 1e6,
+    }
+    path = trial_path(run_dir, algorithm, target, params, rows)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(record, f, indent=2)
+    os.replace(f"{path}.tmp", path)  # its presence marks the trial as finished
+    return record
+
+
+def load_trial(run_dir, algorithm, target, params, rows):
+    path = trial_path(run_dir, algorithm, target, params, rows)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def run_rung(args, jobs, rows, workers, n_jobs):
+    """Run the unfinished (algorithm, target, params) jobs on `rows` rows; return every finished record."""
+    records = {}
+    pending = []
+    for algorithm, target, params in jobs:
+        record = load_trial(args.run_dir, algorithm, target, params, rows)
+        if record is None:
+            pending.append((algorithm, target, params))
+        else:
+            records[(algorithm, target, trial_id(params))] = record
+    if records:
+        print(f"  {len(records)} of {len(jobs)} trials already done")
+    if not pending:
+        return records
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(pending)))) as pool:
+        futures = {pool.submit(run_trial, args.data, args.run_dir, a, t, p, rows, n_jobs): (a, t, p)
+                   for a, t, p in pending}
+        for future in as_completed(futures):
+            algorithm, target, params = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                print(f"  {algorithm} / {target} {params} failed: {e}")
+                continue
+            records[(algorithm, target, trial_id(params))] = record
+            metric = "mse" if "mse" in record else "accuracy"
+            print(f"  {algorithm:14s} {target:9s} {metric} {record[metric]:.4f}  ({record['fit_seconds']:.1f}s fit) {params}")
+    return records
+
+
+def successive_halving(args, searches, n_train, workers, n_jobs):
+    """Race every search's candidates rung by rung; return the records of the last rung each reached."""
+    schedules = {key: rung_rows(n_train, len(candidates), args.eta, args.min_rows) for key, candidates in searches.items()}
+    survivors = dict(searches)
+    final = {}
+    for rung in range(max(len(s) for s in schedules.values())):
+        by_rows = {}
+        for key, candidates in survivors.items():
+            if rung < len(schedules[key]):
+                by_rows.setdefault(schedules[key][rung], []).extend((*key, params) for params in candidates)
+        for rows, jobs in sorted(by_rows.items()):
+            print(f"Rung {rung + 1}: {len(jobs)} trials on {rows} rows x {args.folds} folds")
+            records = run_rung(args, jobs, rows, workers, n_jobs)
+            for key in {(a, t) for a, t, _ in jobs}:
+                ranked = sorted((r for (a, t, _), r in records.items() if (a, t) == key),
+                                key=lambda r: r["score"], reverse=True)
+                final[key] = ranked
+                last = rung == len(schedules[key]) - 1
+                survivors[key] = [r["params"] for r in ranked[:1 if last else max(1, len(ranked) // args.eta)]]
+    return final
+
+
+def leaderboard(final, max_latency_ms=None):
+    """Return target -> final-rung records sorted by score, each flagged if within the latency budget."""
+    board = {}
+    for (algorithm, target), records in final.items():
+        board.setdefault(target, []).extend(records)
+    for target, records in board.items():
+        records.sort(key=lambda r: r["score"], reverse=True)
+        for record in records:
+            record["fast_enough"] = max_latency_ms is None or record["predict_1_ms"] <= max_latency_ms
+    return board
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune every notebook model with successive halving in parallel.")
+    parser.add_argument("--data", default=DEFAULT_SOURCE, help="xlsx or csv training file")
+    parser.add_argument("--run-dir", default=os.path.join("runs", "tune"), help="trial folder (reuse it to resume)")
+    parser.add_argument("--algorithms", nargs="+", default=ALGORITHMS, choices=ALGORITHMS)
+    parser.add_argument("--targets", nargs="+", default=list(TARGETS), choices=list(TARGETS))
+    parser.add_argument("--candidates", type=int, default=DEFAULT_CANDIDATES, help="configurations per search")
+    parser.add_argument("--eta", type=int, default=DEFAULT_ETA, help="keep the best 1/eta per rung")
+    parser.add_argument("--folds", type=int, default=DEFAULT_FOLDS, help="cross-validation folds")
+    parser.add_argument("--min-rows", type=int, default=MIN_ROWS, help="fewest training rows of the first rung")
+    parser.add_argument("--cpus", type=int, default=os.cpu_count() or 1, help="total CPU budget")
+    parser.add_argument("--workers", type=int, default=None, help="parallel trials (default: cpus)")
+    parser.add_argument("--max-latency-ms", type=float, default=None, help="single-row latency budget for the pick")
+    args = parser.parse_args(argv)
+    if args.eta < 2:
+        parser.error("--eta must be at least 2")
+
+    os.makedirs(os.path.join(args.run_dir, "trials"), exist_ok=True)
+    algorithms = [a for a in args.algorithms if is_available(a)]
+    for skipped in sorted(set(args.algorithms) - set(algorithms)):
+        print(f"Skipping {skipped}: package not installed")
+    try:
+        dataset = load_dataset(args.data)  # build the cache once, before the workers start
+        make_folds(args.run_dir, dataset, args.folds)
+    except (OSError, ValueError) as e:
+        print(f"Tuning failed: {e}", file=sys.stderr)
+        return 1
+    n_train = len(split_indices(len(dataset))[0]) * (args.folds - 1) // args.folds
+    searches = {(a, t): sample_candidates(a, t, args.candidates) for a in algorithms for t in args.targets}
+    workers = max(1, min(args.workers or args.cpus, args.cpus))
+    n_jobs = max(1, args.cpus // workers)
+
+    final = successive_halving(args, searches, n_train, workers, n_jobs)
+    board = leaderboard(final, args.max_latency_ms)
+    with open(os.path.join(args.run_dir, "leaderboard.json"), "w") as f:
+        json.dump(board, f, indent=2)
+    for target in args.targets:
+        records = board.get(target, [])
+        print(f"\n{target}")
+        print(f"  {'algorithm':14s} {'mse / acc':>10s} {'fit s':>8s} {'1 row ms':>9s} {'us/row':>8s}  params")
+        for r in records:
+            metric = "mse" if "mse" in r else "accuracy"
+            flag = "" if r["fast_enough"] else "  (too slow)"
+            print(f"  {r['algorithm']:14s} {r[metric]:10.4f} {r['fit_seconds']:8.2f} {r['predict_1_ms']:9.2f} "
+                  f"{r['predict_row_us']:8.1f}  {json.dumps(r['params'])}{flag}")
+        pick = next((r for r in records if r["fast_enough"]), None)
+        if pick:
+            print(f"  Best{' within the latency budget' if args.max_latency_ms else ''}: {pick['algorithm']} {json.dumps(pick['params'])}")
+    print(f"\nLeaderboard written to {os.path.join(args.run_dir, 'leaderboard.json')}")
+    return 0 if all(board.get(t) for t in args.targets) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())